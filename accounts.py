@@ -0,0 +1,338 @@
+# accounts.py
+# Multi-mailbox serving: one inference host shared by a team.
+# - Requests name their mailbox with the X-Account header or ?account= ("default" = legacy token.json)
+# - Any other account must present its API key (Authorization: Bearer <key>) and have a stored
+#   Gmail token; keys are issued by `python gmail_service.py --auth <account>` (SHA-256 kept only)
+# - "default" is open to localhost only, and needs its key too once any key has been issued
+#   (`python gmail_service.py --new-key default`), so a shared host never serves the owner's mail
+# - Local state (mail store, vector index) is kept per account under ACCOUNTS_DIR/<account>/
+# - Model / LLM capacity is shared with weighted fair queuing, so a heavy mailbox cannot starve the rest
+# - Per-account usage, queue wait and run latency are recorded for /api/accounts
+
+import os
+import re
+import json
+import asyncio
+import time
+import heapq
+import hashlib
+import hmac
+import secrets
+import itertools
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Optional
+
+from eval_history import percentile
+
+DEFAULT_ACCOUNT = "default"
+ACCOUNTS_DIR = os.getenv("ACCOUNTS_DIR", "accounts")
+ACCOUNT_KEYS_FILE = os.getenv("ACCOUNT_KEYS_FILE", "account_keys.json")
+LATENCY_WINDOW = 500     # recent samples kept per account and task
+
+_ACCOUNT_RE = re.compile(r"^[A-Za-z0-9._@+-]{1,64}$")
+
+
+def normalize_account(raw: Optional[str]) -> str:
+    """Account id from a header / query value; raises ValueError for unusable ids"""
+    account = (raw or "").strip() or DEFAULT_ACCOUNT
+    if not _ACCOUNT_RE.match(account) or account in (".", ".."):
+        raise ValueError(f"invalid account id: {account!r}")
+    return account
+
+
+def _digest(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class AccountKeys:
+    """
+    API key -> account mapping, stored as {sha256(key): account} in ACCOUNT_KEYS_FILE.
+    The file is re-read when it changes, so a newly issued key works without a restart.
+    """
+
+    def __init__(self, path: str = ACCOUNT_KEYS_FILE):
+        self.path = path
+        self._keys: Dict[str, str] = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            self._keys, self._mtime = {}, None
+            return
+        if mtime != self._mtime:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._keys = json.load(f)
+            self._mtime = mtime
+
+    @property
+    def enabled(self) -> bool:
+        """Keys have been issued: every account, "default" included, must present one"""
+        with self._lock:
+            self._reload()
+            return bool(self._keys)
+
+    def account_for(self, key: Optional[str]) -> Optional[str]:
+        if not key:
+            return None
+        digest = _digest(key)
+        with self._lock:
+            self._reload()
+            for stored, account in self._keys.items():
+                if hmac.compare_digest(stored, digest):
+                    return account
+        return None
+
+    def issue(self, account: str) -> str:
+        """New key for account (replaces its previous keys); only the digest is stored"""
+        account = normalize_account(account)
+        key = secrets.token_urlsafe(32)
+        with self._lock:
+            self._reload()
+            keys = {d: a for d, a in self._keys.items() if a != account}
+            keys[_digest(key)] = account
+            tmp = self.path + ".tmp"
+            with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as f:
+                json.dump(keys, f, indent=2)
+            os.replace(tmp, self.path)
+            self._keys, self._mtime = keys, None
+        return key
+
+
+def is_loopback(remote: Optional[str]) -> bool:
+    return bool(remote) and (remote.startswith("127.") or remote in ("::1", "localhost"))
+
+
+def authorize_request(raw: Optional[str], api_key: Optional[str], keys: AccountKeys,
+                      is_registered: Callable[[str], bool], remote: Optional[str] = None) -> str:
+    """
+    Account for a request. "default" (the local single-mailbox setup) needs no key while no
+    keys are issued and the client is on this machine (remote: its address); any other
+    account needs a matching API key and a stored Gmail token (is_registered).
+    Raises ValueError for a malformed id, PermissionError when not authorised.
+    Nothing is created for an account before this succeeds.
+    """
+    keyed = keys.account_for(api_key)
+    account = normalize_account(raw or keyed)
+    if keyed == account == DEFAULT_ACCOUNT:
+        return account
+    if account == DEFAULT_ACCOUNT:
+        if keys.enabled:
+            raise PermissionError("missing or invalid API key for account 'default'")
+        if not is_loopback(remote):
+            raise PermissionError("the default mailbox is served without a key to localhost only "
+                                  "(issue one: python gmail_service.py --new-key default)")
+        return account
+    if keyed != account:
+        raise PermissionError(f"missing or invalid API key for account {account!r}")
+    if not is_registered(account):
+        raise PermissionError(f"account {account!r} has no stored Gmail token")
+    return account
+
+
+def bearer_key(authorization: Optional[str]) -> Optional[str]:
+    scheme, _, token = (authorization or "").partition(" ")
+    return token.strip() or None if scheme.lower() == "bearer" else None
+
+
+def account_dir(account: str) -> str:
+    path = os.path.join(ACCOUNTS_DIR, account)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """'alice=2,bob=0.5' -> {'alice': 2.0, 'bob': 0.5}; unknown accounts weigh 1"""
+    out = {}
+    for part in filter(None, (spec or "").split(",")):
+        k, _, v = part.partition("=")
+        try:
+            out[k.strip()] = max(0.01, float(v))
+        except ValueError:
+            print(f"[accounts] ignoring bad weight: {part!r}")
+    return out
+
+
+class AccountResources:
+    """Lazily created per-account objects (factory(account) is called once per account)"""
+
+    def __init__(self, factory: Callable[[str], Any]):
+        self.factory = factory
+        self._items: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self, account: str) -> Any:
+        item = self._items.get(account)
+        if item is None:
+            with self._lock:
+                item = self._items.get(account)
+                if item is None:
+                    item = self._items[account] = self.factory(account)
+        return item
+
+
+class _Waiter:
+    __slots__ = ("start", "seq", "account", "wake", "granted")
+
+    def __init__(self, start: float, seq: int, account: str, wake: Callable[[], None]):
+        self.start, self.seq, self.account, self.wake = start, seq, account, wake
+        self.granted = False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.start, self.seq) < (other.start, other.seq)
+
+
+class FairScheduler:
+    """
+    Weighted fair queuing over a fixed number of slots (start-time fair queuing).
+    A request is tagged start = max(V, last finish of its account) and its account's
+    finish becomes start + cost / weight; the waiting request with the lowest start
+    tag runs next, and V advances to the start tag of the request entering service.
+    An account that floods the queue only pushes its own tags further out.
+    Threads wait with slot(), coroutines with aslot(); both share the same queue.
+    """
+
+    def __init__(self, name: str, slots: int, weights: Optional[Dict[str, float]] = None):
+        self.name = name
+        self.slots = max(1, slots)
+        self.weights = weights or {}
+        self.free = self.slots
+        self.vtime = 0.0
+        self._finish: Dict[str, float] = {}
+        self._waiting = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _enqueue(self, account: str, cost: float, wake: Callable[[], None]) -> _Waiter:
+        with self._lock:
+            start = max(self.vtime, self._finish.get(account, 0.0))
+            self._finish[account] = start + max(cost, 1.0) / self.weights.get(account, 1.0)
+            w = _Waiter(start, next(self._seq), account, wake)
+            heapq.heappush(self._waiting, w)
+            self._dispatch()
+        return w
+
+    def _dispatch(self):
+        # Called with the lock held: grant free slots to the lowest start tags
+        while self.free > 0 and self._waiting:
+            w = heapq.heappop(self._waiting)
+            w.granted = True
+            self.free -= 1
+            self.vtime = max(self.vtime, w.start)
+            w.wake()
+
+    def _release(self):
+        with self._lock:
+            self.free += 1
+            self._dispatch()
+
+    def _abandon(self, w: _Waiter):
+        """A waiter gave up (e.g. the client disconnected): dequeue it or return its slot"""
+        with self._lock:
+            if not w.granted:
+                self._waiting.remove(w)
+                heapq.heapify(self._waiting)
+                return
+        self._release()
+
+    @contextmanager
+    def slot(self, account: str, cost: float = 1.0, timeout: Optional[float] = None):
+        """
+        Block until this request is granted a slot; yields the queue wait in ms.
+        With a timeout (s), gives up its place and raises TimeoutError if not granted in time.
+        """
+        t0 = time.perf_counter()
+        ready = threading.Event()
+        w = self._enqueue(account, cost, ready.set)
+        if not ready.wait(timeout):
+            self._abandon(w)
+            raise TimeoutError(f"{self.name} queue: no slot within {timeout:.1f}s")
+        try:
+            yield (time.perf_counter() - t0) * 1000
+        finally:
+            self._release()
+
+    async def acquire(self, account: str, cost: float = 1.0) -> float:
+        """
+        Wait for a slot without holding a thread; returns the queue wait in ms.
+        The caller owns the slot and must call release() exactly once (see aslot()).
+        Cancelled while waiting, the request leaves the queue.
+        """
+        t0 = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: ready.done() or ready.set_result(None))
+
+        w = self._enqueue(account, cost, wake)
+        try:
+            await ready
+        except BaseException:
+            self._abandon(w)
+            raise
+        return (time.perf_counter() - t0) * 1000
+
+    def release(self):
+        self._release()
+
+    @asynccontextmanager
+    async def aslot(self, account: str, cost: float = 1.0):
+        """slot() for coroutines: waiting holds no thread"""
+        wait_ms = await self.acquire(account, cost)
+        try:
+            yield wait_ms
+        finally:
+            self._release()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            queued: Dict[str, int] = {}
+            for w in self._waiting:
+                queued[w.account] = queued.get(w.account, 0) + 1
+            return {"slots": self.slots, "busy": self.slots - self.free, "queued": queued}
+
+
+class _Usage:
+    __slots__ = ("count", "errors", "tokens", "wait_ms", "run_ms", "last")
+
+    def __init__(self):
+        self.count = self.errors = self.tokens = 0
+        self.wait_ms = deque(maxlen=LATENCY_WINDOW)
+        self.run_ms = deque(maxlen=LATENCY_WINDOW)
+        self.last = 0.0
+
+
+class AccountMetrics:
+    """Per account / task: calls, errors, input tokens, queue wait and run latency"""
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, _Usage]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, account: str, task: str, wait_ms: float, run_ms: float, tokens: int, ok: bool):
+        with self._lock:
+            u = self._data.setdefault(account, {}).setdefault(task, _Usage())
+            u.count += 1
+            u.errors += 0 if ok else 1
+            u.tokens += tokens
+            u.wait_ms.append(wait_ms)
+            u.run_ms.append(run_ms)
+            u.last = time.time()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {account: {task: {
+                "count": u.count,
+                "errors": u.errors,
+                "tokens": u.tokens,
+                "wait_ms_p50": round(percentile(list(u.wait_ms), 0.5), 1),
+                "wait_ms_p95": round(percentile(list(u.wait_ms), 0.95), 1),
+                "run_ms_p50": round(percentile(list(u.run_ms), 0.5), 1),
+                "run_ms_p95": round(percentile(list(u.run_ms), 0.95), 1),
+                "last_used": round(u.last, 3),
+            } for task, u in tasks.items()} for account, tasks in self._data.items()}
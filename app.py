@@ -3,12 +3,16 @@ import sys
 sys.dont_write_bytecode = True
 
 import re
+import gzip
+import json
 import time
-import shlex
-import subprocess
-from typing import List
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import nullcontext
+from typing import List, Optional
 
-from flask import Flask, request, jsonify, Response, stream_with_context
+import ollama
+from flask import Flask, request, jsonify, Response, stream_with_context, g, has_request_context
 from transformers import pipeline
 
 # Use Built-in Signature Remover
@@ -17,6 +21,19 @@ try:
 except Exception:
     def remove_signature(x: str) -> str:
         return (x or "").strip()
+
+from extractive import compress_to_budget
+from thread_dedup import thread_deduper
+from cost_model import cost_model, count_tokens, BACKEND_ORDER
+from near_dup import NearDupIndex
+from vector_index import SentenceEncoder, VectorIndex
+from mail_store import MailStore
+from translate_pipeline import SegmentCache, assemble, split_segments, translate_segments
+from model_registry import ModelRegistry
+from lang_router import route_languages
+from llm_profiles import GenerationRun, LLMTokenStats, LANG_BUDGET, LLM_PROFILES, parse_ollama_opts
+from accounts import (DEFAULT_ACCOUNT, AccountKeys, AccountMetrics, AccountResources, FairScheduler,
+                      account_dir, authorize_request, bearer_key, parse_weights)
     
 # --- SPEED OPTIONS (add near the top of app.py) ---
 import os
@@ -45,9 +62,11 @@ else:
 
 # Ollama Settings: Smaller Model + Shorter Output + Lower Temperature
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma3:4b")  # Replace with smaller installed model if needed (e.g., llama3.2:3b, qwen2:1.5b)
-OLLAMA_OPTS  = os.getenv("OLLAMA_OPTS",
-                         "-o num_predict=120 -o temperature=0.2 -o top_p=0.9 -o num_thread=4 -o stop=Reply:")
-# num_predict: Lower max generated tokens  / num_thread: Match CPU cores
+OLLAMA_OPTS  = os.getenv("OLLAMA_OPTS", "-o top_p=0.9 -o num_thread=4")
+# num_thread: Match CPU cores. Output length, temperature and stops come from the per-task
+# profiles in llm_profiles.py; a num_predict here caps every task, extra stops are added
+OLLAMA_BASE_OPTIONS = parse_ollama_opts(OLLAMA_OPTS)
+OLLAMA_TIMEOUT_S = float(os.getenv("OLLAMA_TIMEOUT_S", "300"))
 
 app = Flask(__name__)
 
@@ -57,24 +76,129 @@ app = Flask(__name__)
 EN_SUM_MODEL = "philschmid/bart-large-cnn-samsum"          # English Conversation/Email Summarisation
 KO_SUM_MODEL = "csebuetnlp/mT5_multilingual_XLSum"         # Multilingual Summarization (including ko)
 
+SENTIMENT_MODEL = "cardiffnlp/twitter-xlm-roberta-base-sentiment"
+
+# Model lifecycle: load on first use, unload LRU/idle models to stay within the budget
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "6144"))
+MODEL_IDLE_UNLOAD_S = float(os.getenv("MODEL_IDLE_UNLOAD_S", "900"))     # 0 = never unload idle models
+MODEL_DTYPE = os.getenv("MODEL_DTYPE", "fp32").lower()                   # fp32 | bf16 (CPU reduced precision)
+
 def _load_pipe(task, model):
+    kwargs = {}
+    if MODEL_DTYPE == "bf16" and _torch_ok:
+        kwargs["torch_dtype"] = torch.bfloat16
     try:
-        p = pipeline(task, model=model)
-        print(f"[load] {task} <- {model}")
+        p = pipeline(task, model=model, **kwargs)
+        print(f"[load] {task} <- {model} ({MODEL_DTYPE})")
         return p
     except Exception as e:
         print(f"[load] FAILED: {task} <- {model} :: {e}")
         return None
 
-en_summarizer = _load_pipe("summarization", EN_SUM_MODEL)
-ko_summarizer = _load_pipe("summarization", KO_SUM_MODEL)
+model_registry = ModelRegistry(MODEL_MEMORY_BUDGET_MB, MODEL_IDLE_UNLOAD_S)
+# est_mb: fp32 sizes, used to make room before the first load (measured afterwards)
+model_registry.register("en_sum", lambda: _load_pipe("summarization", EN_SUM_MODEL), est_mb=1600)
+model_registry.register("ko_sum", lambda: _load_pipe("summarization", KO_SUM_MODEL), est_mb=2300)
+model_registry.register("sentiment", lambda: _load_pipe("sentiment-analysis", SENTIMENT_MODEL), est_mb=1100)
 
 # ----------------------------
-# Summarization helpers
+# Decoding profiles (seq2seq summarisers)
 # ----------------------------
-def _is_korean(text: str) -> bool:
-    return bool(re.search(r"[가-힣]", text or ""))
+# num_beams: 1 = greedy; ratio: output length cap as a share of the chunk's input tokens
+# assisted: greedy decoding verified against a small draft model (same tokenizer family)
+DECODE_PROFILES = {
+    "greedy":   {"num_beams": 1, "ratio": 0.30},
+    "beam2":    {"num_beams": 2, "ratio": 0.35},
+    "beam4":    {"num_beams": 4, "ratio": 0.40},
+    "assisted": {"num_beams": 1, "ratio": 0.30, "assisted": True},
+}
+MODE_DECODE = {
+    "fast":   os.getenv("DECODE_FAST", "greedy"),
+    "hybrid": os.getenv("DECODE_HYBRID", "beam2"),
+    "llm":    os.getenv("DECODE_LLM", "beam4"),
+}
+for _mode, _name in MODE_DECODE.items():
+    if _name not in DECODE_PROFILES:
+        print(f"[decode] DECODE_{_mode.upper()}={_name!r} is not one of {', '.join(DECODE_PROFILES)}; using beam2")
+        MODE_DECODE[_mode] = "beam2"
+# Draft models for assisted decoding ("" = none; the profile then falls back to greedy)
+DRAFT_EN_MODEL = os.getenv("DRAFT_EN_MODEL", "philschmid/distilbart-cnn-12-6-samsum")
+DRAFT_KO_MODEL = os.getenv("DRAFT_KO_MODEL", "")
+if DRAFT_EN_MODEL:
+    model_registry.register("en_draft", lambda: _load_pipe("summarization", DRAFT_EN_MODEL), est_mb=1200)
+if DRAFT_KO_MODEL:
+    model_registry.register("ko_draft", lambda: _load_pipe("summarization", DRAFT_KO_MODEL), est_mb=1200)
 
+# ----------------------------
+# Accounts: one host serves several mailboxes
+# ----------------------------
+# Model / LLM capacity is shared with weighted fair queuing (ACCOUNT_WEIGHTS="alice=2,bob=1")
+ACCOUNT_WEIGHTS = parse_weights(os.getenv("ACCOUNT_WEIGHTS", ""))
+llm_queue = FairScheduler("llm", int(os.getenv("LLM_SLOTS", "2")), ACCOUNT_WEIGHTS)       # match OLLAMA_NUM_PARALLEL
+model_queue = FairScheduler("model", int(os.getenv("MODEL_SLOTS", "2")), ACCOUNT_WEIGHTS)
+account_metrics = AccountMetrics()
+account_keys = AccountKeys()
+
+def account_registered(account: str) -> bool:
+    """An account is served only once its Gmail token is stored (gmail_service.py --auth)"""
+    from gmail_service import token_path
+    return os.path.exists(token_path(account))
+
+def resolve_account(raw: Optional[str], authorization: Optional[str], remote: Optional[str] = None) -> str:
+    """Shared by both serving paths: ValueError -> 400, PermissionError -> 403"""
+    return authorize_request(raw, bearer_key(authorization), account_keys, account_registered, remote)
+
+@app.before_request
+def _resolve_account():
+    try:
+        g.account = resolve_account(request.headers.get("X-Account") or request.args.get("account"),
+                                    request.headers.get("Authorization"), request.remote_addr)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 403
+
+def _scheduled(account: str, task: str, queue: FairScheduler, fn, text: str = "",
+               timeout: Optional[float] = None):
+    """
+    Run fn() in a fair-queued slot, charged by input size. Returns (result, run_ms);
+    run_ms excludes the queue wait so the cost model only sees execution time.
+    timeout: max queue wait in seconds (TimeoutError if no slot was granted in time).
+    """
+    tokens = count_tokens(text)
+    with queue.slot(account, cost=tokens, timeout=timeout) as wait_ms:
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            out = fn()
+            ok = not (isinstance(out, str) and _is_error_text(out))
+            return out, (time.perf_counter() - t0) * 1000
+        finally:
+            account_metrics.record(account, task, wait_ms, (time.perf_counter() - t0) * 1000, tokens, ok)
+
+def _scheduled_stream(account: str, task: str, queue: FairScheduler, gen, text: str = ""):
+    """Like _scheduled for an SSE generator: the slot is held until the stream ends"""
+    tokens = count_tokens(text)
+    with queue.slot(account, cost=tokens) as wait_ms:
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            yield from gen
+            ok = True
+        finally:
+            account_metrics.record(account, task, wait_ms, (time.perf_counter() - t0) * 1000, tokens, ok)
+
+# Extractive pre-compression: input budget per mode, in model chunks (0 = disabled)
+# fast -> 1 chunk so the abstractive model usually runs a single pass
+PRECOMPRESS_CHUNKS = {
+    "fast":   float(os.getenv("PRECOMPRESS_CHUNKS_FAST", "1")),
+    "hybrid": float(os.getenv("PRECOMPRESS_CHUNKS_HYBRID", "3")),
+    "llm":    float(os.getenv("PRECOMPRESS_CHUNKS_LLM", "0")),
+}
+
+# ----------------------------
+# Summarization helpers
+# ----------------------------
 def _fallback_extractive(text: str, max_sent=2) -> str:
     sents = re.split(r'(?<=[\.\?\!])\s+', (text or "").strip())
     sents = [s.strip() for s in sents if s.strip()]
@@ -104,25 +228,93 @@ def _chunk_by_tokens(text: str, tokenizer, max_tokens: int, overlap: int = 50) -
             break
     return chunks
 
-def _summarize_once(pipe, text: str, *, max_len: int, min_len: int) -> str:
-    out = pipe(text, max_length=max_len, min_length=min_len, do_sample=False, truncation=True)
+def _decode_kwargs(pipe, texts: List[str], profile: dict, draft, *, max_len: int, min_len: int) -> dict:
+    """generate() kwargs: profile beams, output length scaled to the longest input (capped by mode)"""
+    try:
+        in_tokens = max(len(pipe.tokenizer.encode(t, add_special_tokens=False)) for t in texts)
+        scaled = max(min_len + 8, int(in_tokens * profile["ratio"]))
+        max_len = min(max_len, scaled)
+    except Exception:
+        pass
+    kwargs = {"max_length": max_len, "min_length": min(min_len, max_len // 2),
+              "num_beams": profile["num_beams"], "do_sample": False}
+    if profile["num_beams"] > 1:
+        kwargs.update(early_stopping=True, no_repeat_ngram_size=3)
+    if profile.get("assisted") and draft is not None:
+        kwargs["assistant_model"] = draft.model
+    return kwargs
+
+def _summarize_once(pipe, text: str, *, max_len: int, min_len: int,
+                    profile: Optional[dict] = None, draft=None) -> str:
+    kwargs = _decode_kwargs(pipe, [text], profile, draft, max_len=max_len, min_len=min_len) if profile \
+        else {"max_length": max_len, "min_length": min_len, "do_sample": False}
+    out = pipe(text, truncation=True, **kwargs)
     return (out[0]["summary_text"] or "").strip()
 
-def summarize_text(text: str, lang: str = "auto", mode: str = "hybrid") -> str:
+SUM_BATCH_SIZE = int(os.getenv("SUM_BATCH_SIZE", "4"))
+
+def _summarize_batch(pipe, texts: List[str], *, max_len: int, min_len: int,
+                     profile: Optional[dict] = None, draft=None) -> List[str]:
+    """Summarise several chunks in batched forward passes; per-chunk extractive fallback on error"""
+    if not texts:
+        return []
+    profile = profile or DECODE_PROFILES["beam2"]
+    kwargs = _decode_kwargs(pipe, texts, profile, draft, max_len=max_len, min_len=min_len)
+    # Assisted generation only supports batch size 1
+    batch_size = 1 if "assistant_model" in kwargs else SUM_BATCH_SIZE
+    try:
+        outs = pipe(texts, truncation=True, batch_size=batch_size, **kwargs)
+        return [(o[0] if isinstance(o, list) else o)["summary_text"].strip() for o in outs]
+    except Exception as e:
+        print("[summarize] batch failed -> per chunk:", e)
+    out = []
+    for t in texts:
+        try:
+            out.append(_summarize_once(pipe, t, max_len=max_len, min_len=min_len, profile=profile, draft=draft))
+        except Exception:
+            out.append(_fallback_extractive(t, max_sent=1))
+    return out
+
+def _input_budget(mode: str, max_chunk_tokens: int, budget: Optional[int]) -> int:
+    if budget is not None:
+        return max(0, int(budget))
+    chunks = PRECOMPRESS_CHUNKS.get(mode, PRECOMPRESS_CHUNKS["hybrid"])
+    # Small margin: sentence joins can re-tokenise slightly longer than the sum of parts
+    return int(chunks * max_chunk_tokens * 0.95)
+
+def summarize_text(text: str, lang: str = "auto", mode: str = "hybrid",
+                   budget: Optional[int] = None, decode: Optional[str] = None) -> str:
     """
     lang: auto|en|ko
     mode: hybrid|llm|fast  (This value is only a hint for length/speed tuning)
+    budget: input token budget for extractive pre-compression
+            (None = per-mode default from PRECOMPRESS_CHUNKS, 0 = disabled)
+    decode: DECODE_PROFILES name (None = the mode's profile from MODE_DECODE)
     """
     raw = (text or "").strip()
     if not raw:
         return ""
 
-    # Language Detection
-    use_ko = (lang == "ko") or (lang == "auto" and _is_korean(raw))
-    pipe = ko_summarizer if use_ko else en_summarizer
-    if pipe is None:
-        return _fallback_extractive(raw)
-
+    # Language routing: explicit lang uses one model; auto groups paragraphs by script
+    # so only the Korean part (if it is a real share of the mail) goes to mT5
+    groups = [(lang, raw)] if lang in ("en", "ko") else route_languages(raw)
+    profile = DECODE_PROFILES.get(decode or MODE_DECODE.get(mode, "beam2"), DECODE_PROFILES["beam2"])
+    partials = []
+    for group_lang, group_text in groups:
+        use_ko = group_lang == "ko"
+        draft_name = "ko_draft" if use_ko else "en_draft"
+        use_draft = profile.get("assisted") and draft_name in model_registry.names()
+        with model_registry.use("ko_sum" if use_ko else "en_sum") as pipe, \
+                (model_registry.use(draft_name) if use_draft else nullcontext()) as draft:
+            if pipe is None:
+                partials.append(_fallback_extractive(group_text))
+            else:
+                partials.append(_summarize_with_pipe(pipe, group_text, use_ko, mode, budget, profile, draft))
+    # Partial summaries are merged in order of first appearance
+    return " ".join(p for p in partials if p)
+
+def _summarize_with_pipe(pipe, raw: str, use_ko: bool, mode: str, budget: Optional[int],
+                         profile: dict, draft=None) -> str:
     # Input Limits per Model
     default_cap = 512 if use_ko else 1024
     max_in = _safe_model_max(pipe, default_cap)
@@ -146,6 +338,14 @@ def summarize_text(text: str, lang: str = "auto", mode: str = "hybrid") -> str:
         final_min = 18
 
     try:
+        # Extractive pre-compression: cut input to the mode's token budget
+        in_budget = _input_budget(mode, max_chunk_tokens, budget)
+        if in_budget > 0:
+            tok = pipe.tokenizer
+            raw = compress_to_budget(
+                raw, in_budget,
+                count_tokens=lambda s: len(tok.encode(s, add_special_tokens=False)))
+
         # Token Splitting
         chunks = _chunk_by_tokens(raw, pipe.tokenizer, max_chunk_tokens, overlap=50)
         if not chunks:
@@ -153,33 +353,25 @@ def summarize_text(text: str, lang: str = "auto", mode: str = "hybrid") -> str:
 
         # Single summary if only 1 chunk
         if len(chunks) == 1:
-            return _summarize_once(pipe, chunks[0], max_len=final_max, min_len=final_min)
+            return _summarize_once(pipe, chunks[0], max_len=final_max, min_len=final_min,
+                                   profile=profile, draft=draft)
 
-        # Step 1: Summarize Each Chunk
-        part_sums = []
-        for c in chunks:
-            try:
-                s = _summarize_once(pipe, c, max_len=first_pass_max, min_len=first_pass_min)
-            except Exception:
-                s = _fallback_extractive(c, max_sent=1)
-            if s:
-                part_sums.append(s)
+        # Step 1: Summarize Each Chunk (batched)
+        part_sums = [s for s in _summarize_batch(pipe, chunks, max_len=first_pass_max, min_len=first_pass_min,
+                                                 profile=profile, draft=draft) if s]
 
         combined = " ".join(part_sums)
 
         # Step 2: If combined summary is too long, shorten again
         if len(part_sums) > 2 or len(combined) > 1500:
             comb_chunks = _chunk_by_tokens(combined, pipe.tokenizer, max_chunk_tokens, overlap=20)
-            comb_sums = []
-            for cc in comb_chunks:
-                try:
-                    comb_sums.append(_summarize_once(pipe, cc, max_len=first_pass_max, min_len=first_pass_min))
-                except Exception:
-                    comb_sums.append(_fallback_extractive(cc, max_sent=1))
+            comb_sums = _summarize_batch(pipe, comb_chunks, max_len=first_pass_max, min_len=first_pass_min,
+                                         profile=profile, draft=draft)
             combined = " ".join([s for s in comb_sums if s.strip()])
 
         # Final Refinement
-        final = _summarize_once(pipe, combined, max_len=final_max, min_len=final_min)
+        final = _summarize_once(pipe, combined, max_len=final_max, min_len=final_min,
+                                profile=profile, draft=draft)
         return final or _fallback_extractive(raw)
 
     except Exception as e:
@@ -189,12 +381,47 @@ def summarize_text(text: str, lang: str = "auto", mode: str = "hybrid") -> str:
 # ----------------------------
 # Sentiment (multilingual + rules)
 # ----------------------------
-try:
-    sentiment_pipe = pipeline("sentiment-analysis", model="cardiffnlp/twitter-xlm-roberta-base-sentiment")
-    print("[sentiment] xlm-roberta loaded")
-except Exception as e:
-    sentiment_pipe = None
-    print("[sentiment] fallback rules only:", e)
+# Model is leased from model_registry per call; rules are used if it failed to load
+# Long emails: overlapping token windows scored in one batched forward pass
+SENTIMENT_WINDOW_TOKENS = 512
+SENTIMENT_STRIDE = 64                                               # overlap between windows
+SENTIMENT_MAX_WINDOWS = int(os.getenv("SENTIMENT_MAX_WINDOWS", "8"))  # cost cap for very long mail
+SENTIMENT_MAX_CHARS = 50000
+SENTIMENT_AGG = os.getenv("SENTIMENT_AGG", "worst")                 # worst | length_weighted | mean
+
+def _aggregate_windows(probs, lengths, labels: List[str], strategy: str):
+    """probs: (windows, labels) tensor -> one probability row"""
+    if probs.shape[0] == 1:
+        return probs[0]
+    if strategy == "worst":
+        neg = next((i for i, l in enumerate(labels) if "negative" in l), None)
+        if neg is not None:
+            return probs[int(probs[:, neg].argmax())]
+    if strategy in ("worst", "length_weighted"):
+        w = lengths.to(probs.dtype)
+        return (probs * w.unsqueeze(1)).sum(0) / w.sum()
+    return probs.mean(0)
+
+def _window_sentiment(pipe, text: str) -> dict:
+    """Whole-text sentiment: {"label": ..., "score": ...} from batched sliding windows"""
+    tok, model = pipe.tokenizer, pipe.model
+    enc = tok(text[:SENTIMENT_MAX_CHARS], max_length=SENTIMENT_WINDOW_TOKENS, truncation=True,
+              stride=SENTIMENT_STRIDE, return_overflowing_tokens=True, padding=True, return_tensors="pt")
+    enc.pop("overflow_to_sample_mapping", None)
+
+    n = enc["input_ids"].shape[0]
+    if n > SENTIMENT_MAX_WINDOWS:
+        # Evenly spaced windows keep beginning, middle and end in view
+        keep = torch.linspace(0, n - 1, SENTIMENT_MAX_WINDOWS).round().long().unique()
+        enc = {k: v.index_select(0, keep) for k, v in enc.items()}
+
+    with torch.no_grad():
+        logits = model(**{k: v.to(model.device) for k, v in enc.items()}).logits.float()
+    probs = torch.softmax(logits, dim=-1).cpu()
+    labels = [model.config.id2label[i].lower() for i in range(probs.shape[1])]
+    row = _aggregate_windows(probs, enc["attention_mask"].sum(1), labels, SENTIMENT_AGG)
+    best = int(row.argmax())
+    return {"label": labels[best], "score": float(row[best])}
 
 NEG_PATTERNS = [
     r"\bnot (working|able|available)\b",
@@ -215,9 +442,20 @@ def analyze_sentiment(text: str) -> dict:
     if neg_hits >= 2 or ("urgent" in t and ("help" in t or "asap" in t)):
         return {"label": "1 star", "score": 0.95, "mapped_category": "negative"}
 
-    if sentiment_pipe:
+    res = None
+    with model_registry.use("sentiment") as sentiment_pipe:
+        if sentiment_pipe:
+            try:
+                res = _window_sentiment(sentiment_pipe, t)
+            except Exception as e:
+                print("[sentiment] windowed scoring failed -> single pass:", e)
+                try:
+                    res = sentiment_pipe(t[:512])[0]
+                except Exception as e:
+                    print("[sentiment] model error -> rules:", e)
+
+    if res:
         try:
-            res = sentiment_pipe(t[:512])[0]
             raw_label = (res["label"] or "").lower()
             score = float(res["score"])
             mapped = "positive" if "positive" in raw_label else ("negative" if "negative" in raw_label else "neutral")
@@ -247,84 +485,127 @@ ANSI_RE = re.compile(r"\x1B\[[0-?]*[ -/]*[@-~]")
 def _strip_ansi(s: str) -> str:
     return ANSI_RE.sub("", s)
 
-def _ollama_stream(prompt: str):
+# Ollama HTTP API (OLLAMA_HOST is honoured): per-call options, and closing the stream stops generation
+ollama_client = ollama.Client(timeout=OLLAMA_TIMEOUT_S)
+llm_stats = LLMTokenStats()
+
+def _llm_stream(task: str, prompt: str, source: str, timeout: float = OLLAMA_TIMEOUT_S,
+                lang: Optional[str] = None, complete: bool = False):
     """
-    Read Ollama output line/chunk by line and deliver via SSE.
+    Yield generated text for one task (reply / summary / translate).
+    The task profile sets budget / stops / temperature (budget scaled to the output lang);
+    generation is cut off as soon as the output monitor sees the structural end, and token
+    use is recorded in llm_stats.
+    complete: raise RuntimeError if the output hit the token budget (a cut-off translation
+    must not pass as a whole one).
     """
-    cmd = "ollama run gemma3:4b"
-    proc = subprocess.Popen(
-        shlex.split(cmd),
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        encoding="utf-8",
-        bufsize=1,
-    )
+    run = GenerationRun(task, source, OLLAMA_BASE_OPTIONS, lang)
+    deadline = time.perf_counter() + timeout
+    stream = ollama_client.generate(model=OLLAMA_MODEL, prompt=prompt, options=run.options, stream=True)
     try:
-        proc.stdin.write(prompt)
-        proc.stdin.close()
+        for part in stream:
+            text = run.feed(part)
+            if text:
+                yield text
+            if run.done:
+                break
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"LLM {task} exceeded {timeout:.0f}s")
+        if complete and run.truncated:
+            raise RuntimeError(f"{task} output cut off at {run.budget} tokens")
+    finally:
+        stream.close()
+        llm_stats.record(run)
+
+def _llm_generate(task: str, prompt: str, source: str, timeout: float = OLLAMA_TIMEOUT_S,
+                  lang: Optional[str] = None, complete: bool = False) -> str:
+    return "".join(_llm_stream(task, prompt, source, timeout, lang, complete))
+
+def _sse_data(chunk: str) -> str:
+    # Multi-line chunks become multi-line SSE data (the client re-joins them with \n)
+    return "".join(f"data: {line}\n" for line in chunk.split("\n")) + "\n"
 
+def _ollama_stream(prompt: str, source: str = "", lang: str = "en"):
+    """
+    Stream a reply from Ollama and deliver via SSE.
+    """
+    try:
         last_ping = time.time()
-        for line in proc.stdout:
-            chunk = _strip_ansi(line.rstrip("\r\n"))
-            if chunk:
-                yield f"data: {chunk}\n\n"
+        for chunk in _llm_stream("reply", prompt, source, lang=lang):
+            yield _sse_data(chunk)
             # Heartbeat every 3 seconds
             now = time.time()
             if now - last_ping > 3:
                 yield "event: ping\ndata: keepalive\n\n"
                 last_ping = now
-
-        proc.wait(timeout=300)
         yield "event: done\ndata: [DONE]\n\n"
     except Exception as e:
         yield f"event: error\ndata: {str(e)}\n\n"
-    finally:
-        try:
-            proc.kill()
-        except Exception:
-            pass
 
-def generate_reply_with_gemma3(prompt: str, lang: str = "en") -> str:
+# Prompt builders / output cleanup are shared by the sync (Flask) and async (asgi_app) paths
+def reply_prompt(email: str, lang: str = "en") -> str:
     lang_instruction = "Reply in Korean." if lang == "ko" else "Reply in English."
-    refined_prompt = f"""You are an assistant that writes polite, professional email replies.
+    return f"""You are an assistant that writes polite, professional email replies.
 {lang_instruction}
 Based on the following email, write a short relevant reply.
 
 --- EMAIL START ---
-{prompt}
+{email}
 --- EMAIL END ---
 
 Reply:
 """
+
+def clean_reply(out: str) -> str:
+    out = _strip_ansi((out or "").strip())
+    if "Reply:" in out:
+        out = out.split("Reply:", 1)[-1].strip()
+    if out.lower().startswith("please provide"):
+        return "⚠️ The model did not return a valid reply."
+    return out or "⚠️ The model returned an empty response."
+
+def generate_reply_with_gemma3(prompt: str, lang: str = "en") -> str:
+    refined_prompt = reply_prompt(prompt, lang)
     try:
-        cmd = "ollama run gemma3:4b"
-        proc = subprocess.run(
-            shlex.split(cmd),
-            input=refined_prompt,
-            capture_output=True,
-            text=True,
-            encoding="utf-8",
-            timeout=300
-        )
-        if proc.returncode != 0:
-            print(f"[Gemma Error] {proc.stderr}")
-            return "⚠️ Error generating reply. Please try again."
-        out = _strip_ansi((proc.stdout or "").strip())
-        if "Reply:" in out:
-            out = out.split("Reply:", 1)[-1].strip()
-        if out.lower().startswith("please provide"):
-            return "⚠️ The model did not return a valid reply."
-        return out or "⚠️ The model returned an empty response."
-    except subprocess.TimeoutExpired:
+        return clean_reply(_llm_generate("reply", refined_prompt, prompt, lang=lang))
+    except TimeoutError:
         return "⚠️ Reply generation timed out. Please try again."
+    except ollama.ResponseError as e:
+        print(f"[Gemma Error] {e}")
+        return "⚠️ Error generating reply. Please try again."
     except Exception as e:
         return f"⚠️ Unexpected error: {e}"
     
 
 # --- Add: LLM Summarization Function ---
-def summarize_llm_ollama(text: str, max_chars: int = 2000) -> str:
+def summary_prompt(email: str) -> str:
+    return f"""You are a helpful assistant.
+Summarize the following email in the SAME language as the original.
+Be concise but keep key details (dates, deadlines, requests, numbers).
+Write 2–3 sentences.
+
+--- EMAIL START ---
+{email}
+--- EMAIL END ---
+
+Summary:
+"""
+
+def clean_llm_summary(out: str) -> str:
+    out = (out or "").strip()
+
+    # Clean up if the model echoed part of the prompt
+    if "Summary:" in out:
+        out = out.split("Summary:", 1)[-1].strip()
+
+    # Clean up occasional template phrases
+    bad_heads = ("Please provide", "I cannot")
+    if any(out.startswith(h) for h in bad_heads):
+        return "⚠️ The model did not return a valid summary. Try again with clearer input."
+
+    return out or "⚠️ (empty response from model)"
+
+def summarize_llm_ollama(text: str, max_chars: int = 2000, timeout: int = 120) -> str:
     """
     More precise summarization with Ollama local LLM.
     - Input after signature removal and length limit
@@ -335,71 +616,32 @@ def summarize_llm_ollama(text: str, max_chars: int = 2000) -> str:
         return ""
 
     # Cut overly long input for speed/quality stability
-    cleaned = cleaned[:max_chars]
-
-    prompt = f"""You are a helpful assistant.
-Summarize the following email in the SAME language as the original.
-Be concise but keep key details (dates, deadlines, requests, numbers).
-Write 2–3 sentences.
-
---- EMAIL START ---
-{cleaned}
---- EMAIL END ---
-
-Summary:
-"""
+    source = cleaned[:max_chars]
 
     try:
-        cmd = "ollama run gemma3:4b"
-        proc = subprocess.run(
-            shlex.split(cmd),
-            input=prompt,
-            capture_output=True,
-            text=True,
-            encoding="utf-8",
-            timeout=120
-        )
-        if proc.returncode != 0:
-            # Ollama Runtime Error
-            return f"⚠️ LLM error: {proc.stderr.strip() or 'unknown error'}"
-        out = (proc.stdout or "").strip()
-
-        # Clean up if the model echoed part of the prompt
-        if "Summary:" in out:
-            out = out.split("Summary:", 1)[-1].strip()
-
-        # Clean up occasional template phrases
-        bad_heads = ("Please provide", "I cannot")
-        if any(out.startswith(h) for h in bad_heads):
-            return "⚠️ The model did not return a valid summary. Try again with clearer input."
-
-        return out or "⚠️ (empty response from model)"
-    except subprocess.TimeoutExpired:
+        return clean_llm_summary(_llm_generate("summary", summary_prompt(source), source, timeout))
+    except TimeoutError:
         return "⚠️ LLM summarization timed out."
+    except ollama.ResponseError as e:
+        # Ollama Runtime Error
+        return f"⚠️ LLM error: {e.error or 'unknown error'}"
     except Exception as e:
         return f"⚠️ Unexpected error: {e}"
     
 # --- Add: LLM Translation Function ---
-def translate_llm_ollama(text: str, target_lang: str = "en", max_chars: int = 2000) -> str:
-    """
-    Simple translation using Ollama LLM.
-    - target_lang: 'en' or 'ko'
-    - Limit input length for speed/stability
-    - Output translation only (no explanations/notes)
-    """
-    source = (text or "").strip()
-    if not source:
-        return ""
+TRANSLATE_WORKERS = int(os.getenv("TRANSLATE_WORKERS", "2"))  # segments in flight per request
+segment_cache = SegmentCache()
 
-    target_lang = (target_lang or "en").lower()
-    if target_lang not in ("en", "ko"):
-        return "⚠️ target_lang must be 'en' or 'ko'"
+def _translate_pool() -> ThreadPoolExecutor:
+    # Per request, not shared: segments wait in llm_queue as their account, so a 40-segment
+    # mail holds TRANSLATE_WORKERS threads and cannot put other accounts behind all of its segments
+    return ThreadPoolExecutor(max_workers=TRANSLATE_WORKERS, thread_name_prefix="translate")
 
-    source = source[:max_chars]
+def translate_prompt(source: str, target_lang: str) -> str:
     instruction = "Translate into English only. Output ONLY the translation." if target_lang == "en" \
                   else "Translate into Korean only. Output ONLY the translation."
 
-    prompt = f"""{instruction}
+    return f"""{instruction}
 Preserve key details such as names, dates, times, amounts, and URLs. Keep formatting when helpful.
 
 --- TEXT START ---
@@ -407,32 +649,101 @@ Preserve key details such as names, dates, times, amounts, and URLs. Keep format
 --- TEXT END ---
 """
 
+def clean_translation(out: str) -> str:
+    """Strip a preface the model may add; raises RuntimeError on an empty result."""
+    out = (out or "").strip()
+
+    # Attempt to remove unnecessary preface if model adds one
+    bad_heads = ("Translation:", "Result:", "Output:", "Please provide")
+    for h in bad_heads:
+        if out.startswith(h):
+            out = out[len(h):].strip()
+
+    if not out:
+        raise RuntimeError("empty response from model")
+    return out
+
+def _translate_segment(source: str, target_lang: str) -> str:
+    """Translate one segment with Ollama; raises RuntimeError on failure."""
+    prompt = translate_prompt(source, target_lang)
+
     try:
-        cmd = "ollama run gemma3:4b"
-        proc = subprocess.run(
-            shlex.split(cmd),
-            input=prompt,
-            capture_output=True,
-            text=True,
-            encoding="utf-8",
-            timeout=300
-        )
-        if proc.returncode != 0:
-            return f"⚠️ LLM error: {proc.stderr.strip() or 'unknown error'}"
-
-        out = (proc.stdout or "").strip()
-
-        # Attempt to remove unnecessary preface if model adds one
-        bad_heads = ("Translation:", "Result:", "Output:", "Please provide")
-        for h in bad_heads:
-            if out.startswith(h):
-                out = out[len(h):].strip()
-
-        return out or "⚠️ (empty response from model)"
-    except subprocess.TimeoutExpired:
-        return "⚠️ LLM translation timed out."
+        out = _llm_generate("translate", prompt, source, complete=True)
+    except TimeoutError:
+        raise RuntimeError("LLM translation timed out.")
     except Exception as e:
-        return f"⚠️ Unexpected error: {e}"
+        raise RuntimeError(f"LLM error: {e}")
+    return clean_translation(out)
+
+def _account_translate_fn(account: str):
+    """Per-segment Ollama calls go through the fair queue as the requesting account"""
+    def run(seg: str, target_lang: str) -> str:
+        return _scheduled(account, "translate", llm_queue, lambda: _translate_segment(seg, target_lang), seg)[0]
+    return run
+
+def translate_llm_ollama(text: str, target_lang: str = "en", max_chars: Optional[int] = None,
+                         account: str = DEFAULT_ACCOUNT, use_cache: bool = True) -> dict:
+    """
+    Translation using Ollama LLM, segment by segment.
+    - target_lang: 'en' or 'ko'
+    - Long input is split on paragraph/sentence boundaries and translated in parallel
+    - Output translation only (no explanations/notes), original paragraph breaks kept
+    - Returns {"translated", "partial", "failed_segments"}: failed segments keep their source text
+    """
+    source = (text or "").strip()
+    if not source:
+        return {"translated": "", "partial": False, "failed_segments": []}
+
+    target_lang = (target_lang or "en").lower()
+    if target_lang not in ("en", "ko"):
+        return {"translated": "⚠️ target_lang must be 'en' or 'ko'", "partial": False, "failed_segments": []}
+
+    if max_chars:
+        source = source[:max_chars]
+
+    segments = split_segments(source)
+    parts = [""] * len(segments)
+    failed = []
+    pool = _translate_pool()
+    try:
+        for i, out, ok in translate_segments(segments, target_lang, _account_translate_fn(account),
+                                             pool, segment_cache if use_cache else SegmentCache(0)):
+            parts[i] = out
+            if not ok:
+                failed.append(i)
+    except Exception as e:
+        return {"translated": f"⚠️ Unexpected error: {e}", "partial": False, "failed_segments": []}
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return assemble(segments, parts, failed)
+
+def _translate_stream(text: str, target_lang: str, account: str = DEFAULT_ACCOUNT):
+    """SSE: one 'segment' event per finished segment (index + separator), then done."""
+    segments = split_segments(text)
+    yield f"event: meta\ndata: {json.dumps({'segments': len(segments)})}\n\n"
+    pool = _translate_pool()
+    try:
+        for i, out, ok in translate_segments(segments, target_lang, _account_translate_fn(account),
+                                             pool, segment_cache):
+            payload = {"index": i, "text": out, "sep": segments[i][1], "ok": ok}
+            yield f"event: segment\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        yield "event: done\ndata: [DONE]\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {str(e)}\n\n"
+    finally:
+        # Client gone (GeneratorExit) or done: segments not started yet are dropped
+        pool.shutdown(wait=False, cancel_futures=True)
+
+@app.route("/translate_llm_stream", methods=["POST"])
+def translate_llm_stream():
+    data = (request.json or {})
+    text = (data.get("text") or "").strip()
+    target = (data.get("target_lang") or "en").lower()
+    if not text or target not in ("en", "ko"):
+        return Response("event: done\ndata: [DONE]\n\n", mimetype="text/event-stream")
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(_translate_stream(text, target, g.account)),
+                    mimetype="text/event-stream", headers=headers)
 
 # --- Add: Flask Endpoint ---
 @app.route("/translate_llm", methods=["POST"])
@@ -442,8 +753,7 @@ def translate_llm_endpoint():
     target = (data.get("target_lang") or "en").lower()
     if not text:
         return jsonify({"translated": ""})
-    translated = translate_llm_ollama(text, target_lang=target)
-    return jsonify({"translated": translated})
+    return jsonify(translate_llm_ollama(text, target_lang=target, account=g.account, use_cache=_cache_allowed()))
 
 @app.route("/summarize_llm", methods=["POST"])
 def summarize_llm_endpoint():
@@ -451,9 +761,200 @@ def summarize_llm_endpoint():
     text = (data.get("text") or "").strip()
     if not text:
         return jsonify({"summary": ""})
-    summary = summarize_llm_ollama(text)
+    summary, run_ms = _scheduled(g.account, "summary:llm", llm_queue, lambda: summarize_llm_ollama(text), text)
+    if not _is_error_text(summary):
+        cost_model.observe("llm", count_tokens(text), run_ms)
     return jsonify({"summary": summary})
 
+# ----------------------------
+# Deadline-driven summarisation (adaptive path selection)
+# ----------------------------
+EXTRACTIVE_SUMMARY_WORDS = 60
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+summary_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS)
+# Model runs past their deadline cannot be interrupted; while this many are still running,
+# deadline requests only use the extractive path instead of queueing behind them
+MAX_ABANDONED_SUMMARIES = int(os.getenv("MAX_ABANDONED_SUMMARIES", str(SUMMARY_WORKERS)))
+_abandoned = {"running": 0}
+_abandoned_lock = threading.Lock()
+
+def _is_error_text(s: str) -> bool:
+    return not s or s.startswith("⚠️")
+
+def _run_summary_backend(backend: str, text: str, lang: str, deadline: float,
+                         account: str = DEFAULT_ACCOUNT) -> str:
+    """Run one backend; deadline is a time.perf_counter() value (queue wait counts against it)"""
+    tokens = count_tokens(text)
+    if backend == "extractive":
+        t0 = time.perf_counter()
+        out = compress_to_budget(text, EXTRACTIVE_SUMMARY_WORDS)
+        cost_model.observe(backend, tokens, (time.perf_counter() - t0) * 1000)
+        return out
+    loads = model_registry.thread_loads()
+    try:
+        if backend == "llm":
+            # The LLM gets whatever is left once its slot is granted
+            out, run_ms = _scheduled(
+                account, "summary:llm", llm_queue,
+                lambda: summarize_llm_ollama(text, timeout=max(1.0, deadline - time.perf_counter())),
+                text, timeout=max(0.0, deadline - time.perf_counter()))
+        else:
+            out, run_ms = _scheduled(account, f"summary:{backend}", model_queue,
+                                     lambda: summarize_text(text, lang, backend), text,
+                                     timeout=max(0.0, deadline - time.perf_counter()))
+    except TimeoutError:
+        return "⚠️ Deadline passed while queued."
+    if model_registry.thread_loads() != loads:
+        return out    # run_ms includes loading the model: not a latency sample
+    if not _is_error_text(out):
+        cost_model.observe(backend, tokens, run_ms)
+    elif time.perf_counter() >= deadline:
+        # Cut off by the deadline: the real latency is at least run_ms (censored sample),
+        # otherwise the model would only learn from fast successes
+        cost_model.observe_censored(backend, tokens, run_ms)
+    return out
+
+def _abandon_summary(fut):
+    """A deadline expired: drop the job if still queued, else count it until it finishes"""
+    if fut.cancel():
+        return
+    with _abandoned_lock:
+        _abandoned["running"] += 1
+
+    def done(_):
+        with _abandoned_lock:
+            _abandoned["running"] -= 1
+    fut.add_done_callback(done)
+
+def deadline_candidates(paths=None) -> List[str]:
+    """Backends a deadline request may use, best first (extractive is always the last resort)"""
+    order = [b for b in BACKEND_ORDER if not paths or b in paths]
+    with _abandoned_lock:
+        if _abandoned["running"] >= MAX_ABANDONED_SUMMARIES:
+            order = []
+    return order if "extractive" in order else order + ["extractive"]
+
+def summarize_with_deadline(text: str, lang: str, deadline_ms: float, account: str = DEFAULT_ACCOUNT,
+                            paths: Optional[List[str]] = None) -> dict:
+    """
+    Pick the best summariser predicted to finish within deadline_ms.
+    - llm -> hybrid -> fast -> extractive (extractive is effectively free); paths limits the choice
+    - On timeout or error, degrade to the next cheaper path with the remaining budget
+    - Time spent queued behind other accounts counts against the deadline
+    """
+    t0 = time.perf_counter()
+    deadline = t0 + deadline_ms / 1000
+    tokens = count_tokens(text)
+    candidates = deadline_candidates(paths)
+    degraded = []
+    summary, backend, predicted = "", "extractive", 0.0
+
+    while candidates:
+        remaining_ms = (deadline - time.perf_counter()) * 1000
+        backend, predicted = cost_model.choose(tokens, remaining_ms, candidates)
+        if backend == "extractive":
+            summary = _run_summary_backend(backend, text, lang, deadline)
+            break
+
+        fut = summary_executor.submit(_run_summary_backend, backend, text, lang, deadline, account)
+        try:
+            summary = fut.result(timeout=max(0.0, remaining_ms) / 1000)
+            if not _is_error_text(summary):
+                break
+        except FutureTimeout:
+            # A model run that already started finishes in the background and still trains the cost model
+            _abandon_summary(fut)
+        degraded.append(backend)
+        candidates = candidates[candidates.index(backend) + 1:]
+
+    return {
+        "summary": summary,
+        "path": backend,
+        "degraded_from": degraded,
+        "predicted_ms": round(predicted, 1),
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+
+# ----------------------------
+# Near-duplicate reuse (summary / sentiment / reply)
+# ----------------------------
+# Per account: cached summaries / replies carry mailbox content and must never cross accounts
+near_dup_indexes = AccountResources(lambda account: NearDupIndex() if account == DEFAULT_ACCOUNT
+                                    else NearDupIndex(os.path.join(account_dir(account), "near_dup.sqlite3")))
+
+def _cache_allowed() -> bool:
+    """Requests can opt out of result caches ("no_cache": true), e.g. evaluate.py timing real runs"""
+    return not (request.get_json(silent=True) or {}).get("no_cache")
+
+def _note_near_dup(status: str):
+    # hit | miss | off, sent back as X-Near-Dup
+    if has_request_context():
+        g.near_dup = status
+
+def _reuse_or_run(account: str, task: str, cleaned: str, fn, use_cache: bool = True):
+    """Return a cached result for a near-duplicate email of this account, else run fn() and cache it."""
+    if not use_cache:
+        _note_near_dup("off")
+        return fn()
+    near_dup_index = near_dup_indexes.get(account)
+    hit = near_dup_index.lookup(task, cleaned)
+    _note_near_dup("miss" if hit is None else "hit")
+    if hit is not None:
+        return hit
+    t0 = time.perf_counter()
+    result = fn()
+    if not (isinstance(result, str) and _is_error_text(result)):
+        near_dup_index.add(task, cleaned, result, (time.perf_counter() - t0) * 1000)
+    return result
+
+@app.after_request
+def _near_dup_header(resp):
+    if g.get("near_dup"):
+        resp.headers["X-Near-Dup"] = g.near_dup
+    return resp
+
+@app.route("/api/info", methods=["GET"])
+def api_info():
+    return jsonify({
+        "models": {
+            "en_sum": EN_SUM_MODEL,
+            "ko_sum": KO_SUM_MODEL,
+            "sentiment": SENTIMENT_MODEL,
+            "llm": OLLAMA_MODEL,
+            "en_draft": DRAFT_EN_MODEL,
+            "ko_draft": DRAFT_KO_MODEL,
+        },
+        "ollama_opts": OLLAMA_OPTS,
+        "model_dtype": MODEL_DTYPE,
+        "decode": {"modes": MODE_DECODE, "profiles": DECODE_PROFILES},
+        "llm_profiles": LLM_PROFILES,
+        "llm_lang_budget": LANG_BUDGET,
+    })
+
+@app.route("/api/models", methods=["GET"])
+def api_models():
+    return jsonify(model_registry.report())
+
+@app.route("/api/near_dup_stats", methods=["GET"])
+def api_near_dup_stats():
+    return jsonify(near_dup_indexes.get(g.account).stats())
+
+@app.route("/api/cost_model", methods=["GET"])
+def api_cost_model():
+    return jsonify(cost_model.snapshot())
+
+@app.route("/api/llm_stats", methods=["GET"])
+def api_llm_stats():
+    return jsonify(llm_stats.snapshot())
+
+@app.route("/api/accounts", methods=["GET"])
+def api_accounts():
+    return jsonify({
+        "usage": account_metrics.snapshot(),
+        "queues": {"llm": llm_queue.snapshot(), "model": model_queue.snapshot()},
+        "weights": ACCOUNT_WEIGHTS,
+    })
+
 # ----------------------------
 # API endpoints
 # ----------------------------
@@ -463,14 +964,47 @@ def summarize_endpoint():
     text = (data.get("text") or "").strip()
     lang = (data.get("lang") or "auto").lower()
     mode = (data.get("mode") or "hybrid").lower()
+    budget = data.get("budget")  # optional: input token budget (0 disables pre-compression)
+    budget = int(budget) if isinstance(budget, (int, float)) else None
+    deadline_ms = data.get("deadline_ms")  # optional: latency budget -> adaptive path
+    paths = data.get("paths")  # optional: backends the adaptive path may use, e.g. ["hybrid", "fast"]
+    paths = [p for p in paths if p in BACKEND_ORDER] if isinstance(paths, list) else None
+    decode = data.get("decode")  # optional: DECODE_PROFILES name (benchmarks)
+    decode = decode if decode in DECODE_PROFILES else None
     cleaned = remove_signature(text)
-    return jsonify({"summary": summarize_text(cleaned, lang, mode)})
+
+    if isinstance(deadline_ms, (int, float)) and deadline_ms > 0:
+        return jsonify(summarize_with_deadline(cleaned, lang, float(deadline_ms), g.account, paths))
+
+    # Overrides (budget / decode) always run the model: no cache, no cost-model samples
+    default_run = budget is None and decode is None
+    use_cache = default_run and _cache_allowed()
+    _note_near_dup("miss" if use_cache else "off")
+    if use_cache:
+        # Near-duplicates reuse the cached summary (the cost model only sees real runs)
+        hit = near_dup_indexes.get(g.account).lookup(f"summary:{mode}:{lang}", cleaned)
+        if hit is not None:
+            _note_near_dup("hit")
+            return jsonify({"summary": hit})
+
+    loads = model_registry.thread_loads()
+    summary, elapsed_ms = _scheduled(g.account, f"summary:{mode}", model_queue,
+                                     lambda: summarize_text(cleaned, lang, mode, budget, decode), cleaned)
+    warm = model_registry.thread_loads() == loads
+    if use_cache and summary:
+        near_dup_indexes.get(g.account).add(f"summary:{mode}:{lang}", cleaned, summary, elapsed_ms)
+    # "llm" here is summarize_text's length hint, not the Ollama backend, so it is not recorded
+    if default_run and warm and mode in ("fast", "hybrid"):
+        cost_model.observe(mode, count_tokens(cleaned), elapsed_ms)
+    return jsonify({"summary": summary})
 
 @app.route("/sentiment", methods=["POST"])
 def sentiment_endpoint():
     text = (request.json or {}).get("text","").strip()
     cleaned = remove_signature(text)
-    return jsonify(analyze_sentiment(cleaned))
+    account = g.account
+    return jsonify(_reuse_or_run(account, "sentiment", cleaned, lambda: _scheduled(
+        account, "sentiment", model_queue, lambda: analyze_sentiment(cleaned), cleaned)[0], _cache_allowed()))
 
 @app.route("/reply", methods=["POST"])
 def reply_endpoint():
@@ -478,7 +1012,11 @@ def reply_endpoint():
     text = (data.get("text") or "").strip()
     lang = (data.get("lang") or "en").lower()
     cleaned = remove_signature(text)
-    return jsonify({"reply": generate_reply_with_gemma3(cleaned, lang)})
+    account = g.account
+    reply = _reuse_or_run(account, f"reply:{lang}", cleaned, lambda: _scheduled(
+        account, "reply", llm_queue, lambda: generate_reply_with_gemma3(cleaned, lang), cleaned)[0],
+        _cache_allowed())
+    return jsonify({"reply": reply})
 
 @app.route("/reply_stream", methods=["POST"])
 def reply_stream():
@@ -488,42 +1026,230 @@ def reply_stream():
     if not text:
         return Response("data: \n\n", mimetype="text/event-stream")
 
-    lang_instruction = "Reply in Korean." if lang == "ko" else "Reply in English."
-    refined_prompt = f"""You are an assistant that writes polite, professional email replies.
-{lang_instruction}
-Based on the following email, write a short relevant reply.
-
---- EMAIL START ---
-{remove_signature(text)}
---- EMAIL END ---
-
-Reply:
-"""
+    refined_prompt = reply_prompt(remove_signature(text), lang)
 
     headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
-    return Response(stream_with_context(_ollama_stream(refined_prompt)),
+    stream = _scheduled_stream(g.account, "reply", llm_queue, _ollama_stream(refined_prompt, text, lang), text)
+    return Response(stream_with_context(stream),
                     mimetype="text/event-stream", headers=headers)
 
-# Email List (before summarisation)
+# ----------------------------
+# Similar-email retrieval (local vector index)
+# ----------------------------
+def _load_encoder():
+    try:
+        enc = SentenceEncoder()
+        enc.load()
+        return enc
+    except Exception as e:
+        print(f"[load] FAILED: embeddings :: {e}")
+        return None
+
+model_registry.register("embedder", _load_encoder, est_mb=470)
+# Local state is per account; "default" keeps the original single-mailbox paths
+vector_indexes = AccountResources(lambda account: VectorIndex() if account == DEFAULT_ACCOUNT
+                                  else VectorIndex(os.path.join(account_dir(account), "vector_index")))
+index_executor = ThreadPoolExecutor(max_workers=1)  # single writer keeps appends ordered
+
+def _encode(account: str, texts: List[str]):
+    """Embed texts in a fair-queued model slot; None if the encoder is unavailable"""
+    def run():
+        with model_registry.use("embedder") as encoder:
+            return None if encoder is None else encoder.encode(texts)
+    return _scheduled(account, "embed", model_queue, run, " ".join(texts))[0]
+
+def _index_messages(account: str, items: List[dict]):
+    """Embed list items (subject + snippet) and bodies; a body replaces an earlier snippet vector"""
+    vector_index = vector_indexes.get(account)
+    new = []
+    for it in items:
+        if not it.get("message_id"):
+            continue
+        stored = vector_index.source(it["message_id"])
+        if stored is None or (stored == "snippet" and it.get("text")):
+            new.append(it)
+    if not new:
+        return
+    try:
+        vecs = _encode(account, [f"{it.get('subject', '')}\n{it.get('text') or it.get('snippet', '')}" for it in new])
+        if vecs is None:
+            return
+        vector_index.add([{
+            "id": it["message_id"],
+            "thread_id": it.get("thread_id"),
+            "subject": it.get("subject", ""),
+            "snippet": it.get("snippet", ""),
+            "source": "body" if it.get("text") else "snippet",
+        } for it in new], vecs)
+    except Exception as e:
+        print("[vector] indexing failed:", e)
+
+@app.route("/similar", methods=["POST"])
+def similar_endpoint():
+    data = (request.json or {})
+    text = (data.get("text") or "").strip()
+    message_id = data.get("message_id")
+    try:
+        k = max(1, min(50, int(data.get("k") or 5)))
+    except (TypeError, ValueError):
+        return jsonify({"error": "k must be an integer"}), 400
+
+    t0 = time.perf_counter()
+    vector_index = vector_indexes.get(g.account)
+    q = vector_index.vector(message_id) if message_id else None
+    if q is None:
+        if not text:
+            return jsonify({"results": []})
+        vecs = _encode(g.account, [remove_signature(text)])
+        if vecs is None:
+            return jsonify({"error": "embedding model unavailable", "results": []}), 503
+        q = vecs[0]
+    res = vector_index.search(q, k=k, exclude=message_id)
+    res["search_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    res["indexed"] = len(vector_index)
+    return jsonify(res)
+
+mail_stores = AccountResources(lambda account: MailStore() if account == DEFAULT_ACCOUNT
+                               else MailStore(os.path.join(account_dir(account), "mail_store.sqlite3")))
+
+def _search_emails(q: str):
+    limit = max(1, min(100, request.args.get("limit", default=20, type=int)))
+    t0 = time.perf_counter()
+    res = mail_stores.get(g.account).search(q, limit=limit, cursor=request.args.get("cursor"))
+    res["search_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    return jsonify(res)
+
+EMAIL_PAGE_SIZE = 20
+GZIP_MIN_BYTES = 1024
+GZIP_ETAG_SUFFIX = "-gz"  # gzip and identity bodies are different representations
+
+def _conditional_json(payload):
+    """JSON response with an ETag; a matching If-None-Match turns it into a 304."""
+    resp = jsonify(payload)
+    resp.headers["Cache-Control"] = "no-cache"  # always revalidate, never reuse blindly
+    # The mailbox comes from X-Account (authorised by the key) or ?account=; the query is
+    # already part of the cache key, the headers are not
+    resp.vary.add("X-Account")
+    resp.vary.add("Authorization")
+    resp.add_etag()
+    etag, _ = resp.get_etag()
+    # _gzip_json sends the compressed body under etag + GZIP_ETAG_SUFFIX
+    if request.if_none_match.contains(etag + GZIP_ETAG_SUFFIX):
+        resp.set_etag(etag + GZIP_ETAG_SUFFIX)
+        resp.status_code = 304
+        resp.set_data(b"")
+        return resp
+    return resp.make_conditional(request)
+
+@app.after_request
+def _gzip_json(resp):
+    if (resp.status_code != 200 or resp.direct_passthrough or resp.is_streamed
+            or resp.mimetype != "application/json" or "Content-Encoding" in resp.headers
+            or "gzip" not in request.headers.get("Accept-Encoding", "").lower()):
+        return resp
+    data = resp.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return resp
+    resp.set_data(gzip.compress(data, compresslevel=5))
+    resp.headers["Content-Encoding"] = "gzip"
+    etag, weak = resp.get_etag()
+    if etag:
+        resp.set_etag(etag + GZIP_ETAG_SUFFIX, weak)
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+# Email List (metadata only; bodies via /api/emails/<id>)
+# ?q=... searches the local full-text index instead of calling Gmail
+# ?cursor=... continues from the previous page's next_cursor
+def sync_email_page(account: str, metas: List[dict]) -> List[dict]:
+    """Gmail metadata page -> list items; stored and queued for embedding as a side effect"""
+    items = [{
+        "message_id": m["id"],
+        "thread_id": m["threadId"],
+        "subject": (m["subject"] or "(no subject)")[:200],
+        "from": m["from"],
+        "date": m["internalDate"],
+        "snippet": m["snippet"],
+    } for m in metas]
+
+    mail_stores.get(account).upsert([{
+        "id": it["message_id"],
+        "thread_id": it["thread_id"],
+        "subject": it["subject"],
+        "sender": it["from"],
+        "date": it["date"],
+        "snippet": it["snippet"],
+    } for it in items])
+    # Incremental embedding of newly synced mail (subject + snippet), off the request path
+    index_executor.submit(_index_messages, account, items)
+    return items
+
+def store_email_body(account: str, m: dict) -> dict:
+    """Fetched Gmail message -> body item with quoted thread history removed; stored"""
+    mail_store = mail_stores.get(account)
+    cleaned = remove_signature(m["body"] or "").strip()
+    # Thread ids are per mailbox, so the dedup state is keyed by account too
+    thread_key = f"{account}:{m['threadId']}"
+    # A thread not in memory (restart / eviction) first registers the bodies stored earlier;
+    # later fetches of the thread only dedup the new message
+    if not thread_deduper.has_thread(thread_key):
+        for prev in mail_store.thread(m["threadId"]):
+            if prev["message_id"] != m["id"] and prev.get("text"):
+                thread_deduper.register(thread_key, prev["message_id"], prev["text"], prev["date"])
+    text = thread_deduper.dedup(thread_key, m["id"], cleaned, m["internalDate"]) or cleaned or m["body"]
+
+    item = {
+        "message_id": m["id"],
+        "thread_id": m["threadId"],
+        "subject": m["subject"] or "(no subject)",
+        "from": m["from"],
+        "date": m["internalDate"],
+        "snippet": m["snippet"],
+        "text": text,
+    }
+    mail_store.upsert([dict(item, id=m["id"], sender=m["from"])])
+    # The body replaces the subject + snippet embedding from the list sync
+    index_executor.submit(_index_messages, account, [item])
+    return item
+
+def email_body(account: str, message_id: str) -> dict:
+    """Stored body item; fetched from Gmail (thread dedup + store) on first use"""
+    item = mail_stores.get(account).get(message_id)
+    if item is None or not item.get("text"):
+        from gmail_service import get_message
+        item = store_email_body(account, get_message(message_id, account=account))
+    return item
+
 @app.route("/api/emails", methods=["GET"])
 def api_emails():
-    # Assume fetch_emails(max_results=N) function exists in run_fetch.py
-    from run_fetch import fetch_emails
-    raw_emails = fetch_emails(max_results=20)
-    items = []
-    for idx, raw in enumerate(raw_emails):
-        raw = raw or ""
-        cleaned = remove_signature(raw).strip()
-        lines = [ln.strip() for ln in raw.splitlines() if ln.strip()]
-        subject = (lines[0] if lines else "(no subject)")[:120]
-        snippet = (cleaned or raw).replace("\n", " ")[:200]
-        items.append({
-            "id": idx,
-            "subject": subject,
-            "snippet": snippet,
-            "text": cleaned or raw
-        })
-    return jsonify(items)
+    q = (request.args.get("q") or "").strip()
+    if q:
+        return _search_emails(q)
+
+    from gmail_service import list_messages
+    limit = max(1, min(100, request.args.get("limit", default=EMAIL_PAGE_SIZE, type=int)))
+    try:
+        metas, next_cursor = list_messages(max_results=limit, page_token=request.args.get("cursor") or None,
+                                           account=g.account)
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 403
+
+    items = sync_email_page(g.account, metas)
+    return _conditional_json({"items": items, "next_cursor": next_cursor})
+
+@app.route("/api/emails/<message_id>", methods=["GET"])
+def api_email_body(message_id):
+    try:
+        item = email_body(g.account, message_id)
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 403
+    except Exception as e:
+        return jsonify({"error": f"Gmail fetch failed: {e}"}), 502
+    return _conditional_json(item)
+
+@app.route("/api/dedup_stats", methods=["GET"])
+def api_dedup_stats():
+    return jsonify(thread_deduper.stats())
 
 # Manual Text Processing (Summarisation + Sentiment)
 @app.route("/process", methods=["POST"])
@@ -533,9 +1259,12 @@ def process_input():
     lang = (data.get("lang") or "auto").lower()
     mode = (data.get("mode") or "hybrid").lower()
     cleaned = remove_signature(text)
+    summary, _ = _scheduled(g.account, f"summary:{mode}", model_queue,
+                            lambda: summarize_text(cleaned, lang, mode), cleaned)
+    sentiment, _ = _scheduled(g.account, "sentiment", model_queue, lambda: analyze_sentiment(cleaned), cleaned)
     return jsonify({
-        "summary": summarize_text(cleaned, lang, mode),
-        "sentiment": analyze_sentiment(cleaned)["mapped_category"]
+        "summary": summary,
+        "sentiment": sentiment["mapped_category"]
     })
 
 if __name__ == "__main__":
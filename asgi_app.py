@@ -0,0 +1,524 @@
+# asgi_app.py
+# -----------------------------------------------------------------------------
+# Async serving path (ASGI) for many concurrent waiting / streaming clients
+# - Ollama through its HTTP API (ollama.AsyncClient) and Gmail through async REST calls:
+#   a waiting or streaming client holds a coroutine, not an OS thread
+# - CPU-bound HF inference runs on a dedicated executor (INFERENCE_WORKERS)
+# - Fair queuing, near-dup reuse, cost model and per-account metrics are shared with app.py
+# - Every route not implemented here is served by the Flask app mounted underneath
+# -----------------------------------------------------------------------------
+# Usage:
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import gzip
+import time
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import ollama
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as core
+from llm_profiles import GenerationRun
+from gmail_service import aget_message, alist_messages
+from translate_pipeline import SegmentCache, assemble, atranslate_segments, split_segments
+
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))   # HF forward passes in parallel
+OLLAMA_TIMEOUT_S = core.OLLAMA_TIMEOUT_S
+HEARTBEAT_S = 3
+
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+ollama_client = ollama.AsyncClient(timeout=OLLAMA_TIMEOUT_S)   # OLLAMA_HOST is honoured
+
+
+# ----------------------------
+# Helpers
+# ----------------------------
+def _account(request: Request) -> str:
+    try:
+        return core.resolve_account(request.headers.get("x-account") or request.query_params.get("account"),
+                                    request.headers.get("authorization"),
+                                    request.client.host if request.client else None)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except PermissionError as e:
+        raise HTTPException(403, str(e))
+
+async def _body(request: Request) -> dict:
+    try:
+        data = await request.json()
+    except Exception:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def _json(request: Request, payload, conditional: bool = False, status_code: int = 200,
+          headers: Optional[dict] = None) -> Response:
+    """JSON with the same ETag / gzip behaviour as the Flask responses"""
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    gz = len(body) >= core.GZIP_MIN_BYTES and "gzip" in request.headers.get("accept-encoding", "").lower()
+    headers = dict(headers or {})
+    if conditional:
+        # Encoding-specific tag: the gzip body is a different representation
+        etag = '"' + hashlib.sha1(body).hexdigest() + (core.GZIP_ETAG_SUFFIX if gz else "") + '"'
+        # ?account= is part of the URL (the cache key); X-Account / Authorization are not
+        headers.update({"ETag": etag, "Cache-Control": "no-cache", "Vary": "X-Account, Authorization"})
+        sent = [t.strip() for t in request.headers.get("if-none-match", "").split(",")]
+        if etag in sent or "*" in sent:
+            return Response(status_code=304, headers=headers)
+    if gz:
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = ", ".join(filter(None, [headers.get("Vary"), "Accept-Encoding"]))
+    return Response(body, status_code=status_code, media_type="application/json", headers=headers)
+
+async def _scheduled(account: str, task: str, queue, coro_fn, text: str = "", timeout: Optional[float] = None):
+    """Async counterpart of app._scheduled: returns (result, run_ms); timeout bounds the queue wait"""
+    tokens = core.count_tokens(text)
+    wait_ms = await asyncio.wait_for(queue.acquire(account, cost=tokens), timeout)
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        out = await coro_fn()
+        ok = not (isinstance(out, str) and core._is_error_text(out))
+        return out, (time.perf_counter() - t0) * 1000
+    finally:
+        queue.release()
+        core.account_metrics.record(account, task, wait_ms, (time.perf_counter() - t0) * 1000, tokens, ok)
+
+async def _scheduled_infer(account: str, task: str, queue, fn, *args, text: str = "", on_done=None):
+    """
+    _scheduled() for CPU-bound model code on the inference executor: returns (result, run_ms).
+    A thread cannot be interrupted, so the slot is held until the executor job ends, not until
+    the caller goes away; a cancelled caller's running job counts as abandoned (app._abandoned).
+    on_done(result, run_ms) sees every successful run, including abandoned ones, except runs that
+    loaded a model (their time includes the load).
+    """
+    tokens = core.count_tokens(text)
+    wait_ms = await queue.acquire(account, cost=tokens)
+    state = {"t0": None, "abandoned": False, "counted": False}
+
+    def job():
+        with core._abandoned_lock:
+            if state["abandoned"]:
+                raise RuntimeError("caller gone before the run started")
+            state["t0"] = time.perf_counter()
+        loads = core.model_registry.thread_loads()
+        try:
+            return fn(*args)
+        finally:
+            state["loaded"] = core.model_registry.thread_loads() != loads
+
+    def finished(f):
+        queue.release()
+        run_ms = (time.perf_counter() - state["t0"]) * 1000 if state["t0"] else 0.0
+        out = None if f.cancelled() or f.exception() else f.result()
+        ok = out is not None and not (isinstance(out, str) and core._is_error_text(out))
+        core.account_metrics.record(account, task, wait_ms, run_ms, tokens, ok)
+        with core._abandoned_lock:
+            if state["counted"]:
+                core._abandoned["running"] -= 1
+        if ok and on_done and not state.get("loaded"):
+            on_done(out, run_ms)
+
+    try:
+        fut = asyncio.get_running_loop().run_in_executor(inference_executor, job)
+    except BaseException:
+        queue.release()
+        raise
+    fut.add_done_callback(finished)
+    try:
+        out = await asyncio.shield(fut)
+    except asyncio.CancelledError:
+        with core._abandoned_lock:
+            state["abandoned"] = True
+            if state["t0"] is not None and not fut.done():
+                state["counted"] = True
+                core._abandoned["running"] += 1
+        raise
+    return out, (time.perf_counter() - state["t0"]) * 1000
+
+async def _scheduled_stream(account: str, task: str, queue, agen, text: str = ""):
+    tokens = core.count_tokens(text)
+    async with queue.aslot(account, cost=tokens) as wait_ms:
+        t0 = time.perf_counter()
+        ok = False
+        try:
+            async for item in agen:
+                yield item
+            ok = True
+        finally:
+            core.account_metrics.record(account, task, wait_ms, (time.perf_counter() - t0) * 1000, tokens, ok)
+
+async def _reuse_or_run(account: str, task: str, cleaned: str, coro_fn, use_cache: bool = True):
+    """Async app._reuse_or_run (the SQLite lookups run off the event loop): (result, hit|miss|off)"""
+    if not use_cache:
+        return await coro_fn(), "off"
+    near_dup_index = core.near_dup_indexes.get(account)
+    hit = await asyncio.to_thread(near_dup_index.lookup, task, cleaned)
+    if hit is not None:
+        return hit, "hit"
+    t0 = time.perf_counter()
+    result = await coro_fn()
+    if not (isinstance(result, str) and core._is_error_text(result)):
+        await asyncio.to_thread(near_dup_index.add, task, cleaned, result,
+                                (time.perf_counter() - t0) * 1000)
+    return result, "miss"
+
+async def _with_heartbeat(agen, interval: float = HEARTBEAT_S):
+    """Yield items from agen, and None whenever nothing arrived for `interval` seconds"""
+    it = agen.__aiter__()
+    nxt = asyncio.ensure_future(it.__anext__())
+    try:
+        while True:
+            done, _ = await asyncio.wait({nxt}, timeout=interval)
+            if not done:
+                yield None
+                continue
+            try:
+                item = nxt.result()
+            except StopAsyncIteration:
+                return
+            yield item
+            nxt = asyncio.ensure_future(it.__anext__())
+    finally:
+        nxt.cancel()
+
+
+# ----------------------------
+# Ollama (HTTP API)
+# ----------------------------
+async def _llm_stream(task: str, prompt: str, source: str, lang: Optional[str] = None,
+                      complete: bool = False):
+    """Async app._llm_stream: task profile options, early stop at the structural end, token stats"""
+    run = GenerationRun(task, source, core.OLLAMA_BASE_OPTIONS, lang)
+    try:
+        stream = await ollama_client.generate(model=core.OLLAMA_MODEL, prompt=prompt,
+                                              options=run.options, stream=True)
+        try:
+            async for part in stream:
+                text = run.feed(part)
+                if text:
+                    yield text
+                if run.done:
+                    break
+        finally:
+            await stream.aclose()     # closes the HTTP stream: Ollama stops generating
+        if complete and run.truncated:
+            raise RuntimeError(f"{task} output cut off at {run.budget} tokens")
+    finally:
+        core.llm_stats.record(run)
+
+async def _generate(task: str, prompt: str, source: str, timeout: float = OLLAMA_TIMEOUT_S,
+                    lang: Optional[str] = None, complete: bool = False) -> str:
+    async def collect():
+        return "".join([t async for t in _llm_stream(task, prompt, source, lang, complete)])
+    return await asyncio.wait_for(collect(), timeout)
+
+async def generate_reply(cleaned: str, lang: str = "en") -> str:
+    try:
+        out = await _generate("reply", core.reply_prompt(cleaned, lang), cleaned, lang=lang)
+    except asyncio.TimeoutError:
+        return "⚠️ Reply generation timed out. Please try again."
+    except Exception as e:
+        print(f"[Gemma Error] {e}")
+        return "⚠️ Error generating reply. Please try again."
+    return core.clean_reply(out)
+
+async def summarize_llm(text: str, max_chars: int = 2000, timeout: float = 120) -> str:
+    cleaned = core.remove_signature(text or "").strip()
+    if not cleaned:
+        return ""
+    source = cleaned[:max_chars]
+    try:
+        out = await _generate("summary", core.summary_prompt(source), source, timeout)
+    except asyncio.TimeoutError:
+        return "⚠️ LLM summarization timed out."
+    except Exception as e:
+        return f"⚠️ LLM error: {e}"
+    return core.clean_llm_summary(out)
+
+async def _translate_segment(source: str, target_lang: str) -> str:
+    try:
+        out = await _generate("translate", core.translate_prompt(source, target_lang), source,
+                              complete=True)
+    except asyncio.TimeoutError:
+        raise RuntimeError("LLM translation timed out.")
+    except Exception as e:
+        raise RuntimeError(f"LLM error: {e}")
+    return core.clean_translation(out)
+
+def _translate_fn(account: str):
+    async def run(seg: str, target_lang: str) -> str:
+        out, _ = await _scheduled(account, "translate", core.llm_queue,
+                                  lambda: _translate_segment(seg, target_lang), seg)
+        return out
+    return run
+
+async def _ollama_stream(prompt: str, source: str = "", lang: str = "en"):
+    try:
+        async for chunk in _with_heartbeat(_llm_stream("reply", prompt, source, lang)):
+            if chunk is None:
+                yield "event: ping\ndata: keepalive\n\n"
+            else:
+                yield core._sse_data(chunk)
+        yield "event: done\ndata: [DONE]\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {str(e)}\n\n"
+
+
+# ----------------------------
+# Endpoints
+# ----------------------------
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+async def reply_endpoint(request: Request):
+    account = _account(request)
+    data = await _body(request)
+    cleaned = core.remove_signature((data.get("text") or "").strip())
+    lang = (data.get("lang") or "en").lower()
+
+    async def run():
+        out, _ = await _scheduled(account, "reply", core.llm_queue, lambda: generate_reply(cleaned, lang), cleaned)
+        return out
+    reply, near_dup = await _reuse_or_run(account, f"reply:{lang}", cleaned, run, not data.get("no_cache"))
+    return _json(request, {"reply": reply}, headers={"X-Near-Dup": near_dup})
+
+async def reply_stream(request: Request):
+    account = _account(request)
+    data = await _body(request)
+    text = (data.get("text") or "").strip()
+    lang = (data.get("lang") or "en").lower()
+    if not text:
+        return Response("data: \n\n", media_type="text/event-stream")
+    prompt = core.reply_prompt(core.remove_signature(text), lang)
+    stream = _scheduled_stream(account, "reply", core.llm_queue, _ollama_stream(prompt, text, lang), text)
+    return StreamingResponse(stream, media_type="text/event-stream", headers=SSE_HEADERS)
+
+async def summarize_llm_endpoint(request: Request):
+    account = _account(request)
+    text = ((await _body(request)).get("text") or "").strip()
+    if not text:
+        return _json(request, {"summary": ""})
+    summary, run_ms = await _scheduled(account, "summary:llm", core.llm_queue, lambda: summarize_llm(text), text)
+    if not core._is_error_text(summary):
+        core.cost_model.observe("llm", core.count_tokens(text), run_ms)
+    return _json(request, {"summary": summary})
+
+async def translate_endpoint(request: Request):
+    account = _account(request)
+    data = await _body(request)
+    source = (data.get("text") or "").strip()
+    target = (data.get("target_lang") or "en").lower()
+    if not source:
+        return _json(request, {"translated": ""})
+    if target not in ("en", "ko"):
+        return _json(request, {"translated": "⚠️ target_lang must be 'en' or 'ko'", "partial": False,
+                               "failed_segments": []})
+
+    segments = split_segments(source)
+    parts = [""] * len(segments)
+    failed = []
+    cache = SegmentCache(0) if data.get("no_cache") else core.segment_cache
+    async for i, out, ok in atranslate_segments(segments, target, _translate_fn(account),
+                                                core.TRANSLATE_WORKERS, cache):
+        parts[i] = out
+        if not ok:
+            failed.append(i)
+    return _json(request, assemble(segments, parts, failed))
+
+async def _translate_stream(text: str, target: str, account: str):
+    segments = split_segments(text)
+    yield f"event: meta\ndata: {json.dumps({'segments': len(segments)})}\n\n"
+    try:
+        async for i, out, ok in atranslate_segments(segments, target, _translate_fn(account),
+                                                    core.TRANSLATE_WORKERS, core.segment_cache):
+            payload = {"index": i, "text": out, "sep": segments[i][1], "ok": ok}
+            yield f"event: segment\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        yield "event: done\ndata: [DONE]\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {str(e)}\n\n"
+
+async def translate_stream_endpoint(request: Request):
+    account = _account(request)
+    data = await _body(request)
+    text = (data.get("text") or "").strip()
+    target = (data.get("target_lang") or "en").lower()
+    if not text or target not in ("en", "ko"):
+        return Response("event: done\ndata: [DONE]\n\n", media_type="text/event-stream")
+    return StreamingResponse(_translate_stream(text, target, account), media_type="text/event-stream",
+                             headers=SSE_HEADERS)
+
+async def _run_summary_backend(backend: str, text: str, lang: str, deadline: float, account: str) -> str:
+    """Async app._run_summary_backend: queue waits and model runs are awaited, no thread per request"""
+    if backend == "extractive":
+        return core._run_summary_backend(backend, text, lang, deadline, account)
+    tokens = core.count_tokens(text)
+    try:
+        if backend == "llm":
+            # Closing the stream stops Ollama, so the LLM is bounded by its own timeout
+            out, run_ms = await _scheduled(
+                account, "summary:llm", core.llm_queue,
+                lambda: summarize_llm(text, timeout=max(1.0, deadline - time.perf_counter())),
+                text, timeout=max(0.0, deadline - time.perf_counter()))
+        else:
+            # A model run past the deadline keeps its slot and trains the cost model when it ends
+            out, run_ms = await asyncio.wait_for(
+                _scheduled_infer(account, f"summary:{backend}", core.model_queue, core.summarize_text,
+                                 text, lang, backend, text=text,
+                                 on_done=lambda _, ms: core.cost_model.observe(backend, tokens, ms)),
+                max(0.0, deadline - time.perf_counter()))
+            return out
+    except asyncio.TimeoutError:
+        return "⚠️ Deadline passed."
+    if not core._is_error_text(out):
+        core.cost_model.observe(backend, tokens, run_ms)
+    elif time.perf_counter() >= deadline:
+        core.cost_model.observe_censored(backend, tokens, run_ms)
+    return out
+
+async def summarize_with_deadline(text: str, lang: str, deadline_ms: float, account: str,
+                                  paths: Optional[List[str]] = None) -> dict:
+    """Async app.summarize_with_deadline (same path choice and degradation)"""
+    t0 = time.perf_counter()
+    deadline = t0 + deadline_ms / 1000
+    tokens = core.count_tokens(text)
+    candidates = core.deadline_candidates(paths)
+    degraded = []
+    summary, backend, predicted = "", "extractive", 0.0
+
+    while candidates:
+        remaining_ms = (deadline - time.perf_counter()) * 1000
+        backend, predicted = core.cost_model.choose(tokens, remaining_ms, candidates)
+        summary = await _run_summary_backend(backend, text, lang, deadline, account)
+        if backend == "extractive" or not core._is_error_text(summary):
+            break
+        degraded.append(backend)
+        candidates = candidates[candidates.index(backend) + 1:]
+
+    return {
+        "summary": summary,
+        "path": backend,
+        "degraded_from": degraded,
+        "predicted_ms": round(predicted, 1),
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+
+async def summarize_endpoint(request: Request):
+    account = _account(request)
+    data = await _body(request)
+    text = (data.get("text") or "").strip()
+    lang = (data.get("lang") or "auto").lower()
+    mode = (data.get("mode") or "hybrid").lower()
+    budget = data.get("budget")
+    budget = int(budget) if isinstance(budget, (int, float)) else None
+    deadline_ms = data.get("deadline_ms")
+    decode = data.get("decode")
+    decode = decode if decode in core.DECODE_PROFILES else None
+    paths = data.get("paths")
+    paths = [p for p in paths if p in core.BACKEND_ORDER] if isinstance(paths, list) else None
+    cleaned = core.remove_signature(text)
+
+    if isinstance(deadline_ms, (int, float)) and deadline_ms > 0:
+        return _json(request, await summarize_with_deadline(cleaned, lang, float(deadline_ms), account, paths))
+
+    task = f"summary:{mode}:{lang}"
+    default_run = budget is None and decode is None
+    use_cache = default_run and not data.get("no_cache")
+    near_dup_index = core.near_dup_indexes.get(account)
+    if use_cache:
+        hit = await asyncio.to_thread(near_dup_index.lookup, task, cleaned)
+        if hit is not None:
+            return _json(request, {"summary": hit}, headers={"X-Near-Dup": "hit"})
+
+    # "llm" here is summarize_text's length hint, not the Ollama backend, so it is not recorded
+    observe = None
+    if default_run and mode in ("fast", "hybrid"):
+        observe = lambda _, ms: core.cost_model.observe(mode, core.count_tokens(cleaned), ms)
+    summary, elapsed_ms = await _scheduled_infer(account, f"summary:{mode}", core.model_queue, core.summarize_text,
+                                                 cleaned, lang, mode, budget, decode, text=cleaned, on_done=observe)
+    if use_cache and summary:
+        await asyncio.to_thread(near_dup_index.add, task, cleaned, summary, elapsed_ms)
+    return _json(request, {"summary": summary}, headers={"X-Near-Dup": "miss" if use_cache else "off"})
+
+async def sentiment_endpoint(request: Request):
+    account = _account(request)
+    data = await _body(request)
+    cleaned = core.remove_signature((data.get("text") or "").strip())
+
+    async def run():
+        out, _ = await _scheduled_infer(account, "sentiment", core.model_queue, core.analyze_sentiment, cleaned,
+                                        text=cleaned)
+        return out
+    result, near_dup = await _reuse_or_run(account, "sentiment", cleaned, run, not data.get("no_cache"))
+    return _json(request, result, headers={"X-Near-Dup": near_dup})
+
+async def api_emails(request: Request):
+    account = _account(request)
+    q = (request.query_params.get("q") or "").strip()
+    try:
+        limit = max(1, min(100, int(request.query_params.get("limit") or core.EMAIL_PAGE_SIZE)))
+    except ValueError:
+        limit = core.EMAIL_PAGE_SIZE
+    cursor = request.query_params.get("cursor") or None
+
+    if q:
+        t0 = time.perf_counter()
+        res = await asyncio.to_thread(core.mail_stores.get(account).search, q, limit, cursor)
+        res["search_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        return _json(request, res)
+
+    try:
+        metas, next_cursor = await alist_messages(max_results=limit, page_token=cursor, account=account)
+    except PermissionError as e:
+        return _json(request, {"error": str(e)}, status_code=403)
+    items = await asyncio.to_thread(core.sync_email_page, account, metas)
+    return _json(request, {"items": items, "next_cursor": next_cursor}, conditional=True)
+
+async def api_email_body(request: Request):
+    account = _account(request)
+    message_id = request.path_params["message_id"]
+    item = await asyncio.to_thread(core.mail_stores.get(account).get, message_id)
+    if item is None or not item.get("text"):
+        try:
+            m = await aget_message(message_id, account=account)
+        except PermissionError as e:
+            return _json(request, {"error": str(e)}, status_code=403)
+        except Exception as e:
+            return _json(request, {"error": f"Gmail fetch failed: {e}"}, status_code=502)
+        item = await asyncio.to_thread(core.store_email_body, account, m)
+    return _json(request, item, conditional=True)
+
+async def _http_error(request: Request, exc: HTTPException):
+    return JSONResponse({"error": exc.detail}, status_code=exc.status_code)
+
+
+app = Starlette(
+    routes=[
+        Route("/reply", reply_endpoint, methods=["POST"]),
+        Route("/reply_stream", reply_stream, methods=["POST"]),
+        Route("/summarize", summarize_endpoint, methods=["POST"]),
+        Route("/summarize_llm", summarize_llm_endpoint, methods=["POST"]),
+        Route("/sentiment", sentiment_endpoint, methods=["POST"]),
+        Route("/translate_llm", translate_endpoint, methods=["POST"]),
+        Route("/translate_llm_stream", translate_stream_endpoint, methods=["POST"]),
+        Route("/api/emails", api_emails, methods=["GET"]),
+        Route("/api/emails/{message_id}", api_email_body, methods=["GET"]),
+        # Everything else (/process, /similar, /api/info, stats ...) stays on Flask
+        Mount("/", app=WsgiToAsgi(core.app)),
+    ],
+    exception_handlers={HTTPException: _http_error},
+)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
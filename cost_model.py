@@ -0,0 +1,108 @@
+# cost_model.py
+# Online latency cost model per summarisation backend.
+# latency_ms ~= a + b * input_tokens, fitted by exponentially-weighted least squares
+# so the estimate follows the host as load and models change.
+
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Cold-start priors (intercept ms, ms per input token) before enough observations arrive
+DEFAULT_PRIORS: Dict[str, Tuple[float, float]] = {
+    "extractive": (5.0, 0.01),
+    "fast":       (1500.0, 8.0),
+    "hybrid":     (3000.0, 15.0),
+    "llm":        (8000.0, 40.0),
+}
+
+# Preferred (highest quality) first; degradation walks down this list
+BACKEND_ORDER: List[str] = ["llm", "hybrid", "fast", "extractive"]
+
+DECAY = 0.97         # forgetting factor per observation
+MIN_OBS = 3          # observations before the fitted line replaces the prior
+SAFETY = 1.2         # predicted latency is inflated by this factor when choosing
+
+
+def count_tokens(text: str) -> int:
+    # Whitespace words are a cheap, tokenizer-independent proxy that works across backends
+    return len((text or "").split())
+
+
+class _Fit:
+    __slots__ = ("w", "sx", "sy", "sxx", "sxy", "n")
+
+    def __init__(self):
+        self.w = self.sx = self.sy = self.sxx = self.sxy = 0.0
+        self.n = 0
+
+    def add(self, x: float, y: float):
+        d = DECAY
+        self.w = self.w * d + 1.0
+        self.sx = self.sx * d + x
+        self.sy = self.sy * d + y
+        self.sxx = self.sxx * d + x * x
+        self.sxy = self.sxy * d + x * y
+        self.n += 1
+
+    def line(self) -> Optional[Tuple[float, float]]:
+        if self.n < MIN_OBS or self.w <= 0:
+            return None
+        mx, my = self.sx / self.w, self.sy / self.w
+        var = self.sxx / self.w - mx * mx
+        if var <= 1e-9:
+            # All inputs the same size: intercept-only model
+            return my, 0.0
+        b = max(0.0, (self.sxy / self.w - mx * my) / var)
+        a = max(0.0, my - b * mx)
+        return a, b
+
+
+class LatencyCostModel:
+    def __init__(self, priors: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.priors = dict(priors or DEFAULT_PRIORS)
+        self._fits: Dict[str, _Fit] = {k: _Fit() for k in self.priors}
+        self._lock = threading.Lock()
+
+    def observe(self, backend: str, tokens: int, latency_ms: float):
+        with self._lock:
+            self._fits.setdefault(backend, _Fit()).add(float(tokens), float(latency_ms))
+
+    def observe_censored(self, backend: str, tokens: int, elapsed_ms: float):
+        """A run cut off after elapsed_ms: its latency was at least that (and at least the estimate)"""
+        self.observe(backend, tokens, max(elapsed_ms, self.predict(backend, tokens)))
+
+    def predict(self, backend: str, tokens: int) -> float:
+        with self._lock:
+            fit = self._fits.get(backend)
+            line = fit.line() if fit else None
+        a, b = line or self.priors.get(backend, (0.0, 0.0))
+        return a + b * tokens
+
+    def choose(self, tokens: int, budget_ms: float,
+               candidates: Optional[List[str]] = None) -> Tuple[str, float]:
+        """
+        Best backend whose (inflated) predicted latency fits budget_ms.
+        Falls back to the cheapest candidate when nothing fits.
+        """
+        order = candidates or BACKEND_ORDER
+        for backend in order:
+            pred = self.predict(backend, tokens)
+            if pred * SAFETY <= budget_ms:
+                return backend, pred
+        return order[-1], self.predict(order[-1], tokens)
+
+    def snapshot(self) -> dict:
+        out = {}
+        with self._lock:
+            for backend, fit in self._fits.items():
+                line = fit.line()
+                a, b = line or self.priors.get(backend, (0.0, 0.0))
+                out[backend] = {
+                    "observations": fit.n,
+                    "intercept_ms": round(a, 1),
+                    "ms_per_token": round(b, 3),
+                    "fitted": line is not None,
+                }
+        return out
+
+
+cost_model = LatencyCostModel()
@@ -0,0 +1,219 @@
+# eval_history.py
+# -----------------------------------------------------------------------------
+# Run-history store for evaluate.py
+# - Every evaluation run is saved with metadata (git sha, model names, OLLAMA_OPTS, host CPU)
+# - compare_runs() diffs latency distributions and quality metrics between two runs
+#   (Mann-Whitney U test) and signals a p95 latency regression beyond a threshold
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import math
+import time
+import sqlite3
+import platform
+import subprocess
+from typing import Any, Dict, List, Optional, Tuple
+
+RUNS_DB = os.environ.get("EAA_RUNS_DB", "eval_runs.sqlite3")
+
+LATENCY_COLS = [
+    "sum_fast_latency", "sum_full_latency", "sum_llm_latency", "sent_latency",
+    "reply_en_latency", "reply_ko_latency", "tr_en_latency", "tr_ko_latency",
+]
+QUALITY_COLS = [
+    "sum_fast_rouge1", "sum_fast_rouge2", "sum_fast_rougeL",
+    "sum_full_rouge1", "sum_full_rouge2", "sum_full_rougeL",
+    "sum_llm_rouge1", "sum_llm_rouge2", "sum_llm_rougeL",
+    "sum_fast_comp", "sum_full_comp", "sum_llm_comp",
+    "reply_en_dist1", "reply_en_dist2", "reply_ko_dist1", "reply_ko_dist2",
+]
+
+
+def _connect(path: str = RUNS_DB) -> sqlite3.Connection:
+    db = sqlite3.connect(path)
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY,
+            created TEXT NOT NULL,
+            meta TEXT NOT NULL,
+            rows TEXT NOT NULL
+        );
+    """)
+    return db
+
+
+def git_sha() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, timeout=5)
+        sha = out.stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True, timeout=5).stdout.strip()
+        return f"{sha}-dirty" if sha and dirty else (sha or "unknown")
+    except Exception:
+        return "unknown"
+
+
+def host_info() -> Dict[str, Any]:
+    cpu = platform.processor() or ""
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu = line.split(":", 1)[1].strip()
+                    break
+    except Exception:
+        pass
+    return {
+        "cpu": cpu,
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+    }
+
+
+def save_run(rows: List[Dict[str, Any]], meta: Dict[str, Any], path: str = RUNS_DB) -> int:
+    db = _connect(path)
+    with db:
+        cur = db.execute(
+            "INSERT INTO runs (created, meta, rows) VALUES (?, ?, ?)",
+            (time.strftime("%Y-%m-%d %H:%M:%S"), json.dumps(meta, ensure_ascii=False),
+             json.dumps(rows, ensure_ascii=False, default=str)),
+        )
+    db.close()
+    return int(cur.lastrowid)
+
+
+def list_runs(limit: int = 20, path: str = RUNS_DB) -> List[Tuple[int, str, Dict[str, Any]]]:
+    db = _connect(path)
+    out = [(rid, created, json.loads(meta)) for rid, created, meta in
+           db.execute("SELECT id, created, meta FROM runs ORDER BY id DESC LIMIT ?", (limit,))]
+    db.close()
+    return out
+
+
+def load_run(ref: str, path: str = RUNS_DB) -> Optional[Tuple[int, Dict[str, Any], List[Dict[str, Any]]]]:
+    """ref: run id, 'latest' or 'prev' (the run before latest)"""
+    db = _connect(path)
+    if ref in ("latest", "prev"):
+        row = db.execute("SELECT id, meta, rows FROM runs ORDER BY id DESC LIMIT 1 OFFSET ?",
+                         (0 if ref == "latest" else 1,)).fetchone()
+    else:
+        row = db.execute("SELECT id, meta, rows FROM runs WHERE id = ?", (int(ref),)).fetchone()
+    db.close()
+    if not row:
+        return None
+    return row[0], json.loads(row[1]), json.loads(row[2])
+
+
+def _values(rows: List[Dict[str, Any]], col: str) -> List[float]:
+    vals = []
+    for r in rows:
+        v = r.get(col)
+        if isinstance(v, (int, float)) and not isinstance(v, bool) and not math.isnan(v):
+            vals.append(float(v))
+    return vals
+
+
+def _columns(brows: List[Dict[str, Any]], hrows: List[Dict[str, Any]], fixed: List[str],
+             suffixes: Tuple[str, ...]) -> List[str]:
+    """Fixed columns plus optional ones (e.g. dec_<profile>_latency) present in both runs"""
+    common = set().union(*brows) & set().union(*hrows) if brows and hrows else set()
+    extra = sorted(c for c in common if c not in fixed and c.endswith(suffixes))
+    return fixed + extra
+
+
+def cache_hits(rows: List[Dict[str, Any]]) -> int:
+    """Calls answered from the near-duplicate cache (X-Near-Dup: hit) in a run"""
+    return sum(1 for r in rows for c, v in r.items() if c.endswith("_near_dup") and v == "hit")
+
+
+def percentile(vals: List[float], q: float) -> float:
+    s = sorted(vals)
+    if not s:
+        return float("nan")
+    k = (len(s) - 1) * q
+    lo, hi = math.floor(k), math.ceil(k)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def mann_whitney_p(a: List[float], b: List[float]) -> float:
+    """Two-sided Mann-Whitney U p-value (normal approximation with tie correction)"""
+    n1, n2 = len(a), len(b)
+    if n1 == 0 or n2 == 0:
+        return float("nan")
+    pooled = sorted([(v, 0) for v in a] + [(v, 1) for v in b])
+    ranks = [0.0] * len(pooled)
+    tie_term = 0.0
+    i = 0
+    while i < len(pooled):
+        j = i
+        while j + 1 < len(pooled) and pooled[j + 1][0] == pooled[i][0]:
+            j += 1
+        avg = (i + j) / 2 + 1
+        for k in range(i, j + 1):
+            ranks[k] = avg
+        t = j - i + 1
+        tie_term += t ** 3 - t
+        i = j + 1
+
+    r1 = sum(r for r, (_, g) in zip(ranks, pooled) if g == 0)
+    u1 = r1 - n1 * (n1 + 1) / 2
+    mu = n1 * n2 / 2
+    n = n1 + n2
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))) if n > 1 else 0.0
+    if sigma == 0:
+        return 1.0
+    z = (abs(u1 - mu) - 0.5) / sigma   # continuity correction
+    return min(1.0, math.erfc(max(0.0, z) / math.sqrt(2)))
+
+
+def compare_runs(base_ref: str, head_ref: str, max_p95_regression: float = 0.10,
+                 alpha: Optional[float] = None, path: str = RUNS_DB) -> int:
+    """
+    Print a latency/quality diff between two runs.
+    Returns 1 if any p95 latency regresses by more than max_p95_regression (relative),
+    optionally only when the shift is significant at alpha; otherwise 0.
+    """
+    base, head = load_run(base_ref, path), load_run(head_ref, path)
+    if not base or not head:
+        print(f"[error] run not found: {base_ref if not base else head_ref}")
+        return 2
+    (bid, bmeta, brows), (hid, hmeta, hrows) = base, head
+    print(f"[compare] base #{bid} ({bmeta.get('git_sha')})  vs  head #{hid} ({hmeta.get('git_sha')})")
+    for key in ("models", "ollama_opts", "host"):
+        if bmeta.get(key) != hmeta.get(key):
+            print(f"  [note] {key} differs: {bmeta.get(key)} -> {hmeta.get(key)}")
+    for name, rid, rows in (("base", bid, brows), ("head", hid, hrows)):
+        hits = cache_hits(rows)
+        if hits:
+            print(f"  [note] {name} #{rid} has {hits} near-duplicate cache hits: those latencies are not model runs")
+
+    failed = False
+    print("\nLatency [s]            base p50/p95      head p50/p95     Δp95     p-value")
+    for col in _columns(brows, hrows, LATENCY_COLS, ("_latency",)):
+        a, b = _values(brows, col), _values(hrows, col)
+        if not a or not b:
+            continue
+        bp95, hp95 = percentile(a, 0.95), percentile(b, 0.95)
+        change = (hp95 - bp95) / bp95 if bp95 > 0 else 0.0
+        p = mann_whitney_p(a, b)
+        regressed = change > max_p95_regression and (alpha is None or p < alpha)
+        failed = failed or regressed
+        print(f"  {col:<20} {percentile(a, 0.5):7.3f}/{bp95:7.3f}  {percentile(b, 0.5):7.3f}/{hp95:7.3f}"
+              f"  {change:+7.1%}  {p:8.4f}{'  REGRESSION' if regressed else ''}")
+
+    print("\nQuality                base mean   head mean      Δ      p-value")
+    for col in _columns(brows, hrows, QUALITY_COLS, ("_rouge1", "_rouge2", "_rougeL", "_comp")):
+        a, b = _values(brows, col), _values(hrows, col)
+        if not a or not b:
+            continue
+        ma, mb = sum(a) / len(a), sum(b) / len(b)
+        print(f"  {col:<20} {ma:9.4f}  {mb:9.4f}  {mb - ma:+8.4f}  {mann_whitney_p(a, b):8.4f}")
+
+    if failed:
+        print(f"\n[fail] p95 latency regressed by more than {max_p95_regression:.0%}")
+        return 1
+    print("\n[ok] no p95 latency regression beyond threshold")
+    return 0
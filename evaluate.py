@@ -9,6 +9,16 @@
 #   2) Run this script:  python evaluate.py --limit 20
 #      (option) --source gmail  : use recent emails from gmail_service
 #      (option) --source file   : use ./test_emails.json (default)
+#      (option) --precompress_ab : also summarise with extractive pre-compression disabled
+#                                  (budget=0) to compare latency/ROUGE against the default
+#      (option) --sum_mode fast  : /summarize mode to evaluate (fast|hybrid|llm, default hybrid)
+#      (option) --decode_bench greedy,beam2,beam4,assisted
+#                                : also summarise with each decoding profile (dec_<profile>_* columns)
+#                                  and add a speed vs ROUGE table to the report
+#   3) Every run is stored in eval_runs.sqlite3 with its metadata (git sha, models, host CPU):
+#        python evaluate.py --list_runs
+#        python evaluate.py --compare prev latest --max_p95_regression 0.10 [--alpha 0.05]
+#      --compare exits with code 1 when a p95 latency regresses beyond the threshold
 #
 # test_emails.json format (optional):
 # [
@@ -27,6 +37,8 @@ from typing import List, Dict, Any
 import requests
 import pandas as pd
 
+from eval_history import compare_runs, git_sha, host_info, list_runs, save_run
+
 # ---- Optional Dependencies: auto-fallback if not available -------------------
 try:
     from rouge_score import rouge_scorer
@@ -41,16 +53,20 @@ except Exception:
     LANG_OK = False
 
 BASE_URL = os.environ.get("EAA_BASE_URL", "http://localhost:5000")
+# Needed once API keys are issued (see accounts.py)
+HEADERS = {"Authorization": f"Bearer {os.environ['EAA_API_KEY']}"} if os.environ.get("EAA_API_KEY") else {}
 
 
 def safe_post(path: str, payload: Dict[str, Any], timeout=300) -> Dict[str, Any]:
+    """Timed call; result caches are bypassed so every run measures the models, not cache hits"""
     url = f"{BASE_URL}{path}"
     t0 = time.perf_counter()
     try:
-        r = requests.post(url, json=payload, timeout=timeout)
+        r = requests.post(url, json={**payload, "no_cache": True}, timeout=timeout, headers=HEADERS)
         latency = time.perf_counter() - t0
         r.raise_for_status()
-        return {"ok": True, "json": r.json(), "latency": latency}
+        # X-Near-Dup: hit | miss | off (bypassed); kept per row so a cached timing is visible
+        return {"ok": True, "json": r.json(), "latency": latency, "near_dup": r.headers.get("X-Near-Dup", "")}
     except Exception as e:
         return {"ok": False, "error": str(e), "latency": time.perf_counter() - t0}
 
@@ -59,7 +75,7 @@ def safe_get(path: str, timeout=300) -> Dict[str, Any]:
     url = f"{BASE_URL}{path}"
     t0 = time.perf_counter()
     try:
-        r = requests.get(url, timeout=timeout)
+        r = requests.get(url, timeout=timeout, headers=HEADERS)
         latency = time.perf_counter() - t0
         r.raise_for_status()
         return {"ok": True, "json": r.json(), "latency": latency}
@@ -67,6 +83,20 @@ def safe_get(path: str, timeout=300) -> Dict[str, Any]:
         return {"ok": False, "error": str(e), "latency": time.perf_counter() - t0}
 
 
+def load_api_emails(limit: int) -> List[Dict[str, Any]]:
+    """Metadata page from /api/emails, then each body from /api/emails/<id>"""
+    items: List[Dict[str, Any]] = []
+    res = safe_get(f"/api/emails?limit={limit}")
+    if not res["ok"]:
+        print("[warn] /api/emails failed:", res.get("error"))
+        return items
+    for it in (res["json"].get("items") or [])[:limit]:
+        body = safe_get(f"/api/emails/{it.get('message_id', '')}")
+        text = (body.get("json", {}) or {}).get("text", "") if body["ok"] else ""
+        items.append({"text": text, "subject": it.get("subject", "")})
+    return items
+
+
 def load_dataset(source: str, limit: int) -> List[Dict[str, Any]]:
     """
     source == 'gmail'  : fetch from /api/emails
@@ -75,12 +105,7 @@ def load_dataset(source: str, limit: int) -> List[Dict[str, Any]]:
     items: List[Dict[str, Any]] = []
 
     if source == "gmail":
-        res = safe_get("/api/emails")
-        if res["ok"]:
-            for it in res["json"][:limit]:
-                items.append({"text": it.get("text", ""), "subject": it.get("subject", "")})
-        else:
-            print("[warn] /api/emails failed:", res.get("error"))
+        items = load_api_emails(limit)
     else:
         # Prefer file first
         if os.path.exists("test_emails.json"):
@@ -98,12 +123,7 @@ def load_dataset(source: str, limit: int) -> List[Dict[str, Any]]:
 
         # Fallback: API
         if not items:
-            res = safe_get("/api/emails")
-            if res["ok"]:
-                for it in res["json"][:limit]:
-                    items.append({"text": it.get("text", ""), "subject": it.get("subject", "")})
-            else:
-                print("[warn] /api/emails failed:", res.get("error"))
+            items = load_api_emails(limit)
 
     # Simple Summary
     items = [it for it in items if (it.get("text") or "").strip()]
@@ -143,7 +163,8 @@ def distinct_n(text: str, n: int) -> float:
     return round(len(ngrams) / max(1, (len(tokens)-n+1)), 4)
 
 
-def evaluate_item(item: Dict[str, Any]) -> Dict[str, Any]:
+def evaluate_item(item: Dict[str, Any], precompress_ab: bool = False,
+                  sum_mode: str = "hybrid", decode_profiles: List[str] = ()) -> Dict[str, Any]:
     text = item.get("text", "")
     subject = item.get("subject", "")
     ref_summary = item.get("ref_summary", "")
@@ -156,9 +177,10 @@ def evaluate_item(item: Dict[str, Any]) -> Dict[str, Any]:
     }
 
     # 1) Fast summary
-    r1 = safe_post("/summarize", {"text": text})
+    r1 = safe_post("/summarize", {"text": text, "mode": sum_mode})
     out["sum_fast_ok"] = r1["ok"]
     out["sum_fast_latency"] = round(r1.get("latency", 0.0), 3)
+    out["sum_fast_near_dup"] = r1.get("near_dup", "")
     sum_fast = (r1.get("json", {}) or {}).get("summary", "") if r1["ok"] else ""
     out["sum_fast"] = sum_fast
     out["sum_fast_comp"] = compression_ratio(text, sum_fast)
@@ -168,6 +190,34 @@ def evaluate_item(item: Dict[str, Any]) -> Dict[str, Any]:
         out["sum_fast_rouge2"] = rouge.get("rouge2", "")
         out["sum_fast_rougeL"] = rouge.get("rougeL", "")
 
+    # 1-b) Same summary without extractive pre-compression (quality vs latency A/B)
+    if precompress_ab:
+        r1b = safe_post("/summarize", {"text": text, "mode": sum_mode, "budget": 0})
+        out["sum_full_ok"] = r1b["ok"]
+        out["sum_full_latency"] = round(r1b.get("latency", 0.0), 3)
+        sum_full = (r1b.get("json", {}) or {}).get("summary", "") if r1b["ok"] else ""
+        out["sum_full"] = sum_full
+        out["sum_full_comp"] = compression_ratio(text, sum_full)
+        if ref_summary:
+            rouge = compute_rouge(sum_full, ref_summary)
+            out["sum_full_rouge1"] = rouge.get("rouge1", "")
+            out["sum_full_rouge2"] = rouge.get("rouge2", "")
+            out["sum_full_rougeL"] = rouge.get("rougeL", "")
+
+    # 1-c) Decoding profile benchmark (decode overrides never use the near-dup cache)
+    for prof in decode_profiles:
+        rd = safe_post("/summarize", {"text": text, "mode": sum_mode, "decode": prof})
+        key = f"dec_{prof}"
+        out[f"{key}_ok"] = rd["ok"]
+        out[f"{key}_latency"] = round(rd.get("latency", 0.0), 3)
+        sum_dec = (rd.get("json", {}) or {}).get("summary", "") if rd["ok"] else ""
+        out[f"{key}_comp"] = compression_ratio(text, sum_dec)
+        if ref_summary:
+            rouge = compute_rouge(sum_dec, ref_summary)
+            out[f"{key}_rouge1"] = rouge.get("rouge1", "")
+            out[f"{key}_rouge2"] = rouge.get("rouge2", "")
+            out[f"{key}_rougeL"] = rouge.get("rougeL", "")
+
     # 2) LLM summary
     r2 = safe_post("/summarize_llm", {"text": text})
     out["sum_llm_ok"] = r2["ok"]
@@ -185,6 +235,7 @@ def evaluate_item(item: Dict[str, Any]) -> Dict[str, Any]:
     r3 = safe_post("/sentiment", {"text": text})
     out["sent_ok"] = r3["ok"]
     out["sent_latency"] = round(r3.get("latency", 0.0), 3)
+    out["sent_near_dup"] = r3.get("near_dup", "")
     if r3["ok"]:
         js = r3.get("json", {})
         out["sent_label"] = js.get("label", "")
@@ -195,6 +246,7 @@ def evaluate_item(item: Dict[str, Any]) -> Dict[str, Any]:
     r4_en = safe_post("/reply", {"text": text, "lang": "en"})
     out["reply_en_ok"] = r4_en["ok"]
     out["reply_en_latency"] = round(r4_en.get("latency", 0.0), 3)
+    out["reply_en_near_dup"] = r4_en.get("near_dup", "")
     reply_en = (r4_en.get("json", {}) or {}).get("reply", "") if r4_en["ok"] else ""
     out["reply_en"] = reply_en
     out["reply_en_len"] = len(reply_en.split())
@@ -204,6 +256,7 @@ def evaluate_item(item: Dict[str, Any]) -> Dict[str, Any]:
     r4_ko = safe_post("/reply", {"text": text, "lang": "ko"})
     out["reply_ko_ok"] = r4_ko["ok"]
     out["reply_ko_latency"] = round(r4_ko.get("latency", 0.0), 3)
+    out["reply_ko_near_dup"] = r4_ko.get("near_dup", "")
     reply_ko = (r4_ko.get("json", {}) or {}).get("reply", "") if r4_ko["ok"] else ""
     out["reply_ko"] = reply_ko
     out["reply_ko_len"] = len(reply_ko.split())
@@ -242,6 +295,7 @@ def summarize_table(df: pd.DataFrame) -> str:
     # Success Rate
     for key, label in [
         ("sum_fast_ok", "Summary(Fast) success"),
+        ("sum_full_ok", "Summary(No pre-compression) success"),
         ("sum_llm_ok", "Summary(LLM) success"),
         ("sent_ok", "Sentiment success"),
         ("reply_en_ok", "Reply EN success"),
@@ -256,6 +310,7 @@ def summarize_table(df: pd.DataFrame) -> str:
     # Latency
     for key, label in [
         ("sum_fast_latency", "Latency Summary(Fast) [s]"),
+        ("sum_full_latency", "Latency Summary(No pre-compression) [s]"),
         ("sum_llm_latency", "Latency Summary(LLM) [s]"),
         ("sent_latency", "Latency Sentiment [s]"),
         ("reply_en_latency", "Latency Reply EN [s]"),
@@ -271,6 +326,7 @@ def summarize_table(df: pd.DataFrame) -> str:
     # Summarisation Compression Ratio (lower = more compressed)
     for key, label in [
         ("sum_fast_comp", "Compression(Fast)"),
+        ("sum_full_comp", "Compression(No pre-compression)"),
         ("sum_llm_comp", "Compression(LLM)"),
     ]:
         if key in df.columns:
@@ -281,6 +337,7 @@ def summarize_table(df: pd.DataFrame) -> str:
     # ROUGE (if avaliable)
     if "sum_fast_rouge1" in df.columns:
         for rkey in ["sum_fast_rouge1","sum_fast_rouge2","sum_fast_rougeL",
+                     "sum_full_rouge1","sum_full_rouge2","sum_full_rougeL",
                      "sum_llm_rouge1","sum_llm_rouge2","sum_llm_rougeL"]:
             if rkey in df.columns:
                 vals = [v for v in df[rkey].tolist() if isinstance(v, (int, float))]
@@ -302,13 +359,36 @@ def summarize_table(df: pd.DataFrame) -> str:
     return "\n".join(lines)
 
 
-def write_markdown_report(df: pd.DataFrame, path_md="evaluation_report.md"):
+def decode_bench_table(df: pd.DataFrame, profiles: List[str]) -> str:
+    """Markdown table: latency vs quality per decoding profile"""
+    def mean_of(col):
+        vals = [v for v in df[col].tolist() if isinstance(v, (int, float))] if col in df.columns else []
+        return round(statistics.mean(vals), 3) if vals else "-"
+
+    def p95_of(col):
+        vals = sorted(v for v in df[col].tolist() if isinstance(v, (int, float))) if col in df.columns else []
+        return round(vals[min(len(vals) - 1, int(0.95 * len(vals)))], 3) if vals else "-"
+
+    lines = ["| Profile | Latency mean [s] | Latency p95 [s] | ROUGE-1 | ROUGE-2 | ROUGE-L | Compression |",
+             "|---|---|---|---|---|---|---|"]
+    for prof in profiles:
+        k = f"dec_{prof}"
+        lines.append(f"| {prof} | {mean_of(k + '_latency')} | {p95_of(k + '_latency')} | {mean_of(k + '_rouge1')} "
+                     f"| {mean_of(k + '_rouge2')} | {mean_of(k + '_rougeL')} | {mean_of(k + '_comp')} |")
+    return "\n".join(lines)
+
+
+def write_markdown_report(df: pd.DataFrame, path_md="evaluation_report.md", decode_profiles: List[str] = ()):
     md = []
     md.append("# Email AI Assistant — Evaluation Report\n")
     md.append(f"Generated at: `{time.strftime('%Y-%m-%d %H:%M:%S')}`\n")
     md.append("## Summary\n")
     md.append(summarize_table(df) + "\n")
 
+    if decode_profiles:
+        md.append("## Decoding Profiles (speed vs ROUGE)\n")
+        md.append(decode_bench_table(df, decode_profiles) + "\n")
+
     md.append("## Methodology\n")
     md.append(
         "- Fast Summary: Call pre-built extractive/compressive summarization pipeline\n"
@@ -318,6 +398,8 @@ def write_markdown_report(df: pd.DataFrame, path_md="evaluation_report.md"):
         "- Translate: Use LLM translation (`/translate_llm`) and verify result with language detection\n"
         "- Latency: Measure wall-clock time for each API call\n"
         "- (Optional) ROUGE: Calculate if `ref_summary` is provided in test_emails.json\n"
+        "- (Optional) Pre-compression A/B: `sum_full_*` columns summarise with `budget=0` (`--precompress_ab`)\n"
+        "- (Optional) Decoding benchmark: `dec_<profile>_*` columns summarise with `decode=<profile>` (`--decode_bench`)\n"
     )
 
     md.append("## Sample Rows (first 5)\n")
@@ -335,21 +417,45 @@ def main():
     ap.add_argument("--limit", type=int, default=20, help="Number of samples to evaluate")
     ap.add_argument("--out_csv", default="evaluation_results.csv")
     ap.add_argument("--out_md", default="evaluation_report.md")
+    ap.add_argument("--sum_mode", choices=["fast","hybrid","llm"], default="hybrid",
+                    help="mode passed to /summarize")
+    ap.add_argument("--precompress_ab", action="store_true",
+                    help="Also summarise with extractive pre-compression disabled (latency/ROUGE comparison)")
+    ap.add_argument("--decode_bench", default="",
+                    help="Comma list of decoding profiles to benchmark, e.g. greedy,beam2,beam4,assisted")
+    ap.add_argument("--list_runs", action="store_true", help="List stored evaluation runs and exit")
+    ap.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"),
+                    help="Compare two stored runs (id | latest | prev) and exit")
+    ap.add_argument("--max_p95_regression", type=float, default=0.10,
+                    help="Relative p95 latency increase that fails --compare (default 0.10)")
+    ap.add_argument("--alpha", type=float, default=None,
+                    help="Only fail --compare when the shift is significant at this level")
     args = ap.parse_args()
 
+    if args.list_runs:
+        for rid, created, meta in list_runs():
+            print(f"  #{rid}  {created}  {meta.get('git_sha')}  n={meta.get('samples')}  "
+                  f"source={meta.get('args', {}).get('source')}")
+        return 0
+    if args.compare:
+        return compare_runs(args.compare[0], args.compare[1],
+                            max_p95_regression=args.max_p95_regression, alpha=args.alpha)
+
     print(f"[info] BASE_URL = {BASE_URL}")
     print(f"[info] loading dataset from: {args.source}")
 
     items = load_dataset(args.source, args.limit)
     if not items:
         print("[error] No data available for evaluation.")
-        return
+        return 1
 
+    decode_profiles = [p.strip() for p in args.decode_bench.split(",") if p.strip()]
     rows = []
     for i, it in enumerate(items, 1):
         print(f"  - evaluating {i}/{len(items)} …")
         try:
-            rows.append(evaluate_item(it))
+            rows.append(evaluate_item(it, precompress_ab=args.precompress_ab, sum_mode=args.sum_mode,
+                                      decode_profiles=decode_profiles))
         except Exception as e:
             print("    [warn] item failed:", e)
             rows.append({"subject":"(error)", "error": str(e)})
@@ -358,12 +464,28 @@ def main():
     df.to_csv(args.out_csv, index=False, encoding="utf-8-sig")
     print(f"[ok] CSV saved -> {args.out_csv}")
 
-    write_markdown_report(df, args.out_md)
+    write_markdown_report(df, args.out_md, decode_profiles)
+
+    info = safe_get("/api/info")
+    meta = {
+        "git_sha": git_sha(),
+        "base_url": BASE_URL,
+        "samples": len(rows),
+        "models": (info.get("json") or {}).get("models") if info["ok"] else None,
+        "ollama_opts": (info.get("json") or {}).get("ollama_opts") if info["ok"]
+                       else os.environ.get("OLLAMA_OPTS"),
+        "host": host_info(),
+        "cache": "bypassed (no_cache)",
+        "args": vars(args),
+    }
+    run_id = save_run(rows, meta)
+    print(f"[ok] Run stored -> #{run_id} (compare with: python evaluate.py --compare prev latest)")
 
     print("\n[done] Evaluation complete.")
     print("  - Use the Markdown report for your project write-up.")
     print("  - Attach CSV as raw results appendix if needed.")
+    return 0
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    raise SystemExit(main())
\ No newline at end of file
@@ -1,6 +1,13 @@
 import os.path
+import asyncio
 import base64
+import codecs
 import re
+import datetime
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -9,90 +16,402 @@ from googleapiclient.discovery import build
 # Permission scopes for Gmail API
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 
+# Accounts: "default" keeps the legacy token.json, others use <GMAIL_TOKENS_DIR>/<account>.json
+DEFAULT_ACCOUNT = "default"
+TOKENS_DIR = os.getenv("GMAIL_TOKENS_DIR", "tokens")
+REFRESH_MARGIN_S = 600   # tokens this close to expiry are refreshed in the background
 
-def get_gmail_service():
-    """Create Gmail API service object after OAuth authentication"""
-    creds = None
 
-    # Use token.json
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+class _CredEntry:
+    def __init__(self):
+        self.creds = None
+        self.lock = threading.Lock()   # serialises load/refresh of this account only
+        self.refreshing = False
 
-    # If missing or expired, perform new authentication
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save after authentication
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-
-    # Create Gmail service object
+
+_cred_cache = {}
+_cred_cache_lock = threading.Lock()
+_refresh_executor = ThreadPoolExecutor(max_workers=2)
+
+
+def token_path(account=DEFAULT_ACCOUNT):
+    if account == DEFAULT_ACCOUNT:
+        return 'token.json'
+    return os.path.join(TOKENS_DIR, f"{account}.json")
+
+
+def _cred_entry(account):
+    with _cred_cache_lock:
+        return _cred_cache.setdefault(account, _CredEntry())
+
+
+def _save_token(account, creds):
+    path = token_path(account)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as token:
+        token.write(creds.to_json())
+
+
+def _expires_soon(creds):
+    # google-auth keeps expiry as a naive UTC datetime
+    expiry = getattr(creds, 'expiry', None)
+    if expiry is None:
+        return False
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return (expiry - now).total_seconds() < REFRESH_MARGIN_S
+
+
+def _background_refresh(account, entry):
+    try:
+        with entry.lock:
+            if entry.creds is not None and _expires_soon(entry.creds):
+                entry.creds.refresh(Request())
+                _save_token(account, entry.creds)
+    except Exception as e:
+        print(f"[gmail] background token refresh failed for {account}: {e}")
+    finally:
+        entry.refreshing = False
+
+
+def authorize_account(account=DEFAULT_ACCOUNT):
+    """Interactive OAuth consent for an account; stores its token file"""
+    flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+    creds = flow.run_local_server(port=0)
+    _save_token(account, creds)
+    _cred_entry(account).creds = creds
+    return creds
+
+
+def get_credentials(account=DEFAULT_ACCOUNT):
+    """
+    Cached credentials of an account.
+    Expired tokens are refreshed under that account's lock only; tokens close to
+    expiry are refreshed in the background while the current token keeps serving.
+    """
+    entry = _cred_entry(account)
+    creds = entry.creds
+    if creds is None or not creds.valid:
+        with entry.lock:
+            creds = entry.creds
+            if creds is None and os.path.exists(token_path(account)):
+                creds = Credentials.from_authorized_user_file(token_path(account), SCOPES)
+            if creds and not creds.valid and creds.expired and creds.refresh_token:
+                creds.refresh(Request())
+                _save_token(account, creds)
+            if not creds or not creds.valid:
+                if account != DEFAULT_ACCOUNT:
+                    # Never open a browser flow from a server request for another user's mailbox
+                    raise PermissionError(
+                        f"Gmail account '{account}' is not authorised "
+                        f"(run: python gmail_service.py --auth {account})")
+                creds = authorize_account(account)
+            entry.creds = creds
+    elif creds.refresh_token and not entry.refreshing and _expires_soon(creds):
+        entry.refreshing = True
+        _refresh_executor.submit(_background_refresh, account, entry)
+    return creds
+
+
+def get_gmail_service(account=DEFAULT_ACCOUNT):
+    """Create Gmail API service object for an account (credentials are cached per account)"""
+    creds = get_credentials(account)
+
+    # Service objects are not thread-safe, so one is built per call
     service = build('gmail', 'v1', credentials=creds)
     return service
 
 
+# Body extraction limits (bounded cost on huge newsletters)
+MAX_PART_BYTES = 512 * 1024      # decoded bytes read from any one part
+MAX_HTML_CHARS = 256 * 1024      # HTML fed to the text converter
+MAX_BODY_CHARS = 20000           # converted text kept per message
+
+_BLOCK_TAGS = {
+    "p", "div", "br", "tr", "li", "ul", "ol", "table", "section", "article",
+    "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "hr",
+}
+_SKIP_TAGS = {"script", "style", "head", "title", "noscript", "template"}
+
+
+class _HTMLToText(HTMLParser):
+    """Single-pass HTML -> text (linear time, stops once MAX_BODY_CHARS is collected)"""
+
+    def __init__(self, limit=MAX_BODY_CHARS):
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+        self.skip_depth = 0
+        self.full = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self.skip_depth or self.full:
+            return
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= self.limit:
+            self.full = True
+
+
+def html_to_text(html, limit=MAX_BODY_CHARS):
+    parser = _HTMLToText(limit=limit)
+    html = html[:MAX_HTML_CHARS]
+    # Feed in slices so very large documents can stop early
+    step = 16 * 1024
+    for i in range(0, len(html), step):
+        parser.feed(html[i:i + step])
+        if parser.full:
+            break
+    else:
+        parser.close()
+    return "".join(parser.parts)
+
+
+def normalize_body(text):
+    """Unicode NFC, unified newlines, collapsed blank runs and inline whitespace"""
+    text = unicodedata.normalize("NFC", text or "").replace("\r\n", "\n").replace("\r", "\n")
+    text = text.replace("\u00a0", " ").replace("\u200b", "")
+    lines = [" ".join(ln.split()) for ln in text.split("\n")]
+    text = "\n".join(lines)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()[:MAX_BODY_CHARS]
+
+
+def _headers(part):
+    return {h.get("name", "").lower(): h.get("value", "") for h in part.get("headers", []) or []}
+
+
+def _is_attachment(part, headers):
+    body = part.get("body", {}) or {}
+    if part.get("filename") or body.get("attachmentId"):
+        return True
+    return headers.get("content-disposition", "").lower().startswith("attachment")
+
+
+def _charset(headers):
+    m = re.search(r'charset="?([\w\-.:]+)"?', headers.get("content-type", ""), re.IGNORECASE)
+    if m:
+        try:
+            return codecs.lookup(m.group(1)).name
+        except LookupError:
+            pass
+    return "utf-8"
+
+
+def _decode_part(data, charset):
+    # Only decode the first MAX_PART_BYTES (base64 quanta are 4 chars -> 3 bytes)
+    limit = (MAX_PART_BYTES // 3) * 4
+    data = data[:limit]
+    data += "=" * (-len(data) % 4)
+    raw = base64.urlsafe_b64decode(data.encode("ASCII"))
+    return raw.decode(charset, errors="replace")
+
+
 def extract_body_from_payload(payload):
-    """Extract email body (text/plain or HTML) handling various structures"""
-    def decode_base64(data):
-        return base64.urlsafe_b64decode(data.encode('ASCII')).decode('utf-8', errors='ignore')
-
-    def get_plain_text(part):
-        mime_type = part.get("mimeType", "")
-        data = part.get("body", {}).get("data", "")
-        if mime_type == "text/plain" and data:
-            return decode_base64(data)
-        elif mime_type == "text/html" and data:
-            html = decode_base64(data)
-            return re.sub('<[^<]+?>', '', html)
-        return ""
-
-    # 1. Attempt to extract outermost body
-    if "body" in payload and payload["body"].get("data"):
-        return decode_base64(payload["body"]["data"])
-
-    # 2. Handle single-level parts
-    if "parts" in payload:
-        for part in payload["parts"]:
-            body = get_plain_text(part)
-            if body:
-                return body.strip()
-
-            # 3. Recursively handle nested parts
-            if "parts" in part:
-                for subpart in part["parts"]:
-                    body = get_plain_text(subpart)
-                    if body:
-                        return body.strip()
+    """
+    Extract email body from a Gmail payload of any nesting depth.
+    - text/plain preferred, text/html converted to text otherwise
+    - Attachment parts are skipped without decoding
+    - Each part is decoded with its declared charset
+    """
+    plain, html = None, None
+    stack = [payload or {}]
+    while stack:
+        part = stack.pop()
+        headers = _headers(part)
+        if part.get("parts"):
+            # Reverse so parts are visited in document order
+            stack.extend(reversed(part["parts"]))
+            continue
+        if _is_attachment(part, headers):
+            continue
+
+        mime_type = (part.get("mimeType") or "").lower()
+        data = (part.get("body", {}) or {}).get("data", "")
+        if not data:
+            continue
+        if mime_type == "text/plain" and plain is None:
+            plain = _decode_part(data, _charset(headers))
+            break  # plain text wins; nothing else needs decoding
+        if mime_type == "text/html" and html is None:
+            html = _decode_part(data, _charset(headers))
+        elif not mime_type and plain is None:
+            plain = _decode_part(data, _charset(headers))
 
+    if plain and plain.strip():
+        return normalize_body(plain)
+    if html:
+        return normalize_body(html_to_text(html))
     return "(No readable body found)"
 
 
+METADATA_HEADERS = ['Subject', 'From', 'Date']
 
-def get_recent_emails(max_results=5):
-    """Fetch the most recent email bodies (max_results)"""
-    service = get_gmail_service()
+
+def _message_meta(msg):
+    """id / threadId / header metadata of a Gmail message resource"""
+    headers = _headers(msg.get('payload', {}) or {})
+    return {
+        "id": msg.get('id'),
+        "threadId": msg.get('threadId', ''),
+        "internalDate": int(msg.get('internalDate', 0) or 0),
+        "subject": headers.get('subject', ''),
+        "from": headers.get('from', ''),
+        "date": headers.get('date', ''),
+        "snippet": msg.get('snippet', ''),
+    }
+
+
+def list_messages(max_results=20, page_token=None, account=DEFAULT_ACCOUNT):
+    """One page of inbox metadata (no bodies) and the next page token"""
+    service = get_gmail_service(account)
+    results = service.users().messages().list(
+        userId='me', labelIds=['INBOX'], maxResults=max_results, pageToken=page_token).execute()
+    ids = [m['id'] for m in results.get('messages', [])]
+
+    # Batch the metadata gets into one HTTP round trip
+    found = {}
+
+    def on_meta(request_id, response, exception):
+        if exception is None:
+            found[request_id] = _message_meta(response)
+        else:
+            print(f"[gmail] metadata {request_id} failed: {exception}")
+
+    if ids:
+        batch = service.new_batch_http_request(callback=on_meta)
+        for msg_id in ids:
+            batch.add(service.users().messages().get(
+                userId='me', id=msg_id, format='metadata', metadataHeaders=METADATA_HEADERS),
+                request_id=msg_id)
+        batch.execute()
+
+    return [found[i] for i in ids if i in found], results.get('nextPageToken')
+
+
+def get_message(msg_id, account=DEFAULT_ACCOUNT):
+    """Metadata plus extracted body of a single message"""
+    service = get_gmail_service(account)
+    msg = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
+    item = _message_meta(msg)
+    item["body"] = extract_body_from_payload(msg.get('payload', {}))
+    return item
+
+
+def get_recent_messages(max_results=5, account=DEFAULT_ACCOUNT):
+    """Fetch the most recent messages as dicts (metadata from _message_meta + body)"""
+    service = get_gmail_service(account)
 
     results = service.users().messages().list(
         userId='me', labelIds=['INBOX'], maxResults=max_results).execute()
     messages = results.get('messages', [])
 
-    email_bodies = []
+    items = []
     for msg in messages:
         msg_data = service.users().messages().get(
             userId='me', id=msg['id'], format='full').execute()
-        payload = msg_data.get('payload', {})
-        body = extract_body_from_payload(payload)
-        email_bodies.append(body)
+        item = _message_meta(msg_data)
+        item["body"] = extract_body_from_payload(msg_data.get('payload', {}))
+        items.append(item)
+
+    return items
+
+
+def get_recent_emails(max_results=5, account=DEFAULT_ACCOUNT):
+    """Fetch the most recent email bodies (max_results)"""
+    return [m["body"] for m in get_recent_messages(max_results=max_results, account=account)]
+
+
+# ----------------------------
+# Async Gmail REST (asgi_app): same results as the functions above, no thread per call
+# ----------------------------
+GMAIL_API = "https://gmail.googleapis.com/gmail/v1/users/me"
+ASYNC_CONCURRENCY = int(os.getenv("GMAIL_ASYNC_CONCURRENCY", "10"))   # parallel metadata gets
+_aclient = None
+
+
+def _async_client():
+    # One pooled client per process; httpx is only needed by the async path
+    global _aclient
+    if _aclient is None:
+        import httpx
+        _aclient = httpx.AsyncClient(base_url=GMAIL_API, timeout=30.0,
+                                     limits=httpx.Limits(max_connections=50, max_keepalive_connections=20))
+    return _aclient
+
+
+async def _aget(account, path, params=None):
+    entry = _cred_entry(account)
+    creds = entry.creds
+    if creds is None or not creds.valid or (creds.refresh_token and _expires_soon(creds)):
+        # Loading / refreshing may block on file or network I/O
+        creds = await asyncio.to_thread(get_credentials, account)
+    resp = await _async_client().get(path, params=params,
+                                     headers={"Authorization": f"Bearer {creds.token}"})
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def alist_messages(max_results=20, page_token=None, account=DEFAULT_ACCOUNT):
+    """Async list_messages(): one page of inbox metadata and the next page token"""
+    params = {"labelIds": "INBOX", "maxResults": max_results}
+    if page_token:
+        params["pageToken"] = page_token
+    results = await _aget(account, "/messages", params)
+    ids = [m['id'] for m in results.get('messages', [])]
+
+    sem = asyncio.Semaphore(ASYNC_CONCURRENCY)
+
+    async def meta(msg_id):
+        async with sem:
+            try:
+                msg = await _aget(account, f"/messages/{msg_id}",
+                                  [("format", "metadata")] + [("metadataHeaders", h) for h in METADATA_HEADERS])
+                return _message_meta(msg)
+            except Exception as e:
+                print(f"[gmail] metadata {msg_id} failed: {e}")
+                return None
+
+    metas = await asyncio.gather(*(meta(i) for i in ids))
+    return [m for m in metas if m], results.get('nextPageToken')
+
 
-    return email_bodies
+async def aget_message(msg_id, account=DEFAULT_ACCOUNT):
+    """Async get_message(): metadata plus extracted body"""
+    msg = await _aget(account, f"/messages/{msg_id}", {"format": "full"})
+    item = _message_meta(msg)
+    item["body"] = extract_body_from_payload(msg.get('payload', {}))
+    return item
 
 
-# For test execution
+# For test execution / adding a mailbox: python gmail_service.py --auth <account>
+# (prints the account's API key; --new-key <account> replaces a lost or leaked key;
+#  --new-key default makes the default mailbox require a key as well)
 if __name__ == "__main__":
+    import sys
+    if len(sys.argv) == 3 and sys.argv[1] in ("--auth", "--new-key"):
+        from accounts import AccountKeys, normalize_account
+        account = normalize_account(sys.argv[2])
+        if sys.argv[1] == "--auth":
+            authorize_account(account)
+            print(f"Saved token for {account} -> {token_path(account)}")
+        if account != DEFAULT_ACCOUNT or sys.argv[1] == "--new-key":
+            key = AccountKeys().issue(account)
+            print(f"API key for {account} (send as 'Authorization: Bearer <key>'; shown once): {key}")
+        sys.exit(0)
     emails = get_recent_emails()
     for i, email in enumerate(emails, 1):
         print(f"\n----- Email {i} -----\n{email[:500]}...\n")
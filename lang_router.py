@@ -0,0 +1,99 @@
+# lang_router.py
+# Per-segment language routing for summarisation.
+# Each paragraph is classified by its Hangul share of letters (long mixed paragraphs per
+# sentence) and segments are grouped by language. A small group is folded into the other one
+# so a signature does not cost a second model: a Korean sign-off ("감사합니다. 김철수 드림")
+# is passed through by the English model rather than loading mT5 for it, and a small English
+# group joins a Korean mail (mT5 copes with a few English words).
+# Group shares are measured in words: a Hangul word carries ~3 letters of an English one's ~5,
+# but about the same content.
+
+import os
+import re
+from typing import List, Tuple
+
+KO_RATIO = float(os.getenv("LANG_KO_RATIO", "0.3"))              # Hangul share of letters -> "ko"
+MIN_GROUP_SHARE = float(os.getenv("LANG_MIN_GROUP_SHARE", "0.15"))  # smaller groups join the other one
+MIN_LETTERS = 8          # shorter segments (names, numbers, sign-offs) follow their neighbours
+MIN_KO_LETTERS = MIN_LETTERS * 4   # a smaller Korean group is not worth an mT5 pass
+MIXED_BAND = (0.1, 0.9)  # paragraphs in this band are split and classified per sentence
+
+_PARA_RE = re.compile(r"\n[ \t]*\n")
+_SENT_RE = re.compile(r"(?<=[\.\?\!。])\s+|\n")
+_HANGUL_RE = re.compile(r"[가-힣ㄱ-ㆎ]")
+_LETTER_RE = re.compile(r"[^\W\d_]", re.UNICODE)
+_WORD_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+
+def hangul_ratio(text: str) -> Tuple[float, int]:
+    """(Hangul share of letters, letter count)"""
+    letters = len(_LETTER_RE.findall(text or ""))
+    if not letters:
+        return 0.0, 0
+    return len(_HANGUL_RE.findall(text)) / letters, letters
+
+
+def _segments(text: str) -> List[Tuple[str, float, int]]:
+    out = []
+    for para in _PARA_RE.split(text or ""):
+        para = para.strip()
+        if not para:
+            continue
+        ratio, letters = hangul_ratio(para)
+        if MIXED_BAND[0] < ratio < MIXED_BAND[1]:
+            for sent in _SENT_RE.split(para):
+                if sent.strip():
+                    out.append((sent.strip(), *hangul_ratio(sent)))
+        else:
+            out.append((para, ratio, letters))
+    return out
+
+
+def word_count(text: str) -> int:
+    """Letter runs: an English word or a Korean eojeol (word + particles) each count once"""
+    return len(_WORD_RE.findall(text or ""))
+
+
+def classify_segments(text: str, ko_ratio: float = KO_RATIO) -> List[Tuple[str, str, int]]:
+    """[(lang, segment, words)] in document order; lang is 'ko' or 'en'"""
+    segs = _segments(text)
+    labels = [("ko" if r >= ko_ratio else "en") if n >= MIN_LETTERS else None for _, r, n in segs]
+
+    # Too-short segments take the previous label (or the next one at the start);
+    # if every segment is short, the whole text decides
+    whole = "ko" if hangul_ratio(text)[0] >= ko_ratio else "en"
+    prev = next((lb for lb in labels if lb), whole)
+    for i, lb in enumerate(labels):
+        if lb is None:
+            labels[i] = prev
+        prev = labels[i]
+    return [(lb, s, word_count(s)) for lb, (s, _, _) in zip(labels, segs)]
+
+
+def route_languages(text: str, ko_ratio: float = KO_RATIO,
+                    min_share: float = MIN_GROUP_SHARE) -> List[Tuple[str, str]]:
+    """
+    Group an email by language: [(lang, text)] ordered by first appearance.
+    A Korean group under min_share of the words or MIN_KO_LETTERS Hangul letters is merged
+    into the English group; otherwise an English group under min_share joins the Korean one.
+    """
+    classified = classify_segments(text, ko_ratio)
+    if not classified:
+        return []
+
+    words = {"en": 0, "ko": 0}
+    for lb, _, n in classified:
+        words[lb] += n
+    total = sum(words.values()) or 1
+    ko_letters = sum(len(_HANGUL_RE.findall(seg)) for lb, seg, _ in classified if lb == "ko")
+    target = None
+    if words["en"] and words["ko"]:
+        if words["ko"] / total < min_share or ko_letters < MIN_KO_LETTERS:
+            target = "en"
+        elif words["en"] / total < min_share:
+            target = "ko"
+
+    groups: dict = {}
+    for lb, seg, _ in classified:
+        groups.setdefault(target or lb, []).append(seg)
+    return [(lb, "\n\n".join(parts)) for lb, parts in groups.items()]
@@ -0,0 +1,261 @@
+# llm_profiles.py
+# Task-aware generation settings for the local LLM (Ollama).
+# - Each task (reply / summary / translate) has a token budget scaled to its input and
+#   output language, its own stop sequences and temperature, merged with the global OLLAMA_OPTS
+# - A streaming monitor ends generation at the structural end of the output:
+#   after the sign-off + name line that follows a reply's body, after the requested sentence
+#   count of a summary
+# - Tokens generated / budgeted / saved are recorded per call for /api/llm_stats
+
+import os
+import re
+import time
+import shlex
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+from cost_model import count_tokens
+from lang_router import KO_RATIO, hangul_ratio
+
+# num_predict = clamp(base + per_word * input words, min, max) * LLM_BUDGET_SCALE
+LLM_PROFILES = {
+    "reply": {"base": 96, "per_word": 0.4, "min": 96, "max": 384, "temperature": 0.3,
+              "stop": ["--- EMAIL", "\n---"]},
+    "summary": {"base": 48, "per_word": 0.1, "min": 64, "max": 160, "temperature": 0.2,
+                "stop": ["--- EMAIL", "\n---"], "sentences": 3},
+    # Sized for Korean output (~2-3 LLM tokens per source word), so not scaled by LANG_BUDGET
+    "translate": {"base": 16, "per_word": 2.5, "min": 32, "max": 1024, "temperature": 0.1,
+                  "stop": ["--- TEXT"]},
+}
+# Reply / summary budgets are sized for English output; Korean costs ~1 token per syllable,
+# about 2.5x the tokens for the same content
+LANG_BUDGET = {"en": 1.0, "ko": 2.5}
+LLM_BUDGET_SCALE = float(os.getenv("LLM_BUDGET_SCALE", "1.0"))
+RECENT_CALLS = 50        # per-call records kept for the stats endpoint
+
+_SENT_END_RE = re.compile(r"(?<!\b[A-Za-z])[.!?。](?=\s)")   # "e.g." / initials do not end a sentence
+_SIGNOFF_RE = re.compile(
+    r"^(?:(?:best|kind|warm|warmest)\s+)?regards,?$|^best(?: wishes)?,?$|^sincerely(?: yours)?,?$|"
+    r"^(?:many\s+)?thanks(?: again)?,?$|^thank you,?$|^cheers,?$|^감사합니다\.?$|^고맙습니다\.?$",
+    re.IGNORECASE)
+_SIGNED_RE = re.compile(r"\S\s*드림\.?$")                    # "홍길동 드림": sign-off and name in one line
+_GREETING_RE = re.compile(r"^(?:hi|hello|hey|dear|good\s+(?:morning|afternoon|evening))\b[^.!?]{0,40}$|"
+                          r"^안녕하세요", re.IGNORECASE)
+_PLACEHOLDER_RE = re.compile(r"^[\[(<][^\n]{1,38}[\])>]$")   # "[Your Name]"
+NAME_MAX_WORDS = 4
+
+
+def _is_name_line(line: str) -> bool:
+    """A name ("Alice", "김철수", "John Smith, PhD") or placeholder, not a sentence"""
+    if _PLACEHOLDER_RE.match(line):
+        return True
+    return (len(line) <= 40 and len(line.split()) <= NAME_MAX_WORDS and line[0].isalnum()
+            and not line.endswith((".", "!", "?", "。", ":")))
+
+
+def _num(v: str):
+    for cast in (int, float):
+        try:
+            return cast(v)
+        except ValueError:
+            pass
+    return v
+
+
+def parse_ollama_opts(spec: str) -> dict:
+    """'-o top_p=0.9 -o num_thread=4 -o stop=Reply:' -> {'top_p': 0.9, 'num_thread': 4, 'stop': ['Reply:']}"""
+    out: dict = {}
+    for part in shlex.split(spec or ""):
+        if part == "-o" or "=" not in part:
+            continue
+        k, _, v = part.partition("=")
+        if k == "stop":
+            out.setdefault("stop", []).append(v)
+        else:
+            out[k] = _num(v)
+    return out
+
+
+def output_lang(task: str, source: str, lang: Optional[str] = None) -> Optional[str]:
+    """Language the task writes in: replies are told theirs, summaries follow the source"""
+    if lang or task != "summary":
+        return lang
+    return "ko" if hangul_ratio(source)[0] >= KO_RATIO else "en"
+
+
+def generation_options(task: str, source: str, base: Optional[dict] = None,
+                       lang: Optional[str] = None) -> dict:
+    """
+    Ollama options for one call: the task profile under the global OLLAMA_OPTS.
+    lang: output language, scales the budget (LANG_BUDGET; None = as profiled).
+    A num_predict in OLLAMA_OPTS caps the task budget; stop sequences are merged.
+    """
+    prof = LLM_PROFILES[task]
+    base = dict(base or {})
+    budget = prof["base"] + prof["per_word"] * count_tokens(source)
+    budget = min(prof["max"], max(prof["min"], budget)) * LANG_BUDGET.get(lang, 1.0)
+    budget = int(budget * LLM_BUDGET_SCALE)
+    if "num_predict" in base:
+        budget = min(budget, int(base.pop("num_predict")))
+    stops = prof["stop"] + [s for s in base.pop("stop", []) if s not in prof["stop"]]
+    return {"temperature": prof["temperature"], **base, "num_predict": max(1, budget), "stop": stops}
+
+
+class OutputMonitor:
+    """
+    Watches streamed text and reports the structural end of the output.
+    feed(chunk) returns the text that is safe to emit; `done` is set once the end is reached.
+    After a reply's sign-off the next line is held back until it is judged (flush() at stream end).
+    """
+
+    def __init__(self, task: str, sentences: Optional[int] = None):
+        self.task = task
+        self.sentences = sentences or LLM_PROFILES.get(task, {}).get("sentences")
+        self.text = ""
+        self.done = False
+        self._signed_off = False
+        self._body = False
+        self._line_start = 0
+        self._emitted = 0
+
+    def feed(self, chunk: str) -> str:
+        if self.done or not chunk:
+            return ""
+        self.text += chunk
+        end = None
+        if self.task == "reply":
+            end = self._reply_end()
+        elif self.task == "summary" and self.sentences:
+            end = self._summary_end()
+        if end is not None:
+            self.done = True
+            self.text = self.text[:end]
+            safe = end
+        else:
+            safe = self._line_start if self._signed_off else len(self.text)
+        return self._emit(safe)
+
+    def flush(self) -> str:
+        """Held-back text once the stream has ended on its own"""
+        return self._emit(len(self.text))
+
+    def _emit(self, upto: int) -> str:
+        out = self.text[self._emitted:upto]
+        self._emitted = max(self._emitted, upto)
+        return out
+
+    def _summary_end(self) -> Optional[int]:
+        # Leading "Summary:" style headers contain no sentence end, so counting from 0 is fine
+        ends = [m.end() for m in _SENT_END_RE.finditer(self.text)]
+        return ends[self.sentences - 1] if len(ends) >= self.sentences else None
+
+    def _reply_end(self) -> Optional[int]:
+        # Only completed lines are judged. A sign-off counts once the reply has a body and
+        # only if a name line follows it ("Thanks," opening a paragraph is just thanks)
+        while True:
+            nl = self.text.find("\n", self._line_start)
+            if nl < 0:
+                return None
+            line = self.text[self._line_start:nl].strip().strip("*_")
+            self._line_start = nl + 1
+            if not line:
+                continue
+            if self._signed_off:
+                if _is_name_line(line):
+                    return nl
+                self._signed_off = False     # not the closing after all: judge this line as usual
+            if _SIGNOFF_RE.match(line) or _SIGNED_RE.search(line):
+                if self._body and _SIGNED_RE.search(line):
+                    return nl
+                self._signed_off = self._body
+            elif self._body or not _GREETING_RE.match(line):
+                self._body = True
+
+
+class GenerationRun:
+    """One LLM call: its options, output monitor and token accounting"""
+
+    def __init__(self, task: str, source: str, base_opts: Optional[dict] = None, lang: Optional[str] = None):
+        self.task = task
+        self.lang = output_lang(task, source, lang)
+        self.options = generation_options(task, source, base_opts, self.lang)
+        self.budget = self.options["num_predict"]
+        self.monitor = OutputMonitor(task)
+        self.tokens = 0
+        self.reason = "error"      # stop | length | monitor | error
+        self.t0 = time.perf_counter()
+
+    @property
+    def done(self) -> bool:
+        return self.reason != "error"
+
+    def feed(self, part) -> str:
+        """part: one streamed Ollama chunk; returns the text to keep"""
+        text = part.get("response") or ""
+        if text:
+            self.tokens += 1       # Ollama streams one token per chunk
+        if part.get("done"):
+            self.tokens = part.get("eval_count") or self.tokens
+            self.reason = part.get("done_reason") or "stop"
+        keep = self.monitor.feed(text)
+        if self.monitor.done and not self.done:
+            self.reason = "monitor"
+        elif self.done:
+            keep += self.monitor.flush()
+        return keep
+
+    @property
+    def truncated(self) -> bool:
+        """Ollama stopped at num_predict: the output is cut off mid-text"""
+        return self.reason == "length"
+
+    @property
+    def saved(self) -> int:
+        """Budgeted tokens not generated because the monitor stopped the call"""
+        return max(0, self.budget - self.tokens) if self.reason == "monitor" else 0
+
+
+class _TaskTokens:
+    __slots__ = ("calls", "generated", "budget", "saved", "reasons")
+
+    def __init__(self):
+        self.calls = self.generated = self.budget = self.saved = 0
+        self.reasons: Dict[str, int] = {}
+
+
+class LLMTokenStats:
+    """Per task: calls, tokens generated / budgeted / saved by early stop, and why calls ended"""
+
+    def __init__(self):
+        self._tasks: Dict[str, _TaskTokens] = {}
+        self._recent = deque(maxlen=RECENT_CALLS)
+        self._lock = threading.Lock()
+
+    def record(self, run: GenerationRun):
+        with self._lock:
+            t = self._tasks.setdefault(run.task, _TaskTokens())
+            t.calls += 1
+            t.generated += run.tokens
+            t.budget += run.budget
+            t.saved += run.saved
+            t.reasons[run.reason] = t.reasons.get(run.reason, 0) + 1
+            self._recent.append({
+                "task": run.task, "lang": run.lang, "tokens": run.tokens, "budget": run.budget, "saved": run.saved,
+                "reason": run.reason, "ms": round((time.perf_counter() - run.t0) * 1000, 1),
+                "at": round(time.time(), 3),
+            })
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "tasks": {task: {
+                    "calls": t.calls,
+                    "tokens_generated": t.generated,
+                    "tokens_budgeted": t.budget,
+                    "tokens_saved": t.saved,
+                    "avg_tokens": round(t.generated / t.calls, 1) if t.calls else 0.0,
+                    "ended_by": dict(t.reasons),
+                } for task, t in self._tasks.items()},
+                "recent": list(self._recent),
+            }
@@ -0,0 +1,202 @@
+# mail_store.py
+# Local mail store + full-text index (SQLite FTS5).
+# - Hangul runs are indexed as character bigrams plus their last syllable, so a one-syllable
+#   query is a prefix match; other scripts as unicode61 words
+# - The snippet is indexed too: metadata-only sync stores no body until a message is opened
+# - Upserts are incremental as mail is synced; search never touches the Gmail API
+# - Results are BM25-ranked (subject > sender > body / snippet) with keyset cursor pagination
+
+import os
+import re
+import json
+import base64
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+MAIL_DB = os.getenv("MAIL_DB", "mail_store.sqlite3")
+SEARCH_WEIGHTS = (3.0, 2.0, 1.0, 1.0)   # bm25 column weights: subject, sender, body, snippet
+MAX_INDEXED_CHARS = 20000
+INDEX_VERSION = 2        # PRAGMA user_version; older FTS tables are rebuilt on open
+
+_TERM_RE = re.compile(r"[가-힣]+|[^\W_]+", re.UNICODE)
+_HANGUL_RE = re.compile(r"[가-힣]+")
+
+
+def _bigrams(run: str) -> List[str]:
+    return [run] if len(run) == 1 else [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def index_terms(text: str) -> str:
+    """
+    Text as it is stored in the FTS table: Hangul runs -> bigrams + the last syllable
+    (every syllable then starts some token), the rest unchanged
+    """
+    out = []
+    for m in _TERM_RE.finditer((text or "")[:MAX_INDEXED_CHARS].lower()):
+        tok = m.group(0)
+        if not _HANGUL_RE.fullmatch(tok):
+            out.append(tok)
+        elif len(tok) == 1:
+            out.append(tok)
+        else:
+            out.extend(_bigrams(tok) + [tok[-1]])
+    return " ".join(out)
+
+
+def match_query(q: str) -> str:
+    """
+    User query -> FTS5 MATCH expression (all terms required; Hangul words as bigram
+    phrases, a single syllable as a prefix)
+    """
+    parts = []
+    for m in _TERM_RE.finditer((q or "").lower()):
+        tok = m.group(0)
+        if _HANGUL_RE.fullmatch(tok):
+            parts.append('"' + tok + '"*' if len(tok) == 1 else '"' + " ".join(_bigrams(tok)) + '"')
+        else:
+            parts.append('"' + tok + '"*' if len(tok) >= 3 else '"' + tok + '"')
+    return " ".join(parts)
+
+
+def _encode_cursor(rank: float, rowid: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rank, rowid]).encode()).decode()
+
+
+def _decode_cursor(cursor: Optional[str]):
+    if not cursor:
+        return None
+    try:
+        rank, rowid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), int(rowid)
+    except Exception:
+        return None
+
+
+class MailStore:
+    def __init__(self, path: str = MAIL_DB):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                rowid INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                thread_id TEXT,
+                subject TEXT,
+                sender TEXT,
+                date INTEGER,
+                snippet TEXT,
+                body TEXT
+            );
+            CREATE INDEX IF NOT EXISTS messages_date ON messages(date);
+        """)
+        if self._db.execute("PRAGMA user_version").fetchone()[0] < INDEX_VERSION:
+            self._reindex()
+
+    def _reindex(self):
+        """(Re)build the FTS table in the current index format from the stored messages"""
+        self._db.executescript("""
+            DROP TABLE IF EXISTS messages_fts;
+            CREATE VIRTUAL TABLE messages_fts
+                USING fts5(subject, sender, body, snippet, tokenize = 'unicode61 remove_diacritics 2');
+        """)
+        rows = self._db.execute("SELECT rowid, subject, sender, snippet, body FROM messages").fetchall()
+        for row in rows:
+            self._index_row(row)
+        self._db.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        self._db.commit()
+        if rows:
+            print(f"[search] rebuilt the full-text index over {len(rows)} messages")
+
+    def _index_row(self, row):
+        self._db.execute("DELETE FROM messages_fts WHERE rowid = ?", (row["rowid"],))
+        self._db.execute(
+            "INSERT INTO messages_fts (rowid, subject, sender, body, snippet) VALUES (?, ?, ?, ?, ?)",
+            (row["rowid"], index_terms(row["subject"]), index_terms(row["sender"]),
+             index_terms(row["body"] or ""), index_terms(row["snippet"] or "")),
+        )
+
+    def upsert(self, items: List[Dict]):
+        """
+        items: dicts with id, thread_id, subject, sender, date (ms), snippet, text.
+        Items without "text" (metadata-only sync) keep any body already stored.
+        """
+        with self._lock:
+            for it in items:
+                if not it.get("id"):
+                    continue
+                self._db.execute(
+                    "INSERT INTO messages (id, thread_id, subject, sender, date, snippet, body) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET thread_id = excluded.thread_id, "
+                    "subject = excluded.subject, sender = excluded.sender, date = excluded.date, "
+                    "snippet = excluded.snippet, body = COALESCE(excluded.body, messages.body)",
+                    (it["id"], it.get("thread_id"), it.get("subject", ""), it.get("sender", ""),
+                     int(it.get("date") or 0), it.get("snippet", ""), it.get("text")),
+                )
+                self._index_row(self._db.execute(
+                    "SELECT rowid, subject, sender, snippet, body FROM messages WHERE id = ?", (it["id"],)).fetchone())
+            self._db.commit()
+
+    def _row_to_item(self, r) -> dict:
+        return {
+            "message_id": r["id"],
+            "thread_id": r["thread_id"],
+            "subject": r["subject"],
+            "from": r["sender"],
+            "date": r["date"],
+            "snippet": r["snippet"],
+            "text": r["body"],
+        }
+
+    def get(self, message_id: str) -> Optional[dict]:
+        with self._lock:
+            r = self._db.execute("SELECT * FROM messages WHERE id = ?", (message_id,)).fetchone()
+        return self._row_to_item(r) if r else None
+
+    def thread(self, thread_id: str) -> List[dict]:
+        """Stored messages of a thread, oldest first"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM messages WHERE thread_id = ? ORDER BY date", (thread_id,)).fetchall()
+        return [self._row_to_item(r) for r in rows]
+
+    def search(self, q: str, limit: int = 20, cursor: Optional[str] = None) -> dict:
+        expr = match_query(q)
+        if not expr:
+            return {"items": [], "next_cursor": None}
+
+        after = _decode_cursor(cursor)
+        sql = (
+            "SELECT m.rowid AS rowid, m.id, m.thread_id, m.subject, m.sender, m.date, m.snippet, m.body, "
+            "       hits.score AS score "
+            "FROM (SELECT rowid, bm25(messages_fts, ?, ?, ?, ?) AS score "
+            "      FROM messages_fts WHERE messages_fts MATCH ?) AS hits "
+            "JOIN messages m ON m.rowid = hits.rowid "
+        )
+        args: list = [*SEARCH_WEIGHTS, expr]
+        if after:
+            sql += "WHERE (hits.score > ? OR (hits.score = ? AND m.rowid > ?)) "
+            args += [after[0], after[0], after[1]]
+        sql += "ORDER BY hits.score, m.rowid LIMIT ?"
+        args.append(limit + 1)
+
+        with self._lock:
+            try:
+                rows = self._db.execute(sql, args).fetchall()
+            except sqlite3.OperationalError as e:
+                print("[search] bad query:", e)
+                return {"items": [], "next_cursor": None}
+
+        page = rows[:limit]
+        # bm25() is lower-is-better; expose a higher-is-better score
+        # Metadata only: bodies are fetched on demand like the list API
+        items = []
+        for r in page:
+            it = self._row_to_item(r)
+            it.pop("text")
+            it["score"] = round(-r["score"], 4)
+            items.append(it)
+        next_cursor = _encode_cursor(page[-1]["score"], page[-1]["rowid"]) if len(rows) > limit else None
+        return {"items": items, "next_cursor": next_cursor}
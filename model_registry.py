@@ -0,0 +1,185 @@
+# model_registry.py
+# Model lifecycle manager for the in-process HF models.
+# - Models load on first use and are unloaded LRU-first when the memory budget is exceeded
+# - Models idle for longer than idle_s are unloaded by a background sweeper
+# - A failed load is retried after a backoff (LOAD_RETRY_S, doubling up to LOAD_RETRY_MAX_S)
+# - Resident size and load/unload history are reported per model
+# - thread_loads() tells timed callers that a lease on their thread loaded a model, so the
+#   load time does not end up in latency samples
+
+import gc
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+
+HISTORY_LEN = 200
+SWEEP_INTERVAL_S = 30
+LOAD_RETRY_S = 60
+LOAD_RETRY_MAX_S = 3600
+
+
+def resident_bytes(obj: Any) -> int:
+    """Parameter + buffer bytes of a pipeline / model / wrapper holding a .model or ._model"""
+    model = obj
+    for attr in ("model", "_model"):
+        if getattr(obj, attr, None) is not None:
+            model = getattr(obj, attr)
+            break
+    total = 0
+    try:
+        for t in list(model.parameters()) + list(model.buffers()):
+            total += t.numel() * t.element_size()
+    except Exception:
+        pass
+    return total
+
+
+class _Entry:
+    def __init__(self, name: str, loader: Callable[[], Any], est_mb: float):
+        self.name = name
+        self.loader = loader
+        self.est_bytes = int(est_mb * 1024 * 1024)
+        self.obj: Any = None
+        self.bytes = 0
+        self.in_use = 0
+        self.last_used = 0.0
+        self.loads = 0
+        self.failures = 0              # consecutive failed loads
+        self.retry_at = 0.0
+        self.lock = threading.Lock()   # serialises loading of this model
+
+
+class ModelRegistry:
+    def __init__(self, budget_mb: float, idle_s: float):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.idle_s = idle_s
+        self._models: Dict[str, _Entry] = {}
+        self._lock = threading.RLock()
+        self.history = deque(maxlen=HISTORY_LEN)
+        self._tls = threading.local()
+        if idle_s > 0:
+            threading.Thread(target=self._sweep, daemon=True).start()
+
+    def register(self, name: str, loader: Callable[[], Any], est_mb: float = 0):
+        """loader() returns the loaded object, or None if loading failed"""
+        self._models[name] = _Entry(name, loader, est_mb)
+
+    def names(self):
+        return list(self._models)
+
+    def thread_loads(self) -> int:
+        """Models loaded by leases on the calling thread so far"""
+        return getattr(self._tls, "loads", 0)
+
+    def _resident(self) -> int:
+        return sum(e.bytes for e in self._models.values() if e.obj is not None)
+
+    def _event(self, name: str, action: str, **extra):
+        self.history.append(dict(ts=round(time.time(), 3), model=name, action=action, **extra))
+
+    def _unload(self, e: _Entry, reason: str):
+        freed = e.bytes
+        e.obj, e.bytes = None, 0
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except Exception:
+            pass
+        self._event(e.name, "unload", reason=reason, freed_mb=round(freed / 2**20, 1))
+        print(f"[models] unloaded {e.name} ({reason})")
+
+    def _make_room(self, need: int, keep: str):
+        # Least recently used idle models go first; models in use are never unloaded
+        idle = sorted((e for e in self._models.values()
+                       if e.obj is not None and e.in_use == 0 and e.name != keep),
+                      key=lambda e: e.last_used)
+        for e in idle:
+            if self._resident() + need <= self.budget:
+                break
+            self._unload(e, "budget")
+
+    @staticmethod
+    def _backing_off(e: _Entry) -> bool:
+        return e.failures > 0 and time.time() < e.retry_at
+
+    def _ensure_loaded(self, e: _Entry) -> bool:
+        """True if this call loaded the model"""
+        if e.obj is not None or self._backing_off(e):
+            return False
+        with e.lock:
+            if e.obj is not None or self._backing_off(e):
+                return False
+            with self._lock:
+                self._make_room(e.bytes or e.est_bytes, keep=e.name)
+            t0 = time.perf_counter()
+            obj = e.loader()
+            with self._lock:
+                if obj is None:
+                    e.failures += 1
+                    backoff = min(LOAD_RETRY_MAX_S, LOAD_RETRY_S * 2 ** (e.failures - 1))
+                    e.retry_at = time.time() + backoff
+                    self._event(e.name, "load_failed", retry_in_s=backoff)
+                    return False
+                e.obj = obj
+                e.failures = 0
+                e.bytes = resident_bytes(obj) or e.est_bytes
+                e.est_bytes = e.bytes   # the next reload knows its real size
+                e.loads += 1
+                self._event(e.name, "load", seconds=round(time.perf_counter() - t0, 2),
+                            resident_mb=round(e.bytes / 2**20, 1))
+                if self._resident() > self.budget:
+                    self._make_room(0, keep=e.name)
+            return True
+
+    @contextmanager
+    def use(self, name: str):
+        """Lease a model for the duration of the block (None if it failed to load and is backing off)"""
+        e = self._models[name]
+        with self._lock:
+            e.in_use += 1   # leased before loading so budget/idle eviction skips it
+            e.last_used = time.time()
+        try:
+            if self._ensure_loaded(e):
+                self._tls.loads = self.thread_loads() + 1
+            obj = e.obj
+        except Exception:
+            with self._lock:
+                e.in_use -= 1
+            raise
+        try:
+            yield obj
+        finally:
+            with self._lock:
+                e.in_use -= 1
+                e.last_used = time.time()
+
+    def _sweep(self):
+        while True:
+            time.sleep(SWEEP_INTERVAL_S)
+            now = time.time()
+            with self._lock:
+                for e in self._models.values():
+                    if e.obj is not None and e.in_use == 0 and now - e.last_used > self.idle_s:
+                        self._unload(e, "idle")
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "budget_mb": round(self.budget / 2**20, 1),
+                "resident_mb": round(self._resident() / 2**20, 1),
+                "idle_unload_s": self.idle_s,
+                "models": {e.name: {
+                    "loaded": e.obj is not None,
+                    "resident_mb": round(e.bytes / 2**20, 1),
+                    "in_use": e.in_use,
+                    "loads": e.loads,
+                    "failed": e.failures > 0 and e.obj is None,
+                    "retry_in_s": round(max(0.0, e.retry_at - time.time()), 1) if e.failures else None,
+                    "idle_s": round(time.time() - e.last_used, 1) if e.last_used else None,
+                } for e in self._models.values()},
+                "history": list(self.history),
+            }
@@ -0,0 +1,212 @@
+# near_dup.py
+# Near-duplicate email detection (64-bit SimHash) to reuse analysis across similar messages.
+# Alerts, ticket notifications and newsletters differ only in ids/dates; their cached
+# summary / sentiment / reply is returned instead of running the models again.
+# The hash masks numbers / URLs / addresses / hex ids, so a reused text result has the cached
+# email's values swapped for the new email's; if that mapping is not clean, it is not reused.
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Optional
+
+import numpy as np
+
+NEAR_DUP_DB = os.getenv("NEAR_DUP_DB", "near_dup.sqlite3")
+MAX_HAMMING = int(os.getenv("NEAR_DUP_MAX_HAMMING", "3"))     # similarity threshold (bits of 64)
+MAX_ENTRIES = int(os.getenv("NEAR_DUP_MAX_ENTRIES", "5000"))   # per task, least recently used evicted
+TTL_DAYS = float(os.getenv("NEAR_DUP_TTL_DAYS", "30"))
+MIN_SHINGLES = 8        # shorter texts are too unstable to fingerprint
+SHINGLE = 3
+BANDS = 4               # 4 x 16-bit bands: any hash within 3 bits shares at least one band
+if MAX_HAMMING > BANDS - 1:
+    # More differing bits could touch every band and the lookup would silently miss matches
+    print(f"[near_dup] NEAR_DUP_MAX_HAMMING={MAX_HAMMING} exceeds {BANDS - 1} (banding recall limit); using {BANDS - 1}")
+    MAX_HAMMING = BANDS - 1
+
+_VOLATILE_RES = [
+    (re.compile(r"https?://\S+"), " url "),
+    (re.compile(r"\S+@\S+"), " email "),
+    (re.compile(r"\b[0-9a-f]{8,}\b", re.IGNORECASE), " hex "),
+    (re.compile(r"\d+"), "0"),
+]
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Same classes as _VOLATILE_RES, in original case: the values a reused result must not leak
+_VOLATILE_TOKEN_RE = re.compile(r"https?://\S+|\S+@\S+|\b[0-9a-f]{8,}\b|\d+", re.IGNORECASE)
+
+
+def _normalize(text: str) -> str:
+    t = (text or "").lower()
+    for pat, rep in _VOLATILE_RES:
+        t = pat.sub(rep, t)
+    return t
+
+
+def simhash(text: str) -> Optional[int]:
+    """64-bit SimHash over word shingles of the normalised text (None if too short)"""
+    words = _WORD_RE.findall(_normalize(text))
+    shingles = [" ".join(words[i:i + SHINGLE]) for i in range(max(0, len(words) - SHINGLE + 1))]
+    if len(shingles) < MIN_SHINGLES:
+        return None
+
+    digests = b"".join(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest() for s in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(len(shingles), 8), axis=1)
+    votes = bits.astype(np.int32).sum(axis=0) * 2 - len(shingles)
+    packed = np.packbits((votes > 0).astype(np.uint8))
+    return int.from_bytes(packed.tobytes(), "big")
+
+
+def volatile_tokens(text: str) -> list:
+    """Masked values (URLs, addresses, hex ids, numbers) in document order"""
+    return _VOLATILE_TOKEN_RE.findall(text or "")
+
+
+def _restore(result: Any, cached: list, current: list) -> Optional[Any]:
+    """
+    Swap the cached email's masked values in a text result for the current email's.
+    Structured results (labels, scores) carry no email values and are returned as they are;
+    other values in the text (e.g. numbers the model wrote) are left alone.
+    None if a cached value in the result has no unambiguous counterpart in this email.
+    """
+    if not isinstance(result, str):
+        return result
+    mapping, ambiguous = {}, set()
+    if len(cached) == len(current):
+        for old, new in zip(cached, current):
+            if mapping.setdefault(old, new) != new:
+                ambiguous.add(old)
+    else:
+        ambiguous = set(cached)
+    bad = []
+
+    def swap(m):
+        tok = m.group(0)
+        if tok in ambiguous:
+            bad.append(tok)
+        return mapping.get(tok, tok)
+    out = _VOLATILE_TOKEN_RE.sub(swap, result)
+    return None if bad else out
+
+
+def _signed(h: int) -> int:
+    # SQLite INTEGER is signed 64-bit
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+def _bands(h: int):
+    return [(h >> (16 * i)) & 0xFFFF for i in range(BANDS)]
+
+
+class NearDupIndex:
+    def __init__(self, path: str = NEAR_DUP_DB, max_hamming: int = MAX_HAMMING,
+                 max_entries: int = MAX_ENTRIES, ttl_days: float = TTL_DAYS):
+        if max_hamming > BANDS - 1:
+            raise ValueError(f"max_hamming {max_hamming} > {BANDS - 1}: {BANDS} bands cannot guarantee recall")
+        self.max_hamming = max_hamming
+        self.max_entries = max_entries
+        self.ttl_s = ttl_days * 86400
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS near_dup (
+                id INTEGER PRIMARY KEY,
+                task TEXT NOT NULL,
+                simhash INTEGER NOT NULL,
+                b0 INTEGER, b1 INTEGER, b2 INTEGER, b3 INTEGER,
+                payload TEXT NOT NULL,
+                cost_ms REAL NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS near_dup_b0 ON near_dup(task, b0);
+            CREATE INDEX IF NOT EXISTS near_dup_b1 ON near_dup(task, b1);
+            CREATE INDEX IF NOT EXISTS near_dup_b2 ON near_dup(task, b2);
+            CREATE INDEX IF NOT EXISTS near_dup_b3 ON near_dup(task, b3);
+            CREATE INDEX IF NOT EXISTS near_dup_used ON near_dup(task, last_used);
+        """)
+        cols = {r[1] for r in self._db.execute("PRAGMA table_info(near_dup)")}
+        if "tokens" not in cols:
+            # Older databases: entries without masked values are never reused
+            self._db.execute("ALTER TABLE near_dup ADD COLUMN tokens TEXT")
+            self._db.commit()
+        self.lookups = 0
+        self.hits = 0
+        self.rejected = 0       # near-duplicates whose masked values could not be mapped
+        self.saved_ms = 0.0
+
+    def lookup(self, task: str, text: str) -> Optional[Any]:
+        h = simhash(text)
+        with self._lock:
+            self.lookups += 1
+            if h is None:
+                return None
+            b = _bands(h)
+            rows = self._db.execute(
+                "SELECT id, simhash, payload, cost_ms, tokens FROM near_dup "
+                "WHERE task = ? AND created > ? AND (b0 = ? OR b1 = ? OR b2 = ? OR b3 = ?)",
+                (task, time.time() - self.ttl_s, *b),
+            ).fetchall()
+
+            matches = []
+            for row_id, sh, payload, cost_ms, tokens in rows:
+                dist = bin((sh & 0xFFFFFFFFFFFFFFFF) ^ h).count("1")
+                if dist <= self.max_hamming:
+                    matches.append((dist, row_id, payload, cost_ms, tokens))
+            if not matches:
+                return None
+
+            # Closest first; the first whose values map cleanly onto this email is reused
+            current = volatile_tokens(text)
+            for _, row_id, payload, cost_ms, tokens in sorted(matches):
+                result = None if tokens is None else _restore(json.loads(payload), json.loads(tokens), current)
+                if result is not None:
+                    break
+            else:
+                self.rejected += 1
+                return None
+
+            self._db.execute("UPDATE near_dup SET last_used = ? WHERE id = ?", (time.time(), row_id))
+            self._db.commit()
+            self.hits += 1
+            self.saved_ms += cost_ms
+            return result
+
+    def add(self, task: str, text: str, result: Any, cost_ms: float):
+        h = simhash(text)
+        if h is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO near_dup (task, simhash, b0, b1, b2, b3, payload, cost_ms, created, last_used, tokens) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (task, _signed(h), *_bands(h), json.dumps(result, ensure_ascii=False), cost_ms, now, now,
+                 json.dumps(volatile_tokens(text), ensure_ascii=False)),
+            )
+            self._evict(task, now)
+            self._db.commit()
+
+    def _evict(self, task: str, now: float):
+        self._db.execute("DELETE FROM near_dup WHERE created <= ?", (now - self.ttl_s,))
+        self._db.execute(
+            "DELETE FROM near_dup WHERE task = ? AND id NOT IN "
+            "(SELECT id FROM near_dup WHERE task = ? ORDER BY last_used DESC LIMIT ?)",
+            (task, task, self.max_entries),
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM near_dup").fetchone()[0]
+            return {
+                "entries": entries,
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "rejected": self.rejected,
+                "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "saved_ms": round(self.saved_ms, 1),
+                "max_hamming": self.max_hamming,
+            }
@@ -1,5 +1,12 @@
 (() => {
   const baseUrl = "http://localhost:5000";
+  // Required once the server has issued API keys: localStorage.setItem("apiKey", "<key>")
+  const apiKey = localStorage.getItem("apiKey") || "";
+  const api = (path, opts = {}) => fetch(`${baseUrl}${path}`, apiKey
+    ? { ...opts, headers: { ...(opts.headers || {}), Authorization: `Bearer ${apiKey}` } } : opts);
+  // "Summary (Fast)": server picks the best local summariser that fits this budget (the LLM has its own button)
+  const summaryDeadlineMs = 10000;
+  const summaryFastPaths = ["hybrid", "fast", "extractive"];
 
   const $ = (id) => document.getElementById(id);
   const els = {
@@ -29,6 +36,7 @@
   let filtered = [];
   let selected = -1;
   let topBarTimer = null;
+  let searchTimer = null;
 
   // utils
   const esc = (s="") => s.replace(/[&<>"']/g, (m) => ({ "&":"&amp;","<":"&lt;",">":"&gt;","\"":"&quot;","'":"&#39;" }[m]));
@@ -60,9 +68,9 @@
   async function fetchEmails() {
     disableAll(true); topProgress(true);
     try {
-      const res = await fetch(`${baseUrl}/api/emails`);
+      const res = await api(`/api/emails`);
       const data = await res.json();
-      emails = Array.isArray(data) ? data : [];
+      emails = Array.isArray(data.items) ? data.items : [];
       filtered = emails.slice();
       renderList();
       if (filtered[0]) selectEmail(0);
@@ -109,9 +117,24 @@
     });
   }
 
-  function selectEmail(idx) {
+  // bodies are loaded on demand (metadata-first list)
+  async function loadBody(item) {
+    if (!item || item.text || !item.message_id) return;
+    try {
+      const res = await api(`/api/emails/${encodeURIComponent(item.message_id)}`);
+      const data = await res.json();
+      item.text = data.text || "";
+    } catch (e) { console.error(e); }
+  }
+
+  async function selectEmail(idx) {
     selected = idx;
     const item = filtered[idx];
+    if (item && !item.text && item.message_id) {
+      els.original.textContent = "Loading…";
+      await loadBody(item);
+      if (selected !== idx) return;  // user moved on meanwhile
+    }
     els.original.textContent = item?.text || "(empty)";
     els.subjectLine.textContent = item?.subject || "(no subject)";
     const from = item?.from || item?.sender || "unknown";
@@ -144,12 +167,13 @@
     const t = getSelectedText(); if (!t) return;
     toggle(els.spinFast, true); topProgress(true);
     try {
-      const res = await fetch(`${baseUrl}/summarize`, {
+      const res = await api(`/summarize`, {
         method: "POST", headers: {"Content-Type":"application/json"},
-        body: JSON.stringify({ text: t })
+        body: JSON.stringify({ text: t, deadline_ms: summaryDeadlineMs, paths: summaryFastPaths })
       });
       const data = await res.json();
       els.summary.textContent = data.summary || "(no summary)";
+      if (data.degraded_from && data.degraded_from.length) toast(`Summary via ${data.path} (deadline)`);
     } catch(e){ alert("Summary (Fast) error: " + e); }
     finally { toggle(els.spinFast, false); topProgress(false); }
   }
@@ -158,7 +182,7 @@
     const t = getSelectedText(); if (!t) return;
     toggle(els.spinLlm, true); topProgress(true);
     try {
-      const res = await fetch(`${baseUrl}/summarize_llm`, {
+      const res = await api(`/summarize_llm`, {
         method: "POST", headers: {"Content-Type":"application/json"},
         body: JSON.stringify({ text: t })
       });
@@ -172,7 +196,7 @@
     const t = getSelectedText(); if (!t) return;
     toggle(els.spinSent, true); topProgress(true);
     try {
-      const res = await fetch(`${baseUrl}/sentiment`, {
+      const res = await api(`/sentiment`, {
         method: "POST", headers: {"Content-Type":"application/json"},
         body: JSON.stringify({ text: t })
       });
@@ -191,7 +215,7 @@
     const t = getSelectedText(); if (!t) return;
     toggle(els.spinReply, true); topProgress(true);
     try {
-      const res = await fetch(`${baseUrl}/reply`, {
+      const res = await api(`/reply`, {
         method: "POST", headers: {"Content-Type":"application/json"},
         body: JSON.stringify({ text: t })
       });
@@ -205,7 +229,7 @@
     const t = getSelectedText(); if (!t) return;
     toggle(spinnerEl, true); disableAll(true); topProgress(true);
     try {
-      const res = await fetch(`${baseUrl}/translate_llm`, {
+      const res = await api(`/translate_llm`, {
         method: "POST", headers: {"Content-Type":"application/json"},
         body: JSON.stringify({ text: t, target_lang })
       });
@@ -226,7 +250,12 @@
         els.original.textContent = translated;
       }
       resetOutputs();
-      toast(target_lang === "en" ? "Translated to English" : "한국어로 번역 완료");
+      if (data.partial) {
+        const n = (data.failed_segments || []).length;
+        toast(`Partial translation: ${n} segment(s) left in the original language`);
+      } else {
+        toast(target_lang === "en" ? "Translated to English" : "한국어로 번역 완료");
+      }
     } catch(e){ alert("Translate error: " + e); }
     finally { toggle(spinnerEl, false); disableAll(false); topProgress(false); }
   }
@@ -247,6 +276,22 @@
     });
     selected = -1;
     renderList();
+    clearTimeout(searchTimer);
+    if (q.length >= 2) searchTimer = setTimeout(() => searchServer(q), 250);
+  }
+
+  // full-text search over locally stored mail (older than the loaded 20), appended to the local matches
+  async function searchServer(q) {
+    try {
+      const res = await api(`/api/emails?q=${encodeURIComponent(q)}`);
+      const data = await res.json();
+      if ((els.search.value || "").toLowerCase() !== q) return;  // stale response
+      const seen = new Set(filtered.map(e => e.message_id).filter(Boolean));
+      const extra = (Array.isArray(data.items) ? data.items : []).filter(e => !seen.has(e.message_id));
+      if (!extra.length) return;
+      filtered = filtered.concat(extra);  // local matches keep their positions (and the selection)
+      renderList();
+    } catch (e) { console.error(e); }
   }
 
   // buttons
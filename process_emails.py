@@ -1,44 +1,310 @@
 # process_emails.py
+# -----------------------------------------------------------------------------
+# Batch processing CLI (summary / sentiment / reply) for nightly backfills
+# - Pipelined: bodies are fetched while earlier emails are being analysed
+# - Gmail bodies come through the app (/api/emails/<id>, or app.email_body in-process), so
+#   quoted thread history is removed and the body is stored like a popup fetch
+# - Bounded concurrency per task type, pooled HTTP sessions
+# - Resumable: processed message ids go to a checkpoint file, reruns skip them
+#   (emails with a failed task are written but not checkpointed, so reruns retry them)
+# - Output: one JSON object per email (JSONL), progress/throughput on stderr
+# -----------------------------------------------------------------------------
+# Usage:
+#   python process_emails.py --max 2000 --out results.jsonl
+#   python process_emails.py --input emails.jsonl --in-process     (no HTTP, models in this process)
+#   python process_emails.py --concurrency summarize=2,sentiment=4,reply=1
+#   python process_emails.py --account alice     (mailbox + fair-queue account on a shared host;
+#                                                 its API key from --api-key or EAA_API_KEY)
+#
+# --input format (optional): one {"id": "...", "text": "..."} object per line
+# -----------------------------------------------------------------------------
 
 import sys
 import io
 
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List
+
 import requests
-from gmail_service import get_recent_emails
+from requests.adapters import HTTPAdapter
+
 from email_cleaner import remove_signature
 
-API_URL = "http://localhost:5000"  # Flask app must be running
+API_URL = os.environ.get("EAA_BASE_URL", "http://localhost:5000")  # Flask app must be running (HTTP mode)
+TASKS = ["summarize", "sentiment", "reply"]
+DEFAULT_CONCURRENCY = {"fetch": 4, "summarize": 2, "sentiment": 4, "reply": 1}
 
-def process_email(email_text):
-    # 1. Summarisation Request
-    summ_res = requests.post(f"{API_URL}/summarize", json={"text": email_text})
-    summary = summ_res.json().get("summary", "N/A")
 
-    # 2. Sentiment Analysis Request
-    sent_res = requests.post(f"{API_URL}/sentiment", json={"text": email_text})
-    sentiment = sent_res.json()
+# ----------------------------
+# Task runners
+# ----------------------------
+_local = threading.local()
 
-    # 3. Reply Generation Request
-    reply_res = requests.post(f"{API_URL}/reply", json={"text": email_text})
-    reply = reply_res.json().get("reply", "N/A")
 
-    return summary, sentiment, reply
+def _session(pool_size: int) -> requests.Session:
+    # One pooled session per worker thread (requests.Session is not thread-safe)
+    s = getattr(_local, "session", None)
+    if s is None:
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        _local.session = s
+    return s
 
-if __name__ == "__main__":
-    emails = get_recent_emails()
 
-    for i, email in enumerate(emails, 1):
-        print(f"\n===== Email {i} =====")
-        print(f"📩 Original:\n{email[:500]}...\n")
+def _headers(account: str, api_key: str) -> Dict[str, str]:
+    headers = {"X-Account": account}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    return headers
+
+
+def http_runners(pool_size: int, account: str = "default", api_key: str = "",
+                 timeout: int = 600) -> Dict[str, Callable[[str], object]]:
+    headers = _headers(account, api_key)
+
+    def post(path, payload):
+        r = _session(pool_size).post(f"{API_URL}{path}", json=payload, timeout=timeout, headers=headers)
+        r.raise_for_status()
+        return r.json()
+
+    return {
+        "summarize": lambda text: post("/summarize", {"text": text}).get("summary", ""),
+        "sentiment": lambda text: post("/sentiment", {"text": text}),
+        "reply": lambda text: post("/reply", {"text": text}).get("reply", ""),
+    }
+
+
+def in_process_runners() -> Dict[str, Callable[[str], object]]:
+    # Import lazily: loads the Flask app module (models load on first use)
+    import app
+    return {
+        "summarize": lambda text: app.summarize_text(text),
+        "sentiment": lambda text: app.analyze_sentiment(text),
+        "reply": lambda text: app.generate_reply_with_gemma3(text),
+    }
+
+
+# ----------------------------
+# Sources
+# ----------------------------
+def iter_gmail_ids(max_results: int, account: str = "default", page_size: int = 100) -> Iterator[str]:
+    from gmail_service import list_messages
+    token, seen = None, 0
+    while seen < max_results:
+        metas, token = list_messages(max_results=min(page_size, max_results - seen), page_token=token,
+                                     account=account)
+        for m in metas:
+            yield str(m["id"])
+            seen += 1
+        if not token or not metas:
+            break
+
+
+def _body_record(item: dict) -> Dict[str, str]:
+    return {"id": item["message_id"], "thread_id": item.get("thread_id", ""),
+            "subject": item.get("subject", ""), "text": item.get("text") or ""}
+
+
+def http_fetch(pool_size: int, account: str = "default", api_key: str = "",
+               timeout: int = 120) -> Callable[[str], Dict[str, str]]:
+    headers = _headers(account, api_key)
+
+    def fetch(msg_id: str) -> Dict[str, str]:
+        r = _session(pool_size).get(f"{API_URL}/api/emails/{msg_id}", timeout=timeout, headers=headers)
+        r.raise_for_status()
+        return _body_record(r.json())
+    return fetch
+
+
+def in_process_fetch(account: str = "default") -> Callable[[str], Dict[str, str]]:
+    import app
+    return lambda msg_id: _body_record(app.email_body(account, msg_id))
+
+
+def iter_input_file(path: str) -> Iterator[Dict[str, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            if line.strip():
+                it = json.loads(line)
+                it["id"] = str(it.get("id", n))   # numeric ids must match the checkpoint's strings
+                yield it
+
+
+# ----------------------------
+# Checkpoint / output
+# ----------------------------
+def load_checkpoint(path: str) -> set:
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r", encoding="utf-8") as f:
+        return {ln.strip() for ln in f if ln.strip()}
+
 
-    # Signature Removal
-        cleaned_email = remove_signature(email)
-        print(f"📩 Cleaned:\n{cleaned_email[:500]}...\n")
+class Sink:
+    """Appends results to JSONL and successful ids to the checkpoint, both flushed per email"""
 
-        summary, sentiment, reply = process_email(cleaned_email)
+    def __init__(self, out_path: str, ckpt_path: str):
+        self._out = open(out_path, "a", encoding="utf-8")
+        self._ckpt = open(ckpt_path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
 
-        print(f"📝 Summary:\n{summary}")
-        print(f"📊 Sentiment: {sentiment.get('label')} ({sentiment.get('score'):.2f})")
-        print(f"💬 Suggested Reply:\n{reply}\n")
\ No newline at end of file
+    def write(self, record: dict):
+        with self._lock:
+            self._out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._out.flush()
+            if "errors" not in record:
+                self._ckpt.write(str(record["id"]) + "\n")
+                self._ckpt.flush()
+
+    def close(self):
+        self._out.close()
+        self._ckpt.close()
+
+
+class Progress:
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def tick(self, ok: bool):
+        with self._lock:
+            self.done += 1
+            self.failed += 0 if ok else 1
+            elapsed = time.perf_counter() - self.t0
+            rate = self.done / elapsed if elapsed > 0 else 0.0
+            eta = (self.total - self.done) / rate if rate > 0 and self.total else 0.0
+            total = self.total or "?"
+            sys.stderr.write(f"\r[batch] {self.done}/{total}  {rate:.2f} emails/s  "
+                             f"failed={self.failed}  eta={eta:.0f}s   ")
+            sys.stderr.flush()
+
+
+# ----------------------------
+# Pipeline
+# ----------------------------
+def parse_concurrency(spec: str) -> Dict[str, int]:
+    out = dict(DEFAULT_CONCURRENCY)
+    for part in filter(None, (spec or "").split(",")):
+        k, v = part.split("=")
+        out[k.strip()] = max(1, int(v))
+    return out
+
+
+def run(emails: Iterator, fetch: Callable, runners: Dict[str, Callable], tasks: List[str],
+        conc: Dict[str, int], sink: Sink, progress: Progress, done_ids: set):
+    pools = {name: ThreadPoolExecutor(max_workers=conc.get(name, 1), thread_name_prefix=name)
+             for name in ["fetch"] + tasks}
+    # Bound in-flight emails so a huge backlog does not queue everything in memory
+    inflight = threading.BoundedSemaphore(max(conc.values()) * 4)
+
+    def analyse(item: dict):
+        cleaned = remove_signature(item.get("text") or "")
+        record = {"id": str(item["id"]), "thread_id": item.get("thread_id", ""),
+                  "subject": item.get("subject", "")}
+        remaining = [len(tasks)]
+        lock = threading.Lock()
+
+        def finish(task, fut):
+            try:
+                record[task] = fut.result()
+            except Exception as e:
+                record[task] = None
+                record.setdefault("errors", {})[task] = str(e)
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                # Always release the in-flight slot, even if writing the record fails
+                try:
+                    sink.write(record)
+                finally:
+                    progress.tick("errors" not in record)
+                    inflight.release()
+
+        for task in tasks:
+            pools[task].submit(runners[task], cleaned).add_done_callback(
+                lambda fut, task=task: finish(task, fut))
+
+    def fetch_then_analyse(ref):
+        try:
+            analyse(fetch(ref))
+        except Exception as e:
+            sys.stderr.write(f"\n[batch] fetch failed for {ref}: {e}\n")
+            progress.tick(False)
+            inflight.release()
+
+    for ref in emails:
+        ref_id = str(ref["id"] if isinstance(ref, dict) else ref)
+        if ref_id in done_ids:
+            continue
+        inflight.acquire()
+        pools["fetch"].submit(fetch_then_analyse, ref)
+
+    # Wait for fetches first (they feed the task pools), then for every task pool
+    pools["fetch"].shutdown(wait=True)
+    for name in tasks:
+        pools[name].shutdown(wait=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Batch summary / sentiment / reply over many emails")
+    ap.add_argument("--max", type=int, default=20, help="Number of Gmail messages to process")
+    ap.add_argument("--input", help="JSONL file of {id, text} instead of Gmail")
+    ap.add_argument("--out", default="processed_emails.jsonl", help="JSONL output (appended)")
+    ap.add_argument("--checkpoint", help="Processed-id file (default: <out>.ckpt)")
+    ap.add_argument("--tasks", default=",".join(TASKS), help="Comma list of summarize,sentiment,reply")
+    ap.add_argument("--concurrency", default="", help="e.g. fetch=4,summarize=2,sentiment=4,reply=1")
+    ap.add_argument("--account", default="default", help="Gmail account / X-Account sent to the API")
+    ap.add_argument("--api-key", dest="api_key", default=os.environ.get("EAA_API_KEY", ""),
+                    help="API key of --account (required for accounts other than 'default')")
+    ap.add_argument("--in-process", dest="in_process", action="store_true",
+                    help="Run the models in this process instead of calling the Flask API")
+    args = ap.parse_args()
+
+    tasks = [t.strip() for t in args.tasks.split(",") if t.strip() in TASKS]
+    if not tasks:
+        # No task would ever finish an email, so nothing would be written or released
+        ap.error(f"--tasks: none of {args.tasks!r} is one of {','.join(TASKS)}")
+    conc = parse_concurrency(args.concurrency)
+    ckpt = args.checkpoint or f"{args.out}.ckpt"
+    done_ids = load_checkpoint(ckpt)
+    if done_ids:
+        print(f"[batch] resuming: {len(done_ids)} emails already processed ({ckpt})")
+
+    runners = in_process_runners() if args.in_process else http_runners(max(conc.values()), args.account, args.api_key)
+
+    if args.input:
+        items = list(iter_input_file(args.input))
+        emails, fetch = iter(items), (lambda it: it)
+        total = sum(1 for it in items if it["id"] not in done_ids)
+    else:
+        emails = iter_gmail_ids(args.max, args.account)
+        fetch = (in_process_fetch(args.account) if args.in_process
+                 else http_fetch(max(conc.values()), args.account, args.api_key))
+        total = max(0, args.max - len(done_ids))
+
+    sink = Sink(args.out, ckpt)
+    progress = Progress(total)
+    try:
+        run(emails, fetch, runners, tasks, conc, sink, progress, done_ids)
+    finally:
+        sink.close()
+    elapsed = time.perf_counter() - progress.t0
+    print(f"\n[batch] done: {progress.done} emails in {elapsed:.1f}s "
+          f"({progress.done / elapsed if elapsed else 0:.2f}/s), failed={progress.failed} -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
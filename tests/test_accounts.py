@@ -0,0 +1,37 @@
+import pytest
+
+from accounts import AccountKeys, authorize_request
+
+
+def _auth(keys, raw=None, key=None, remote="127.0.0.1", registered=("alice",)):
+    return authorize_request(raw, key, keys, lambda a: a in registered, remote)
+
+
+def test_default_is_local_only_without_keys(tmp_path):
+    keys = AccountKeys(str(tmp_path / "keys.json"))
+    assert _auth(keys) == "default"
+    with pytest.raises(PermissionError):
+        _auth(keys, remote="10.0.0.7")
+
+
+def test_issued_keys_lock_every_account(tmp_path):
+    keys = AccountKeys(str(tmp_path / "keys.json"))
+    alice = keys.issue("alice")
+    with pytest.raises(PermissionError):
+        _auth(keys)                              # default now needs its own key
+    with pytest.raises(PermissionError):
+        _auth(keys, raw="alice", key="wrong")
+    assert _auth(keys, key=alice, remote="10.0.0.7") == "alice"
+    owner = keys.issue("default")
+    assert _auth(keys, key=owner, remote="10.0.0.7") == "default"
+    with pytest.raises(PermissionError):
+        _auth(keys, raw="default", key=alice)
+
+
+def test_unregistered_account_and_bad_id(tmp_path):
+    keys = AccountKeys(str(tmp_path / "keys.json"))
+    bob = keys.issue("bob")
+    with pytest.raises(PermissionError):
+        _auth(keys, key=bob)                     # no stored Gmail token
+    with pytest.raises(ValueError):
+        _auth(keys, raw="../etc")
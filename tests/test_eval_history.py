@@ -0,0 +1,20 @@
+import math
+
+from eval_history import cache_hits, mann_whitney_p, percentile
+
+
+def test_percentile_interpolates():
+    assert percentile([1, 2, 3, 4], 0.5) == 2.5
+    assert math.isnan(percentile([], 0.95))
+
+
+def test_mann_whitney_separates_shifted_samples():
+    a = [1.0 + i * 0.01 for i in range(30)]
+    assert mann_whitney_p(a, [v + 1.0 for v in a]) < 1e-6
+    assert mann_whitney_p(a, list(a)) > 0.9
+    assert mann_whitney_p([1.0] * 5, [1.0] * 5) == 1.0
+
+
+def test_cache_hits_counts_near_dup_columns():
+    rows = [{"sent_near_dup": "hit", "reply_en_near_dup": "off"}, {"sum_fast_near_dup": "hit", "x": "hit"}]
+    assert cache_hits(rows) == 2
@@ -0,0 +1,23 @@
+from lang_router import route_languages, word_count
+
+EN = "The quarterly report is attached. Please review the numbers before Friday and send comments."
+KO = "이번 분기 보고서를 첨부합니다. 금요일 전까지 수치를 검토하시고 의견을 보내 주시기 바랍니다. 회의는 다음 주 화요일에 진행됩니다."
+
+
+def test_words_count_eojeol_once():
+    assert word_count("보고서를 첨부합니다") == 2
+    assert word_count("the report, attached") == 3
+
+
+def test_korean_signoff_joins_english_mail():
+    assert [lang for lang, _ in route_languages(f"Hi team,\n\n{EN}\n\n감사합니다. 김철수 드림")] == ["en"]
+
+
+def test_english_signoff_joins_korean_mail():
+    groups = route_languages(f"{KO}\n\n{KO}\n\nBest regards, John")
+    assert [lang for lang, _ in groups] == ["ko"] and "John" in groups[0][1]
+
+
+def test_real_mixed_mail_keeps_both_groups():
+    groups = route_languages(f"{EN}\n\n{KO}")
+    assert [lang for lang, _ in groups] == ["en", "ko"]
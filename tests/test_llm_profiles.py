@@ -0,0 +1,52 @@
+from llm_profiles import GenerationRun, OutputMonitor, generation_options, parse_ollama_opts
+
+
+def _stream(task, text, step=3):
+    mon = OutputMonitor(task)
+    out = "".join(mon.feed(text[i:i + step]) for i in range(0, len(text), step))
+    return out + mon.flush(), mon.done
+
+
+def test_reply_ends_after_signoff_and_name():
+    text = "Hi Bob,\n\nThe report looks good. I'll send comments.\n\nBest regards,\nAlice\n\nP.S. extra chatter\n"
+    out, done = _stream("reply", text)
+    assert done and out == "Hi Bob,\n\nThe report looks good. I'll send comments.\n\nBest regards,\nAlice"
+
+
+def test_thanks_opening_a_paragraph_is_not_the_end():
+    text = ("Hi,\n\nI checked the numbers.\n\nThanks,\nI will send the updated sheet by Friday.\n\n"
+            "Best,\nKim\n")
+    out, done = _stream("reply", text)
+    assert done and out.endswith("by Friday.\n\nBest,\nKim")
+
+
+def test_signoff_before_any_body_does_not_end():
+    out, done = _stream("reply", "Thanks,\nAlice\nSee the attached file.\n")
+    assert not done and out == "Thanks,\nAlice\nSee the attached file.\n"
+
+
+def test_korean_signed_line_and_held_text_flushed():
+    out, done = _stream("reply", "안녕하세요.\n검토 후 회신드리겠습니다.\n홍길동 드림\n추가 내용")
+    assert done and out.endswith("홍길동 드림")
+    out, done = _stream("reply", "Sounds good.\n\nRegards,\n[Your Name]")
+    assert not done and out.endswith("[Your Name]")
+
+
+def test_summary_stops_at_sentence_count():
+    out, done = _stream("summary", "Budget is set, e.g. for Q3. Launch moved. Team agreed. Extra one.")
+    assert done and out == "Budget is set, e.g. for Q3. Launch moved. Team agreed."
+
+
+def test_generation_options_scale_and_cap():
+    src = "word " * 200
+    en = generation_options("reply", src, lang="en")
+    ko = generation_options("reply", src, lang="ko")
+    assert ko["num_predict"] > en["num_predict"]
+    capped = generation_options("reply", src, parse_ollama_opts("-o num_predict=50 -o stop=Reply:"))
+    assert capped["num_predict"] == 50 and capped["stop"][-1] == "Reply:"
+
+
+def test_run_reports_truncation():
+    run = GenerationRun("translate", "hello")
+    run.feed({"response": "안녕", "done": True, "done_reason": "length", "eval_count": 7})
+    assert run.done and run.truncated and run.tokens == 7
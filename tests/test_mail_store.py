@@ -0,0 +1,58 @@
+import sqlite3
+
+from mail_store import MailStore, index_terms, match_query
+
+
+def _store(tmp_path, items):
+    store = MailStore(str(tmp_path / "mail.sqlite3"))
+    store.upsert(items)
+    return store
+
+
+def _ids(store, q):
+    return [it["message_id"] for it in store.search(q)["items"]]
+
+
+def test_hangul_bigrams_and_single_syllable():
+    assert index_terms("가격값") == "가격 격값 값"
+    assert match_query("가격값") == '"가격 격값"'
+    assert match_query("값") == '"값"*'
+
+
+def test_search_finds_snippet_only_and_korean(tmp_path):
+    store = _store(tmp_path, [
+        {"id": "a", "subject": "Invoice", "sender": "billing", "snippet": "quarterly reconciliation attached"},
+        {"id": "b", "subject": "견적", "sender": "kim", "snippet": "", "text": "이번 달 가격값 조정 안내"},
+        {"id": "c", "subject": "회의", "sender": "lee", "snippet": "", "text": "값이 올랐습니다"},
+    ])
+    assert _ids(store, "reconciliation") == ["a"]
+    assert sorted(_ids(store, "값")) == ["b", "c"]
+    assert _ids(store, "가격") == ["b"]
+    assert _ids(store, "격값 조정") == ["b"]
+
+
+def test_body_fetch_keeps_snippet_indexed(tmp_path):
+    store = _store(tmp_path, [{"id": "a", "subject": "s", "sender": "x", "snippet": "zebra"}])
+    store.upsert([{"id": "a", "subject": "s", "sender": "x", "snippet": "zebra", "text": "giraffe"}])
+    assert _ids(store, "zebra") == ["a"] and _ids(store, "giraffe") == ["a"]
+
+
+def test_old_index_is_rebuilt(tmp_path):
+    path = str(tmp_path / "mail.sqlite3")
+    db = sqlite3.connect(path)
+    db.executescript("""
+        CREATE TABLE messages (rowid INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, thread_id TEXT,
+                               subject TEXT, sender TEXT, date INTEGER, snippet TEXT, body TEXT);
+        CREATE VIRTUAL TABLE messages_fts USING fts5(subject, sender, body);
+        INSERT INTO messages (id, subject, sender, snippet) VALUES ('a', 's', 'x', 'walrus');
+    """)
+    db.close()
+    assert _ids(MailStore(path), "walrus") == ["a"]
+
+
+def test_cursor_pagination(tmp_path):
+    store = _store(tmp_path, [{"id": str(i), "subject": "report", "sender": "x", "snippet": ""} for i in range(5)])
+    first = store.search("report", limit=3)
+    rest = store.search("report", limit=3, cursor=first["next_cursor"])
+    seen = [it["message_id"] for it in first["items"] + rest["items"]]
+    assert sorted(seen) == [str(i) for i in range(5)] and rest["next_cursor"] is None
@@ -0,0 +1,30 @@
+import model_registry
+from model_registry import ModelRegistry
+
+
+def test_lease_counts_loads_on_the_calling_thread():
+    reg = ModelRegistry(budget_mb=100, idle_s=0)
+    reg.register("m", lambda: object())
+    with reg.use("m") as obj:
+        assert obj is not None
+    assert reg.thread_loads() == 1
+    with reg.use("m"):
+        pass
+    assert reg.thread_loads() == 1          # already resident: no load in this lease
+
+
+def test_failed_load_is_retried_after_backoff(monkeypatch):
+    calls = []
+    reg = ModelRegistry(budget_mb=100, idle_s=0)
+    reg.register("m", lambda: calls.append(1) or (object() if len(calls) > 1 else None))
+    now = [1000.0]
+    monkeypatch.setattr(model_registry.time, "time", lambda: now[0])
+    with reg.use("m") as obj:
+        assert obj is None
+    with reg.use("m") as obj:
+        assert obj is None and len(calls) == 1     # backing off
+    assert reg.report()["models"]["m"]["failed"]
+    now[0] += model_registry.LOAD_RETRY_S + 1
+    with reg.use("m") as obj:
+        assert obj is not None and len(calls) == 2
+    assert not reg.report()["models"]["m"]["failed"]
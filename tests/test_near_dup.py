@@ -0,0 +1,35 @@
+from near_dup import NearDupIndex, _restore, volatile_tokens
+
+ALERT = ("Build {n} of project atlas failed on runner {r}. The integration stage reported "
+         "errors in the payment module. See the logs for details and rerun the pipeline "
+         "once the failing tests are fixed.")
+
+
+def _index(tmp_path):
+    return NearDupIndex(str(tmp_path / "nd.sqlite3"))
+
+
+def test_identical_sentiment_is_reused(tmp_path):
+    idx = _index(tmp_path)
+    text = ALERT.format(n=41, r=7)
+    label = {"label": "1 star", "score": 0.91, "mapped_category": "negative"}
+    idx.add("sentiment", text, label, 120.0)
+    assert idx.lookup("sentiment", text) == label
+    assert idx.stats()["hits"] == 1 and idx.stats()["rejected"] == 0
+
+
+def test_summary_values_are_swapped(tmp_path):
+    idx = _index(tmp_path)
+    idx.add("summary", ALERT.format(n=41, r=7), "Build 41 failed on runner 7 (5 stars).", 300.0)
+    assert idx.lookup("summary", ALERT.format(n=42, r=9)) == "Build 42 failed on runner 9 (5 stars)."
+
+
+def test_restore_leaves_model_values_alone():
+    assert _restore("Build 41: 3 tests", ["41"], ["42"]) == "Build 42: 3 tests"
+    assert _restore({"label": "5 stars"}, ["5"], ["6"]) == {"label": "5 stars"}
+
+
+def test_restore_rejects_ambiguous_values():
+    cached, current = volatile_tokens("id 7 then 7"), volatile_tokens("id 7 then 8")
+    assert _restore("id 7", cached, current) is None
+    assert _restore("no values", cached, current) == "no values"
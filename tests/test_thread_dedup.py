@@ -0,0 +1,23 @@
+from thread_dedup import ThreadDeduper
+
+FIRST = "Can we move the launch review to Thursday afternoon?"
+REPLY = ("Thursday at 3pm works for me, see you then.\n\n"
+         "On Mon, Alice <alice@example.com> wrote:\n> " + FIRST)
+
+
+def test_quoted_history_is_dropped():
+    d = ThreadDeduper()
+    assert d.dedup("t", "m1", FIRST, 1) == FIRST
+    assert d.dedup("t", "m2", REPLY, 2) == "Thursday at 3pm works for me, see you then."
+    # Re-processing and out-of-order arrival give the same text
+    assert d.dedup("t", "m2", REPLY, 2) == "Thursday at 3pm works for me, see you then."
+
+
+def test_registered_messages_are_not_counted():
+    d = ThreadDeduper()
+    assert not d.has_thread("t")
+    d.register("t", "m1", FIRST, 1)
+    assert d.has_thread("t") and d.stats()["chars_in"] == 0
+    out = d.dedup("t", "m2", REPLY, 2)
+    assert out == "Thursday at 3pm works for me, see you then."
+    assert d.stats()["chars_in"] == len(REPLY) and d.stats()["chars_out"] == len(out)
@@ -0,0 +1,35 @@
+from translate_pipeline import SEGMENT_TOKENS, approx_tokens, assemble, split_segments
+
+
+def _check(text, budget=SEGMENT_TOKENS):
+    segs = split_segments(text, budget)
+    assert "".join(seg + sep for seg, sep in segs) == text
+    assert all(approx_tokens(seg) <= budget + 1 for seg, _ in segs)
+    return segs
+
+
+def test_paragraphs_are_packed_and_round_trip():
+    text = "Hello team.\n\nFirst point here.\n\nSecond point."
+    assert _check(text) == [("Hello team.\n\nFirst point here.\n\nSecond point.", "")]
+
+
+def test_unpunctuated_text_is_split_on_whitespace():
+    segs = _check(" ".join(["word"] * 1250))            # ~5000 chars, no sentence boundary
+    assert len(segs) > 1
+
+
+def test_lines_and_unbroken_text_are_split():
+    assert len(_check("\n".join(["line of text without stops"] * 200))) > 1
+    assert len(_check("가" * 1000)) > 1
+
+
+def test_assemble_reports_partial_and_total_failure():
+    segs = [("a", "\n\n"), ("b", "")]
+    assert assemble(segs, ["A", "b"], [1]) == {"translated": "A\n\nb", "partial": True, "failed_segments": [1]}
+    assert assemble(segs, ["a", "b"], [1, 0])["failed_segments"] == [0, 1]
+
+
+def test_long_paragraph_between_short_ones():
+    text = "Intro.\n\n" + " ".join(["word"] * 1250) + "\n\nOutro line."
+    segs = _check(text)
+    assert segs[-1][0].endswith("Outro line.")
@@ -0,0 +1,39 @@
+import numpy as np
+
+import vector_index
+from vector_index import VectorIndex, _l2_normalize
+
+
+def _vecs(n, dim=8, seed=0):
+    return _l2_normalize(np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32))
+
+
+def test_superseded_and_excluded_rows_are_skipped(tmp_path):
+    idx = VectorIndex(str(tmp_path))
+    v = _vecs(4)
+    idx.add([{"id": str(i)} for i in range(4)], v)
+    idx.add([{"id": "0", "source": "body"}], -v[:1])       # re-embedded, now far from v[0]
+    res = idx.search(v[0], k=4, exclude="1")["results"]
+    assert [r["id"] for r in res].count("0") <= 1 and all(r["id"] != "1" for r in res)
+    assert len(res) == 3 and idx.stale == 1
+
+
+def test_ivf_lists_drop_superseded_rows(tmp_path):
+    idx = VectorIndex(str(tmp_path), ivf_threshold=64)
+    v = _vecs(300)
+    idx.add([{"id": str(i)} for i in range(300)], v)
+    idx.add([{"id": "5", "source": "body"}], v[5:6])
+    assert idx.search(v[5], k=3)["mode"] == "ivf"
+    assert sum(len(lst) for lst in idx._lists) == len(idx.ids)
+    assert idx.search(v[5], k=1)["results"][0]["source"] == "body"
+
+
+def test_compaction_survives_reload(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_index, "COMPACT_MIN_STALE", 1)
+    idx = VectorIndex(str(tmp_path))
+    v = _vecs(8)
+    idx.add([{"id": str(i)} for i in range(8)], v)
+    idx.add([{"id": str(i), "source": "body"} for i in range(3)], v[:3])
+    assert idx.stale == 0 and len(idx) == 8
+    again = VectorIndex(str(tmp_path))
+    assert again.search(v[2], k=1)["results"][0] == {"id": "2", "source": "body", "score": 1.0}
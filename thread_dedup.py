@@ -0,0 +1,148 @@
+# thread_dedup.py
+# Thread-aware quoted-text deduplication.
+# Reply chains carry the full quoted history; only paragraphs not already seen
+# earlier in the same Gmail thread are passed on to the models.
+
+import re
+import hashlib
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+PARA_SPLIT_RE = re.compile(r"\n[ \t>]*\n")   # blank lines, including quoted ">" blanks
+QUOTE_PREFIX_RE = re.compile(r"^\s*(>\s*)+")
+ATTRIBUTION_RE = re.compile(
+    r"^\s*(on\s.+\swrote:|-+\s*original message\s*-+|.+\s작성:)\s*$",
+    re.IGNORECASE,
+)
+ATTRIBUTION_LINE_RE = re.compile(ATTRIBUTION_RE.pattern, re.IGNORECASE | re.MULTILINE)
+
+MIN_LINE_CHARS = 12      # shorter lines ("Thanks,", "Hi") are too generic to fingerprint alone
+MAX_THREADS = 2000       # per-thread fingerprint sets kept in memory (LRU)
+
+
+def _normalize(s: str) -> str:
+    lines = [QUOTE_PREFIX_RE.sub("", ln) for ln in s.splitlines()]
+    return " ".join(" ".join(lines).split()).lower()
+
+
+def _fingerprint(s: str) -> bytes:
+    return hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest()
+
+
+class ThreadDeduper:
+    """
+    Per-thread paragraph fingerprint cache.
+    - A fingerprint belongs to the oldest message that contains it (by timestamp,
+      or by arrival order when none is given), so messages can be fed in any
+      order and re-processing the same message returns the same text
+    """
+
+    def __init__(self, max_threads: int = MAX_THREADS):
+        self.max_threads = max_threads
+        self._threads: "OrderedDict[str, Dict[bytes, Tuple[float, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.chars_in = 0
+        self.chars_out = 0
+
+    def _owners(self, thread_id: str) -> Dict[bytes, Tuple[float, str]]:
+        owners = self._threads.get(thread_id)
+        if owners is None:
+            owners = {}
+            self._threads[thread_id] = owners
+            while len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+        else:
+            self._threads.move_to_end(thread_id)
+        return owners
+
+    def has_thread(self, thread_id: str) -> bool:
+        """False for a thread not seen since start-up (or evicted): its stored messages need register()"""
+        with self._lock:
+            return thread_id in self._threads
+
+    def register(self, thread_id: Optional[str], message_id: str, text: str,
+                 timestamp: Optional[float] = None):
+        """Claim the paragraphs of an already processed message; not counted in stats()"""
+        self._dedup(thread_id, message_id, text, timestamp, count=False)
+
+    def dedup(self, thread_id: Optional[str], message_id: str, text: str,
+              timestamp: Optional[float] = None) -> str:
+        """
+        Return only the paragraphs of text not contained in an earlier message of the thread.
+        timestamp: message date (e.g. Gmail internalDate); arrival time if omitted
+        """
+        return self._dedup(thread_id, message_id, text, timestamp, count=True)
+
+    def _dedup(self, thread_id: Optional[str], message_id: str, text: str,
+               timestamp: Optional[float], count: bool) -> str:
+        text = (text or "").strip()
+        if not thread_id or not text:
+            return text
+
+        # Attribution lines become their own paragraph so the quote below can be matched alone
+        split_text = ATTRIBUTION_LINE_RE.sub(lambda m: f"\n\n{m.group(0).strip()}\n\n", text)
+        paras = [p for p in PARA_SPLIT_RE.split(split_text) if p.strip()]
+        kept: List[str] = []
+
+        with self._lock:
+            owners = self._owners(thread_id)
+            me = (float(timestamp) if timestamp is not None else time.time() * 1000, message_id)
+
+            def seen(fp: bytes) -> bool:
+                owner = owners.get(fp)
+                return owner is not None and owner[1] != message_id and owner < me
+
+            def claim(fp: bytes):
+                owner = owners.get(fp)
+                if owner is None or me < owner:
+                    owners[fp] = me
+
+            for para in paras:
+                norm = _normalize(para)
+                if not norm:
+                    continue
+                para_fp = _fingerprint(norm)
+                line_fps = [_fingerprint(n) for n in
+                            (_normalize(ln) for ln in para.splitlines())
+                            if len(n) >= MIN_LINE_CHARS]
+
+                # Drop if the paragraph, or every substantive line of it, is already known
+                duplicate = seen(para_fp) or (bool(line_fps) and all(seen(fp) for fp in line_fps))
+
+                claim(para_fp)
+                for fp in line_fps:
+                    claim(fp)
+
+                if duplicate:
+                    # The "On ... wrote:" line introducing dropped history goes too
+                    if kept:
+                        lines = kept[-1].splitlines()
+                        if ATTRIBUTION_RE.match(lines[-1]):
+                            rest = "\n".join(lines[:-1]).strip()
+                            if rest:
+                                kept[-1] = rest
+                            else:
+                                kept.pop()
+                    continue
+                kept.append(para.strip("\n"))
+
+            out = "\n\n".join(kept).strip()
+            if count:
+                self.chars_in += len(text)
+                self.chars_out += len(out)
+        return out
+
+    def stats(self) -> dict:
+        with self._lock:
+            saved = self.chars_in - self.chars_out
+            return {
+                "threads": len(self._threads),
+                "chars_in": self.chars_in,
+                "chars_out": self.chars_out,
+                "saved_ratio": round(saved / self.chars_in, 4) if self.chars_in else 0.0,
+            }
+
+
+thread_deduper = ThreadDeduper()
@@ -0,0 +1,217 @@
+# translate_pipeline.py
+# Chunked translation for long emails.
+# - Split on paragraph, then sentence boundaries to fit a token budget (a sentence still over
+#   budget is split on newlines, then whitespace, so no segment is cut off by the output cap)
+# - Translate segments with bounded parallelism, reassemble in order with the original separators
+# - Cache segment translations so repeated boilerplate is translated once
+
+import re
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, as_completed
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+SEGMENT_TOKENS = 350        # per-segment budget (approximate tokens)
+CACHE_SIZE = 2000
+
+_PARA_RE = re.compile(r"(\n\s*\n)")
+_SENT_RE = re.compile(r"(?<=[\.\?\!。])(\s+)")
+_NL_RE = re.compile(r"(\n+)")
+_WS_RE = re.compile(r"(\s+)")
+_HANGUL_RE = re.compile(r"[가-힣]")
+_LETTER_RE = re.compile(r"[^\W\d_]", re.UNICODE)
+
+
+def approx_tokens(text: str) -> int:
+    # Hangul is roughly one token per syllable, Latin text roughly four characters per token
+    hangul = len(_HANGUL_RE.findall(text))
+    return hangul + (len(text) - hangul) // 4 + 1
+
+
+def needs_translation(segment: str) -> bool:
+    """Segments without letters (numbers, separators, bare punctuation) pass through untouched"""
+    return bool(_LETTER_RE.search(segment))
+
+
+def _pack(pieces: List[str], budget: int) -> List[Tuple[str, str]]:
+    """pieces alternate [text, sep, text, sep, ...]; pack texts up to budget, keep seps verbatim"""
+    out: List[Tuple[str, str]] = []
+    buf, buf_tokens = "", 0
+    for i in range(0, len(pieces), 2):
+        text = pieces[i]
+        sep = pieces[i + 1] if i + 1 < len(pieces) else ""
+        t = approx_tokens(text)
+        if buf and buf_tokens + t > budget:
+            body, tail = buf.rstrip(), buf[len(buf.rstrip()):]
+            out.append((body, tail))
+            buf, buf_tokens = "", 0
+        buf += text + sep
+        buf_tokens += t
+    if buf:
+        body = buf.rstrip()
+        out.append((body, buf[len(body):]))
+    return out
+
+
+def _refine(pieces: List[str], split: Callable[[str], List[str]], budget: int) -> List[str]:
+    """Re-split the texts of [text, sep, text, ...] that are still over budget; seps stay verbatim"""
+    out: List[str] = []
+    for i in range(0, len(pieces), 2):
+        text = pieces[i]
+        out.extend(split(text) if approx_tokens(text) > budget else [text])
+        if i + 1 < len(pieces):
+            out.append(pieces[i + 1])
+    return out
+
+
+def _chunks(text: str, budget: int) -> List[str]:
+    # Last resort for text without any whitespace: fixed slices (one char is at most one token)
+    out: List[str] = []
+    for i in range(0, len(text), budget):
+        out.extend([text[i:i + budget], ""])
+    return out[:-1] or [text]
+
+
+def split_segments(text: str, budget: int = SEGMENT_TOKENS) -> List[Tuple[str, str]]:
+    """
+    Return [(segment, separator_after)] such that "".join(seg + sep) == text.
+    Paragraphs are packed together up to budget; longer paragraphs split on sentences.
+    """
+    pieces = _PARA_RE.split(text or "")
+    expanded: List[str] = []
+    for i in range(0, len(pieces), 2):
+        para = pieces[i]
+        sep = pieces[i + 1] if i + 1 < len(pieces) else ""
+        if approx_tokens(para) > budget:
+            sents = _SENT_RE.split(para)  # [sent, ws, sent, ..., sent]
+            for split in (_NL_RE.split, _WS_RE.split, lambda t: _chunks(t, budget)):
+                sents = _refine(sents, split, budget)
+            expanded.extend(sents)
+            expanded.append(sep)
+        else:
+            expanded.extend([para, sep])
+    return [(seg, sep) for seg, sep in _pack(expanded, budget) if seg or sep]
+
+
+def assemble(segments: List[Tuple[str, str]], parts: List[str], failed: List[int]) -> Dict:
+    """
+    Reassemble translated parts with the original separators.
+    failed: indices that kept their source text; reported so a partial result is not
+    presented as a full translation ("partial"), all-failed becomes an error message.
+    """
+    failed = sorted(failed)
+    if failed and len(failed) == sum(1 for seg, _ in segments if needs_translation(seg)):
+        return {"translated": "⚠️ LLM translation failed.", "partial": False, "failed_segments": failed}
+    return {"translated": "".join(p + sep for p, (_, sep) in zip(parts, segments)).strip(),
+            "partial": bool(failed), "failed_segments": failed}
+
+
+class SegmentCache:
+    """Thread-safe LRU of (target_lang, segment) -> translation"""
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self._data: "OrderedDict[bytes, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(target: str, segment: str) -> bytes:
+        norm = " ".join(segment.split())
+        return hashlib.blake2b(f"{target}\x00{norm}".encode("utf-8"), digest_size=16).digest()
+
+    def get(self, target: str, segment: str) -> Optional[str]:
+        k = self._key(target, segment)
+        with self._lock:
+            v = self._data.get(k)
+            if v is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(k)
+            self.hits += 1
+            return v
+
+    def put(self, target: str, segment: str, translation: str):
+        k = self._key(target, segment)
+        with self._lock:
+            self._data[k] = translation
+            self._data.move_to_end(k)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+
+def translate_segments(segments: List[Tuple[str, str]], target: str,
+                       translate_fn: Callable[[str, str], str], executor: Executor,
+                       cache: SegmentCache) -> Iterator[Tuple[int, str, bool]]:
+    """
+    Yield (index, translation, ok) as each segment finishes (not necessarily in order).
+    translate_fn(segment, target) raises on failure; failed segments yield the source text.
+    """
+    futures, ready = {}, []
+    for i, (seg, _) in enumerate(segments):
+        if not needs_translation(seg):
+            ready.append((i, seg))
+            continue
+        hit = cache.get(target, seg)
+        if hit is not None:
+            ready.append((i, hit))
+            continue
+        futures[executor.submit(translate_fn, seg, target)] = i
+
+    # Everything is submitted before the first yield so a slow consumer never delays work;
+    # a consumer that stops early (closed stream) cancels the segments not started yet
+    try:
+        for i, out in ready:
+            yield i, out, True
+        for fut in as_completed(futures):
+            i = futures[fut]
+            seg = segments[i][0]
+            try:
+                out = fut.result()
+                cache.put(target, seg, out)
+                yield i, out, True
+            except Exception as e:
+                print(f"[translate] segment {i} failed -> source kept: {e}")
+                yield i, seg, False
+    finally:
+        for fut in futures:
+            fut.cancel()
+
+
+async def atranslate_segments(segments: List[Tuple[str, str]], target: str,
+                              translate_fn: Callable[[str, str], Awaitable[str]], concurrency: int,
+                              cache: SegmentCache) -> AsyncIterator[Tuple[int, str, bool]]:
+    """translate_segments() for coroutines: at most `concurrency` segments in flight."""
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(i: int, seg: str):
+        async with sem:
+            try:
+                out = await translate_fn(seg, target)
+                cache.put(target, seg, out)
+                return i, out, True
+            except Exception as e:
+                print(f"[translate] segment {i} failed -> source kept: {e}")
+                return i, seg, False
+
+    tasks, ready = [], []
+    for i, (seg, _) in enumerate(segments):
+        if not needs_translation(seg):
+            ready.append((i, seg))
+            continue
+        hit = cache.get(target, seg)
+        if hit is not None:
+            ready.append((i, hit))
+            continue
+        tasks.append(asyncio.ensure_future(run(i, seg)))
+    try:
+        for i, out in ready:
+            yield i, out, True
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        for t in tasks:
+            t.cancel()
@@ -0,0 +1,356 @@
+# vector_index.py
+# Local vector index for similar-email retrieval.
+# - Embeddings: small CPU sentence encoder, mean-pooled, batched
+# - Storage: append-only float32 file read back as a NumPy memmap + JSONL metadata
+# - Search: exact top-k (one matrix-vector product), IVF above IVF_THRESHOLD vectors
+#   (k-means retraining runs on a snapshot outside the lock; searches keep using the old lists)
+# - Superseded rows (an id re-embedded from its body) are masked out of search and dropped
+#   from the IVF lists; both files are compacted once they make up COMPACT_FRACTION of the rows
+
+import os
+import json
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+VECTOR_DIR = os.getenv("VECTOR_DIR", "vector_index")
+EMBED_BATCH = 32
+EMBED_MAX_TOKENS = 256
+IVF_THRESHOLD = int(os.getenv("VECTOR_IVF_THRESHOLD", "50000"))  # switch to approximate search above this
+IVF_NPROBE = 8
+KMEANS_ITERS = 10
+KMEANS_SAMPLE = 20000
+COMPACT_FRACTION = float(os.getenv("VECTOR_COMPACT_FRACTION", "0.25"))
+COMPACT_MIN_STALE = 1000     # smaller indexes are not worth rewriting
+
+
+class SentenceEncoder:
+    """Mean-pooled transformer embeddings (loaded lazily on first use)"""
+
+    def __init__(self, model_name: str = EMBED_MODEL):
+        self.model_name = model_name
+        self._tok = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._model is None:
+            from transformers import AutoTokenizer, AutoModel
+            self._tok = AutoTokenizer.from_pretrained(self.model_name)
+            self._model = AutoModel.from_pretrained(self.model_name).eval()
+            print(f"[load] embeddings <- {self.model_name}")
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        import torch
+        with self._lock:
+            self.load()
+            out = []
+            for i in range(0, len(texts), EMBED_BATCH):
+                batch = [t or "" for t in texts[i:i + EMBED_BATCH]]
+                enc = self._tok(batch, padding=True, truncation=True,
+                                max_length=EMBED_MAX_TOKENS, return_tensors="pt")
+                with torch.no_grad():
+                    hidden = self._model(**enc).last_hidden_state
+                mask = enc["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                out.append(pooled.cpu().numpy().astype(np.float32))
+        vecs = np.concatenate(out, axis=0) if out else np.zeros((0, 0), dtype=np.float32)
+        return _l2_normalize(vecs)
+
+
+def _l2_normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def _kmeans(mat: np.ndarray):
+    """(centroids, list number of each row) for the rows of mat"""
+    n = len(mat)
+    nlist = max(16, int(np.sqrt(n)))
+    rng = np.random.default_rng(0)
+    sample = mat[rng.choice(n, size=min(n, KMEANS_SAMPLE), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERS):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = sample[assign == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+        centroids = _l2_normalize(centroids)
+
+    assign = np.empty(n, dtype=np.int64)
+    for i in range(0, n, 8192):
+        assign[i:i + 8192] = np.argmax(mat[i:i + 8192] @ centroids.T, axis=1)
+    return centroids, assign
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+class VectorIndex:
+    """
+    Append-only on-disk index: <dir>/vectors.f32 (row-major float32) + <dir>/meta.jsonl.
+    Rows are L2-normalised, so the dot product is the cosine similarity.
+    Vectors are written before their metadata; on load, rows without metadata (a crash
+    between the two writes) are truncated so later appends stay aligned.
+    Re-adding an id (e.g. the full body after a snippet) appends a new row; the latest row
+    of an id wins and older ones are masked out of search until the next compaction.
+    Compaction writes both files to *.compact, then a compact.ok marker, then swaps them in;
+    an interrupted swap is finished on the next load.
+    """
+
+    def __init__(self, path: str = VECTOR_DIR, ivf_threshold: int = IVF_THRESHOLD):
+        self.path = path
+        self.ivf_threshold = ivf_threshold
+        self.vec_file = os.path.join(path, "vectors.f32")
+        self.meta_file = os.path.join(path, "meta.jsonl")
+        self._compact_marker = os.path.join(path, "compact.ok")
+        self._lock = threading.RLock()
+        self.dim = 0
+        self.meta: List[dict] = []
+        self.ids: Dict[str, int] = {}
+        self._mat: Optional[np.ndarray] = None
+        self._dead = np.zeros(0, dtype=bool)     # superseded rows
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[List[int]] = []         # live rows per IVF list
+        self._assign: List[int] = []              # IVF list of every row
+        self._ivf_trained_at = 0
+        self._training = False
+
+        os.makedirs(path, exist_ok=True)
+        self._recover_compaction()
+        if os.path.exists(self.meta_file):
+            self._load_meta()
+        self._repair()
+        self._dead = np.ones(len(self.meta), dtype=bool)
+        self._dead[list(self.ids.values())] = False
+        self._remap()
+        self._maybe_train()
+
+    def _load_meta(self):
+        torn = False
+        with open(self.meta_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    m = json.loads(line)
+                except json.JSONDecodeError:
+                    torn = True          # partial last line from an interrupted write
+                    break
+                self.ids[m["id"]] = len(self.meta)
+                self.meta.append(m)
+        if self.meta:
+            self.dim = int(self.meta[0].get("dim", 0))
+        if torn:
+            self._rewrite_meta()
+
+    def _write_meta(self, path: str, meta: List[dict]):
+        with open(path, "w", encoding="utf-8") as f:
+            for m in meta:
+                f.write(json.dumps(m, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _rewrite_meta(self):
+        tmp = self.meta_file + ".tmp"
+        self._write_meta(tmp, self.meta)
+        os.replace(tmp, self.meta_file)
+
+    def _recover_compaction(self):
+        """Finish a compaction whose files were complete (marker written), else discard it"""
+        pending = [(self.vec_file + ".compact", self.vec_file), (self.meta_file + ".compact", self.meta_file)]
+        if os.path.exists(self._compact_marker):
+            for tmp, dst in pending:
+                if os.path.exists(tmp):
+                    os.replace(tmp, dst)
+            os.remove(self._compact_marker)
+        else:
+            for tmp, _ in pending:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+    def _repair(self):
+        """Make vectors.f32 hold exactly one row per metadata line"""
+        if not os.path.exists(self.vec_file):
+            if self.meta:
+                print(f"[vector] {self.vec_file} missing: dropping {len(self.meta)} metadata rows")
+                self.meta, self.ids = [], {}
+                self._rewrite_meta()
+            return
+        row_bytes = self.dim * 4
+        size = os.path.getsize(self.vec_file)
+        if not self.meta or not row_bytes:
+            if size:
+                os.truncate(self.vec_file, 0)
+            return
+        rows = size // row_bytes
+        if rows < len(self.meta):
+            # Metadata without vectors: keep the rows that have both
+            print(f"[vector] {len(self.meta) - rows} metadata rows without vectors dropped")
+            self.meta = self.meta[:rows]
+            self.ids = {m["id"]: i for i, m in enumerate(self.meta)}
+            self._rewrite_meta()
+        if size != len(self.meta) * row_bytes:
+            print(f"[vector] truncating {self.vec_file} to {len(self.meta)} rows")
+            os.truncate(self.vec_file, len(self.meta) * row_bytes)
+
+    def __len__(self):
+        return len(self.meta)
+
+    def _remap(self):
+        n = len(self.meta)
+        if n and self.dim and os.path.exists(self.vec_file):
+            self._mat = np.memmap(self.vec_file, dtype=np.float32, mode="r", shape=(n, self.dim))
+        else:
+            self._mat = None
+
+    def has(self, doc_id: str) -> bool:
+        return doc_id in self.ids
+
+    def source(self, doc_id: str) -> Optional[str]:
+        """What the stored vector was embedded from ("snippet" / "body"), None if not indexed"""
+        with self._lock:
+            row = self.ids.get(doc_id)
+            return None if row is None else self.meta[row].get("source", "snippet")
+
+    @property
+    def stale(self) -> int:
+        """Superseded rows still in the files"""
+        return len(self.meta) - len(self.ids)
+
+    def add(self, docs: List[dict], vecs: np.ndarray):
+        """docs: [{"id": ..., plus any metadata}], vecs: (len(docs), dim) normalised float32"""
+        if not docs:
+            return
+        vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+        with self._lock:
+            if not self.dim:
+                self.dim = int(vecs.shape[1])
+            start = len(self.meta)
+            with open(self.vec_file, "ab") as f:
+                f.write(vecs.tobytes())
+            self._dead = np.concatenate([self._dead, np.zeros(len(docs), dtype=bool)])
+            if self._centroids is not None:
+                for v in vecs:
+                    self._assign.append(int(np.argmax(self._centroids @ v)))
+            with open(self.meta_file, "a", encoding="utf-8") as f:
+                for i, d in enumerate(docs):
+                    m = dict(d, dim=self.dim)
+                    old = self.ids.get(m["id"])
+                    if old is not None:
+                        self._dead[old] = True
+                        if self._centroids is not None and old < len(self._assign):
+                            self._lists[self._assign[old]].remove(old)
+                    self.ids[m["id"]] = start + i
+                    self.meta.append(m)
+                    f.write(json.dumps(m, ensure_ascii=False) + "\n")
+                    if self._centroids is not None:
+                        self._lists[self._assign[start + i]].append(start + i)
+            self._remap()
+            self._maybe_compact()
+        self._maybe_train()
+
+    def _maybe_compact(self):
+        """Rewrite both files without superseded rows (caller holds the lock)"""
+        stale = self.stale
+        if self._training or stale < COMPACT_MIN_STALE or stale < COMPACT_FRACTION * len(self.meta):
+            return
+        live = np.flatnonzero(~self._dead)
+        with open(self.vec_file + ".compact", "wb") as f:
+            for i in range(0, len(live), 8192):
+                f.write(np.ascontiguousarray(self._mat[live[i:i + 8192]]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        meta = [self.meta[r] for r in live]
+        self._write_meta(self.meta_file + ".compact", meta)
+        open(self._compact_marker, "w").close()
+        self._mat = None
+        self._recover_compaction()
+
+        new_row = np.full(len(self.meta), -1, dtype=np.int64)
+        new_row[live] = np.arange(len(live))
+        self.meta = meta
+        self.ids = {m["id"]: i for i, m in enumerate(meta)}
+        self._dead = np.zeros(len(meta), dtype=bool)
+        if self._centroids is not None:
+            self._lists = [[int(new_row[r]) for r in lst] for lst in self._lists]
+            self._assign = [self._assign[r] for r in live]
+            self._ivf_trained_at = min(self._ivf_trained_at, len(meta))
+        self._remap()
+        print(f"[vector] compacted: {stale} superseded rows removed, {len(meta)} kept")
+
+    def _maybe_train(self):
+        """(Re)train IVF when due: k-means runs on a snapshot without holding the lock"""
+        with self._lock:
+            n = len(self.meta)
+            due = n >= self.ivf_threshold and (self._centroids is None or n >= 2 * self._ivf_trained_at)
+            if not due or self._training or self._mat is None:
+                return
+            self._training = True
+            snapshot = self._mat            # rows 0..n-1 never change (append-only)
+        try:
+            centroids, assign = _kmeans(np.asarray(snapshot))
+        except Exception:
+            with self._lock:
+                self._training = False
+            raise
+        with self._lock:
+            # Rows appended while training go to their nearest new centroid
+            assign = assign.tolist()
+            for row in range(n, len(self.meta)):
+                assign.append(int(np.argmax(centroids @ self._mat[row])))
+            lists: List[List[int]] = [[] for _ in range(len(centroids))]
+            for row in np.flatnonzero(~self._dead):
+                lists[assign[row]].append(int(row))
+            self._centroids, self._lists, self._assign, self._ivf_trained_at = centroids, lists, assign, n
+            self._training = False
+        print(f"[vector] IVF trained: {len(lists)} lists over {n} vectors")
+
+    def search(self, q: np.ndarray, k: int = 5, exclude: Optional[str] = None) -> dict:
+        with self._lock:
+            if self._mat is None or not len(self.meta):
+                return {"mode": "exact", "results": []}
+            q = _l2_normalize(np.asarray(q, dtype=np.float32).reshape(-1))
+            skip = self.ids.get(exclude) if exclude else None
+
+            if self._centroids is not None:
+                # IVF lists hold live rows only
+                mode = "ivf"
+                probes = _top_k(self._centroids @ q, IVF_NPROBE)
+                rows = np.fromiter((r for c in probes for r in self._lists[c]), dtype=np.int64)
+                scores = self._mat[rows] @ q
+                if skip is not None:
+                    scores[rows == skip] = -np.inf
+                top = _top_k(scores, k)
+                order, best = rows[top], scores[top]
+            else:
+                mode = "exact"
+                scores = self._mat @ q
+                scores[self._dead] = -np.inf
+                if skip is not None:
+                    scores[skip] = -np.inf
+                order = _top_k(scores, k)
+                best = scores[order]
+
+            results = []
+            for row, score in zip(order.tolist(), best.tolist()):
+                if score == -np.inf:
+                    break
+                r = {key: val for key, val in self.meta[row].items() if key != "dim"}
+                r["score"] = round(score, 4)
+                results.append(r)
+            return {"mode": mode, "results": results}
+
+    def vector(self, doc_id: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self.ids.get(doc_id)
+            return None if row is None or self._mat is None else np.array(self._mat[row])